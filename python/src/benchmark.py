@@ -0,0 +1,692 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import subprocess
+import tempfile
+import time
+import traceback
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch import nn
+from torch.utils.data import DataLoader, Subset
+import feedforward
+import losses
+import pose_dataset
+import rotations_numpy
+import rotations_torch as rot
+import spring
+import spring_torch
+import synthetic_data
+import trackers_info_dataset
+import train_direction
+
+# Standing benchmarks of the python/src pipeline on synthetic data. Results
+# (median and minimum seconds per operation) are written as JSON, a previous
+# output can be given as baseline to detect regressions:
+#   python src/benchmark.py --output data/benchmark_baseline.json
+#   python src/benchmark.py --baseline data/benchmark_baseline.json
+
+default_settings = {
+    "repeats": 5,  # measurements per benchmark (the median is reported)
+    "joints": 24,
+    "loader_poses": 2000,  # the in-memory loaders read float by float
+    "memmap_poses": 100000,
+    "rotation_batch": 65536,
+    "loss_batch": 4096,
+    "train_poses": 20000,
+    "train_batch_sizes": [32, 256, 1024],
+    "train_rollouts": [1, 10, 50],
+    "train_steps": 5,  # optimizer steps per measurement
+    # Gradient checkpointing of the rollout (each one in a new process to
+    # measure its peak memory), segment 0 is without checkpointing
+    "checkpoint_rollouts": [50, 200, 500],
+    "checkpoint_segments": [0, 10, 50],
+    "checkpoint_batch_size": 256,
+    "hidden_size": 32,
+    "number_hidden_layers": 2,
+    "inference_calls": 1000,  # calls per measurement
+    "spring_sessions": [1, 128],
+    "spring_frames": 600,
+    "threshold": 0.2,  # relative change to report slower/faster
+}
+
+
+def measure(function, repeats, warmup=1, number=1):
+    # Median and minimum seconds of one call ('number' calls per measurement)
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {"seconds": float(np.median(times)), "min_seconds": float(np.min(times))}
+
+
+class benchmark_data:
+    # Synthetic databases written once to a temporary folder
+    def __init__(self, settings):
+        self.folder = tempfile.TemporaryDirectory()
+        path = self.folder.name
+        J = settings["joints"]
+        self.small = synthetic_data.write_ms_data(
+            path, "Small", settings["loader_poses"], J
+        )
+        self.large = synthetic_data.write_ms_data(
+            path, "Large", settings["memmap_poses"], J, seed=1
+        )
+        self.training = synthetic_data.write_ms_data(
+            path, "TrainingMSData", settings["train_poses"], J, seed=2
+        )
+
+    def files(self, folder):
+        name = os.path.basename(os.path.normpath(folder))
+        return (
+            os.path.join(folder, name + ".mstrackers"),
+            os.path.join(folder, name + ".mspose"),
+        )
+
+
+def bench_loaders(settings, data, device):
+    repeats = settings["repeats"]
+    small_trackers, small_poses = data.files(data.small)
+    large_trackers, large_poses = data.files(data.large)
+    loaders = [
+        ("pose_dataset", pose_dataset.pose_dataset, small_poses, {}),
+        (
+            "trackers_info_dataset",
+            trackers_info_dataset.trackers_info_dataset,
+            small_trackers,
+            {},
+        ),
+        (
+            "pose_dataset_memmap",
+            pose_dataset.pose_dataset,
+            large_poses,
+            {"memmap": True},
+        ),
+        (
+            "trackers_info_dataset_memmap",
+            trackers_info_dataset.trackers_info_dataset,
+            large_trackers,
+            {"memmap": True},
+        ),
+        (
+            "pose_dataset_mean_std",
+            pose_dataset.pose_dataset,
+            large_poses,
+            {"only_mean_std": True},
+        ),
+        (
+            "trackers_info_dataset_mean_std",
+            trackers_info_dataset.trackers_info_dataset,
+            large_trackers,
+            {"only_mean_std": True},
+        ),
+    ]
+    for name, loader, path, kwargs in loaders:
+        frames = (
+            settings["loader_poses"]
+            if path in (small_poses, small_trackers)
+            else settings["memmap_poses"]
+        )
+        result = measure(lambda: loader(path, **kwargs), repeats)
+        result["frames_per_second"] = frames / result["seconds"]
+        yield "loaders/" + name, result
+
+
+def bench_rotations(settings, data, device):
+    n = settings["rotation_batch"]
+    generator = torch.Generator().manual_seed(0)
+    quaternions = nn.functional.normalize(
+        torch.randn(n, 4, generator=generator), dim=-1
+    ).to(device)
+    continuous = rot.quat_to_continuous(quaternions)
+    matrices = rot.quat_to_matrix3x3(quaternions)
+    functions = [
+        ("continuous_to_quat", lambda: rot.continuous_to_quat(continuous)),
+        ("continuous_to_mat", lambda: rot.continuous_to_mat(continuous)),
+        ("quat_to_continuous", lambda: rot.quat_to_continuous(quaternions)),
+        ("quat_to_matrix3x3", lambda: rot.quat_to_matrix3x3(quaternions)),
+        ("matrix3x3_to_quat", lambda: rot.matrix3x3_to_quat(matrices)),
+        ("mul_quat", lambda: rot.mul_quat(quaternions, quaternions)),
+        ("mul_rot_mat", lambda: rot.mul_rot_mat(matrices, matrices)),
+    ]
+    for name, function in functions:
+        result = measure(lambda: synchronize(function(), device), settings["repeats"])
+        result["rotations_per_second"] = n / result["seconds"]
+        yield "rotations_torch/" + name, result
+
+
+def bench_dot_loss(settings, data, device):
+    n = settings["loss_batch"]
+    generator = torch.Generator().manual_seed(0)
+    mean = np.zeros(6, dtype=np.float32)
+    std = np.ones(6, dtype=np.float32)
+    loss_fn = losses.dot_loss(mean, std, device)
+    predicted = torch.randn(n, 6, generator=generator).to(device).requires_grad_(True)
+    target = torch.randn(n, 6, generator=generator).to(device)
+
+    def forward_backward():
+        loss_fn(predicted, target).backward()
+
+    yield "dot_loss/forward", measure(
+        lambda: synchronize(loss_fn(predicted, target), device), settings["repeats"]
+    )
+    yield "dot_loss/forward_backward", measure(
+        lambda: synchronize(forward_backward(), device), settings["repeats"]
+    )
+
+
+def create_model(settings, input_size, trackers, poses, number_recursions, device):
+    return feedforward.FeedForward(
+        trackers,
+        poses,
+        None,
+        None,
+        input_size,
+        settings["hidden_size"],
+        settings["number_hidden_layers"],
+        6,
+        number_recursions,
+        device,
+    ).to(device)
+
+
+def bench_train_step(settings, data, device):
+    trackers_path, poses_path = data.files(data.training)
+    trackers = trackers_info_dataset.trackers_info_dataset(trackers_path, memmap=True)
+    poses = pose_dataset.pose_dataset(poses_path, memmap=True)
+    trackers = np.asarray(trackers.info)
+    poses = np.asarray(poses.poses)
+    steps = settings["train_steps"]
+    for number_recursions in settings["train_rollouts"]:
+        torch.manual_seed(0)
+        model = create_model(
+            settings, trackers.shape[1] + 6, trackers, poses, number_recursions, device
+        )
+        loss_fn = nn.MSELoss()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+        dataset = train_direction.dataset_input(trackers, number_recursions)
+        for batch_size in settings["train_batch_sizes"]:
+            name = "train_step/batch_{}_rollout_{}".format(
+                batch_size, number_recursions
+            )
+            dataloader = training_steps(dataset, batch_size, steps)
+            if dataloader is None:
+                yield name, not_enough_windows(dataset, batch_size)
+                continue
+
+            def train_loop():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    model.train_loop(dataloader, loss_fn, optimizer)
+                synchronize(None, device)
+
+            result = measure(train_loop, settings["repeats"])
+            result["seconds"] /= len(dataloader)
+            result["min_seconds"] /= len(dataloader)
+            result["samples_per_second"] = batch_size / result["seconds"]
+            yield name, result
+
+
+def training_steps(dataset, batch_size, steps):
+    # Loader of 'steps' full batches, fewer if the dataset is too small (None
+    # if it has less than one batch of windows)
+    steps = min(steps, len(dataset) // batch_size)
+    if steps == 0:
+        return None
+    return DataLoader(Subset(dataset, range(batch_size * steps)), batch_size=batch_size)
+
+
+def not_enough_windows(dataset, batch_size):
+    return {
+        "error": "{} training windows, fewer than a batch of {} (increase "
+        "train_poses)".format(len(dataset), batch_size)
+    }
+
+
+def resident_bytes(field):
+    # Linux only (VmRSS: current, VmHWM: peak resident set), None elsewhere
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_resident_bytes():
+    # The peak becomes the current resident set, which is returned
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return None
+    return resident_bytes("VmRSS")
+
+
+def _checkpoint_step(
+    settings, paths, number_recursions, segment, device, number_threads, results
+):
+    # Runs in a new process: the peak memory is the peak of its resident set
+    # (CPU) or of the CUDA allocator during the training steps, minus the
+    # memory in use before them
+    try:
+        torch.set_num_threads(number_threads)
+        trackers = trackers_info_dataset.trackers_info_dataset(paths[0], memmap=True)
+        poses = pose_dataset.pose_dataset(paths[1], memmap=True)
+        trackers = np.asarray(trackers.info)
+        poses = np.asarray(poses.poses)
+        torch.manual_seed(0)
+        model = create_model(
+            settings, trackers.shape[1] + 6, trackers, poses, number_recursions, device
+        )
+        model.checkpoint_segment = segment
+        loss_fn = nn.MSELoss()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+        dataset = train_direction.dataset_input(trackers, number_recursions)
+        batch_size = settings["checkpoint_batch_size"]
+        dataloader = training_steps(dataset, batch_size, settings["train_steps"])
+        if dataloader is None:
+            results.put(not_enough_windows(dataset, batch_size))
+            return
+
+        def train_loop():
+            with contextlib.redirect_stdout(io.StringIO()):
+                model.train_loop(dataloader, loss_fn, optimizer)
+            synchronize(None, device)
+
+        if device != "cpu":
+            torch.cuda.reset_peak_memory_stats()
+            start_bytes = torch.cuda.memory_allocated()
+        else:
+            start_bytes = reset_peak_resident_bytes()
+        result = measure(train_loop, settings["repeats"])
+        if device != "cpu":
+            result["peak_memory_bytes"] = (
+                torch.cuda.max_memory_allocated() - start_bytes
+            )
+        elif start_bytes is not None:
+            result["peak_memory_bytes"] = resident_bytes("VmHWM") - start_bytes
+        result["seconds"] /= len(dataloader)
+        result["min_seconds"] /= len(dataloader)
+        results.put(result)
+    except Exception:
+        results.put({"error": traceback.format_exc()})
+
+
+def bench_rollout_checkpoint(settings, data, device):
+    context = mp.get_context("spawn")
+    for number_recursions in settings["checkpoint_rollouts"]:
+        for segment in settings["checkpoint_segments"]:
+            results = context.Queue()
+            process = context.Process(
+                target=_checkpoint_step,
+                args=(
+                    settings,
+                    data.files(data.training),
+                    number_recursions,
+                    segment,
+                    device,
+                    torch.get_num_threads(),
+                    results,
+                ),
+            )
+            process.start()
+            result = _process_result(process, results)
+            process.join()
+            yield "rollout_checkpoint/rollout_{}_segment_{}".format(
+                number_recursions, segment
+            ), result
+
+
+def _process_result(process, results):
+    # Waits for the result of 'process', or reports its exit code if it dies
+    # without one (e.g., out of memory)
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    try:
+        return results.get(timeout=1.0)  # put just before exiting
+    except queue.Empty:
+        return {
+            "error": "benchmark process exited with code {}".format(process.exitcode)
+        }
+
+
+def bench_export_inference(settings, data, device):
+    trackers_path, _ = data.files(data.training)
+    header = trackers_info_dataset.trackers_info_dataset(
+        trackers_path, only_mean_std=True
+    )
+    input_size = header.number_features + 6
+    torch.manual_seed(0)
+    model = create_model(settings, input_size, None, None, 1, device)
+    model.eval()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "model.onnx")
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = measure(
+                    lambda: model.save(input_size, device, path), 1, warmup=0
+                )
+            result["bytes"] = os.path.getsize(path)
+        except Exception as e:  # e.g., onnx not installed
+            result = {"error": "{}: {}".format(type(e).__name__, e)}
+    yield "feedforward/save", result
+    for batch_size in [1, 64]:
+        input = torch.randn(batch_size, input_size).to(device)
+
+        def inference():
+            with torch.no_grad():
+                synchronize(model(input), device)
+
+        result = measure(
+            inference, settings["repeats"], number=settings["inference_calls"]
+        )
+        result["microseconds"] = result["seconds"] * 1e6
+        yield "feedforward/inference_batch_{}".format(batch_size), result
+
+
+def _inertialize_frames(
+    target_rot, target_ang_vel, source_rot, source_ang_vel, transitions, half_life, dt
+):
+    # Reference: frame by frame as in Inertialization.cs (all sessions at once)
+    offset_rot = np.zeros(target_rot.shape[:1] + target_rot.shape[2:])
+    offset_rot[..., 3] = 1.0
+    offset_ang_vel = np.zeros(target_ang_vel.shape[:1] + target_ang_vel.shape[2:])
+    result_rot = np.empty_like(target_rot)
+    result_ang_vel = np.empty_like(target_ang_vel)
+    for t in range(target_rot.shape[1]):
+        transition = transitions[:, t, None, None]
+        new_rot, new_ang_vel = spring.inertialize_transition_quat(
+            source_rot[:, t],
+            source_ang_vel[:, t],
+            target_rot[:, t],
+            target_ang_vel[:, t],
+            offset_rot,
+            offset_ang_vel,
+        )
+        offset_rot = np.where(transition, new_rot, offset_rot)
+        offset_ang_vel = np.where(transition, new_ang_vel, offset_ang_vel)
+        result_rot[:, t], result_ang_vel[:, t], offset_rot, offset_ang_vel = (
+            spring.inertialize_update_quat(
+                target_rot[:, t],
+                target_ang_vel[:, t],
+                offset_rot,
+                offset_ang_vel,
+                half_life,
+                dt,
+            )
+        )
+    return result_rot, result_ang_vel
+
+
+def bench_spring(settings, data, device):
+    for sessions in settings["spring_sessions"]:
+        for name, result in _spring_sessions(settings, sessions, device):
+            yield "spring/{}_sessions_{}".format(name, sessions), result
+
+
+def _spring_sessions(settings, sessions, device):
+    # Inertialization offsets and trajectory springs of [sessions, frames, joints]
+    frames = settings["spring_frames"]
+    joints = settings["joints"]
+    half_life, dt = 0.1, 1.0 / 60.0
+    rng = np.random.default_rng(0)
+
+    def random_rotations(*shape):
+        return rotations_numpy.quat_from_scaled_angle_axis(
+            rng.normal(0.0, 0.8, shape + (3,))
+        )
+
+    target_rot = random_rotations(sessions, frames, joints)
+    source_rot = random_rotations(sessions, frames, joints)
+    target_ang_vel = rng.normal(size=(sessions, frames, joints, 3))
+    source_ang_vel = rng.normal(size=(sessions, frames, joints, 3))
+    # A motion matching search every 10 frames, half of them change the clip
+    transitions = np.zeros((sessions, frames), dtype=bool)
+    transitions[:, ::10] = rng.random((sessions, len(range(0, frames, 10)))) < 0.5
+    arguments = (target_rot, target_ang_vel, source_rot, source_ang_vel, transitions)
+    torch_arguments = [
+        (
+            torch.from_numpy(x).to(device)
+            if x.dtype == bool
+            else torch.from_numpy(x).float().to(device)
+        )
+        for x in arguments
+    ]
+    float32_arguments = [
+        x if x.dtype == bool else x.astype(np.float32) for x in arguments
+    ]
+    reference = _inertialize_frames(*arguments, half_life, dt)
+
+    def max_error(result):
+        result = [
+            x.cpu().double().numpy() if isinstance(x, torch.Tensor) else x
+            for x in result
+        ]
+        return {
+            "max_angle_error": float(
+                rotations_numpy.angle_between_quat(reference[0], result[0]).max()
+            ),
+            "max_angular_velocity_error": float(np.abs(reference[1] - result[1]).max()),
+        }
+
+    functions = [
+        (
+            "inertialize_frames_numpy",
+            lambda: _inertialize_frames(*arguments, half_life, dt),
+        ),
+        (
+            "inertialize_sequence_quat_numpy",
+            lambda: spring.inertialize_sequence_quat(*arguments, half_life, dt),
+        ),
+        (
+            "inertialize_sequence_quat_numpy_float32",
+            lambda: spring.inertialize_sequence_quat(*float32_arguments, half_life, dt),
+        ),
+        (
+            "inertialize_sequence_quat_torch",
+            lambda: synchronize(
+                spring_torch.inertialize_sequence_quat(*torch_arguments, half_life, dt),
+                device,
+            ),
+        ),
+    ]
+    for name, function in functions:
+        result = measure(function, settings["repeats"])
+        result["frames_per_second"] = sessions * frames / result["seconds"]
+        result.update(max_error(function()))
+        yield name, result
+
+    # Trajectory prediction: spring toward the desired direction every frame
+    rot_q = random_rotations(sessions)
+    ang_vel = rng.normal(size=(sessions, 3))
+    goals = random_rotations(sessions, frames)
+    torch_rot_q, torch_ang_vel, torch_goals = (
+        torch.from_numpy(x).float().to(device) for x in (rot_q, ang_vel, goals)
+    )
+    functions = [
+        (
+            "spring_sequence_quat_numpy",
+            lambda: spring.simple_spring_damper_implicit_quat_sequence(
+                rot_q, ang_vel, goals, half_life, dt
+            ),
+        ),
+        (
+            "spring_sequence_quat_torch",
+            lambda: synchronize(
+                spring_torch.simple_spring_damper_implicit_quat_sequence(
+                    torch_rot_q, torch_ang_vel, torch_goals, half_life, dt
+                ),
+                device,
+            ),
+        ),
+    ]
+    for name, function in functions:
+        result = measure(function, settings["repeats"])
+        result["frames_per_second"] = sessions * frames / result["seconds"]
+        yield name, result
+
+
+def synchronize(result, device):
+    if device != "cpu":
+        torch.cuda.synchronize()
+    return result
+
+
+benchmarks = {
+    "loaders": bench_loaders,
+    "rotations_torch": bench_rotations,
+    "dot_loss": bench_dot_loss,
+    "train_step": bench_train_step,
+    "rollout_checkpoint": bench_rollout_checkpoint,
+    "feedforward": bench_export_inference,
+    "spring": bench_spring,
+}
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return None
+
+
+def metadata(settings, device):
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "device": device,
+        "settings": settings,
+    }
+
+
+def run(settings, device="cpu", groups=None):
+    results = {}
+    data = benchmark_data(settings)
+    try:
+        for group, function in benchmarks.items():
+            if groups is not None and group not in groups:
+                continue
+            for name, result in function(settings, data, device):
+                results[name] = result
+                print(format_result(name, result), flush=True)
+    finally:
+        data.folder.cleanup()
+    return {"metadata": metadata(settings, device), "results": results}
+
+
+def format_result(name, result):
+    if "error" in result:
+        return "{:<45} error: {}".format(name, result["error"])
+    line = "{:<45} {:>12.3f} ms".format(name, result["seconds"] * 1000.0)
+    if result.get("peak_memory_bytes") is not None:
+        line += " {:>10.1f} MB".format(result["peak_memory_bytes"] / 2**20)
+    return line
+
+
+def compare(results, baseline, threshold, key="min_seconds"):
+    # Returns rows (name, baseline seconds, seconds, ratio, status). The minimum
+    # is compared by default, it is less sensitive to noise than the median
+    rows = []
+    for name, result in results["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None or key not in result or key not in previous:
+            continue
+        ratio = result[key] / previous[key]
+        if ratio > 1.0 + threshold:
+            status = "slower"
+        elif ratio < 1.0 / (1.0 + threshold):
+            status = "faster"
+        else:
+            status = "same"
+        rows.append((name, previous[key], result[key], ratio, status))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="python/src performance benchmarks")
+    parser.add_argument("--output", help="JSON file with the results")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--only", action="append", choices=benchmarks.keys(), help="benchmark group"
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a setting",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="exit with code 1 if any benchmark is slower than the baseline",
+    )
+    args = parser.parse_args(argv)
+
+    settings = dict(default_settings)
+    for item in args.set:
+        key, _, value = item.partition("=")
+        if key not in settings:
+            parser.error("unknown setting: " + key)
+        settings[key] = train_direction.parse_value(value)
+
+    results = run(settings, args.device, args.only)
+    if args.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print(
+            "\nComparison with {} (commit {})".format(
+                args.baseline, baseline["metadata"].get("commit")
+            )
+        )
+        rows = compare(results, baseline, settings["threshold"])
+        for name, previous, current, ratio, status in rows:
+            print(
+                "{:<45} {:>10.3f} ms -> {:>10.3f} ms {:>6.2f}x {}".format(
+                    name, previous * 1000.0, current * 1000.0, ratio, status
+                )
+            )
+        slower = [row for row in rows if row[4] == "slower"]
+        print("{} slower, {} compared".format(len(slower), len(rows)))
+        if args.fail_on_regression and len(slower) > 0:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import copy
+import glob
+import os
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+checkpoint_prefix = "checkpoint_"
+checkpoint_extension = ".pt"
+
+
+def checkpoint_path(checkpoint_dir, epoch):
+    return os.path.join(
+        checkpoint_dir,
+        checkpoint_prefix + "{:05d}".format(epoch) + checkpoint_extension,
+    )
+
+
+def list_checkpoints(checkpoint_dir):
+    # Sorted from oldest to newest epoch, temporary files (.tmp) are ignored
+    paths = glob.glob(
+        os.path.join(checkpoint_dir, checkpoint_prefix + "*" + checkpoint_extension)
+    )
+    return sorted(paths)
+
+
+def latest_checkpoint(checkpoint_dir):
+    paths = list_checkpoints(checkpoint_dir)
+    if len(paths) == 0:
+        return None
+    return paths[-1]
+
+
+def load_latest(checkpoint_dir, device):
+    path = latest_checkpoint(checkpoint_dir)
+    if path is None:
+        return None
+    return torch.load(path, map_location=device)
+
+
+def _to_cpu(state):
+    # Deep copy with every tensor moved to the CPU, so training can keep
+    # updating the original tensors while the copy is being written
+    if torch.is_tensor(state):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+    return copy.deepcopy(state)
+
+
+def _rng_state():
+    # numpy keys are stored as a tensor so the checkpoint only contains
+    # types that torch.load can restore safely
+    np_state = np.random.get_state()
+    state = {
+        "python": random.getstate(),
+        "numpy": (
+            np_state[0],
+            torch.from_numpy(np_state[1].astype(np.int64)),
+            np_state[2],
+            np_state[3],
+            np_state[4],
+        ),
+        "torch": torch.get_rng_state(),
+        "cuda": None,
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    random.setstate(state["python"])
+    np_state = state["numpy"]
+    np.random.set_state(
+        (
+            np_state[0],
+            np_state[1].numpy().astype(np.uint32),
+            np_state[2],
+            np_state[3],
+            np_state[4],
+        )
+    )
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def snapshot(
+    epoch, config, model, optimizer, scheduler, generator, sampler=None, settings=None
+):
+    # Copy everything needed to resume training after 'epoch' has finished
+    # ('sampler' is an optional prioritized_sampler, 'settings' the training
+    # settings compared on resume together with 'config')
+    return {
+        "epoch": epoch,
+        "config": copy.deepcopy(config),
+        "settings": copy.deepcopy(settings),
+        "model": _to_cpu(model.state_dict()),
+        "optimizer": _to_cpu(optimizer.state_dict()),
+        "scheduler": _to_cpu(scheduler.state_dict()) if scheduler is not None else None,
+        "sampler": generator.get_state() if generator is not None else None,
+        "priorities": _to_cpu(sampler.state_dict()) if sampler is not None else None,
+        "rng": _rng_state(),
+    }
+
+
+def update_scheduler(state, optimizer, scheduler):
+    # Scheduler state and learning rates of a snapshot taken before the test
+    # loss of its epoch was applied (ReduceLROnPlateau with async evaluation)
+    state["scheduler"] = _to_cpu(scheduler.state_dict())
+    for group, current in zip(
+        state["optimizer"]["param_groups"], optimizer.param_groups
+    ):
+        group["lr"] = current["lr"]
+
+
+def restore(state, model, optimizer, scheduler, generator, sampler=None):
+    # Returns the epoch where training should continue
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    if scheduler is not None and state["scheduler"] is not None:
+        scheduler.load_state_dict(state["scheduler"])
+    if generator is not None and state["sampler"] is not None:
+        generator.set_state(state["sampler"])
+    if sampler is not None and state.get("priorities") is not None:
+        sampler.load_state_dict(state["priorities"])
+    _set_rng_state(state["rng"])
+    return state["epoch"] + 1
+
+
+class checkpoint_writer:
+    # Writes snapshots from a background thread so training never waits for
+    # the disk. Each file is written to a temporary path and atomically renamed,
+    # so a crash never leaves a truncated checkpoint behind. Only the newest
+    # 'keep_last' checkpoints are kept.
+    def __init__(self, checkpoint_dir, keep_last=3, max_pending=2):
+        assert keep_last >= 1
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.error = None
+        # Bounded so at most 'max_pending' snapshots are held in memory
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state):
+        self._raise_error()
+        self.pending.put(state)
+
+    def close(self):
+        # Blocks until every pending snapshot is on disk
+        self.pending.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            state = self.pending.get()
+            if state is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._write(state)
+            except Exception as e:
+                self.error = e
+
+    def _write(self, state):
+        path = checkpoint_path(self.checkpoint_dir, state["epoch"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # Retention
+        for old_path in list_checkpoints(self.checkpoint_dir)[: -self.keep_last]:
+            os.remove(old_path)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("Checkpoint writer failed") from self.error
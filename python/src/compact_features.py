@@ -0,0 +1,221 @@
+import argparse
+import time
+import numpy as np
+import features_dataset
+
+# Reduced-precision copy of a (normalized) .mmfeatures database for the motion
+# matching search. The linear search is bandwidth bound, so the compact codes
+# are scanned instead of the float32 features and only the 'rerank' closest
+# candidates are re-ranked with the exact float32 values (which can stay
+# memory-mapped, only a few rows are read per query).
+#   float16: features stored as half floats
+#   int8: per-dimension scale, the zero point is the stored mean (features are
+#         normalized) and the range is 'clip_sigmas' stored standard deviations,
+#         tightened to the actual range of the dimension
+
+precisions = ["float32", "float16", "int8"]
+
+
+def build(features, valid, precision, clip_sigmas=4.0, chunk_size=65536):
+    assert precision in precisions
+    N, F = features.shape
+    scale = None
+    if precision == "int8":
+        max_abs = np.zeros(F, dtype=np.float32)
+        for start in range(0, N, chunk_size):
+            chunk = np.asarray(features[start : start + chunk_size])
+            chunk = chunk[valid[start : start + chunk_size]]
+            if chunk.shape[0] > 0:
+                max_abs = np.maximum(max_abs, np.max(np.abs(chunk), axis=0))
+        limit = np.maximum(np.minimum(max_abs, clip_sigmas), 1e-6)
+        scale = (limit / 127.0).astype(np.float32)
+    codes = np.empty((N, F), dtype=precision)
+    for start in range(0, N, chunk_size):
+        chunk = np.asarray(features[start : start + chunk_size], dtype=np.float32)
+        if precision == "int8":
+            chunk = np.clip(np.rint(chunk / scale), -127, 127)
+        codes[start : start + chunk_size] = chunk
+    return compact_features(features, valid, codes, scale)
+
+
+class compact_features:
+    def __init__(self, features, valid, codes, scale=None, chunk_size=4096):
+        self.features = features  # float32, used to re-rank
+        self.valid = valid
+        self.codes = codes
+        self.scale = scale
+        self.precision = codes.dtype.name
+        # Rows converted to float32 at once (small enough to stay in cache)
+        self.chunk_size = chunk_size
+        self.norms_weights = None
+        self.norms = None
+
+    def nbytes(self):
+        size = self.codes.nbytes
+        if self.scale is not None:
+            size += self.scale.nbytes
+        return size
+
+    def dequantize(self, rows):
+        values = self.codes[rows].astype(np.float32)
+        if self.scale is not None:
+            values *= self.scale
+        return values
+
+    def _weighted_norms(self, weights):
+        # sum_j(w_j * c_ij^2) per row, only depends on the weights
+        if self.norms is not None and np.array_equal(self.norms_weights, weights):
+            return self.norms
+        w = weights if self.scale is None else weights * self.scale * self.scale
+        N = self.codes.shape[0]
+        self.norms = np.empty(N, dtype=np.float32)
+        for start in range(0, N, self.chunk_size):
+            chunk = self.codes[start : start + self.chunk_size].astype(np.float32)
+            self.norms[start : start + self.chunk_size] = (chunk * chunk) @ w
+        self.norms[~self.valid] = np.inf
+        self.norms_weights = weights.copy()
+        return self.norms
+
+    def approximate_distances(self, query, weights):
+        # |c - q|_w^2 = |c|_w^2 - 2 <c, w q> + |q|_w^2
+        norms = self._weighted_norms(weights)
+        wq = weights * query
+        query_norm = np.dot(wq, query)
+        if self.scale is not None:
+            wq = wq * self.scale
+        distances = np.empty_like(norms)
+        for start in range(0, norms.shape[0], self.chunk_size):
+            chunk = self.codes[start : start + self.chunk_size].astype(np.float32)
+            distances[start : start + self.chunk_size] = chunk @ wq
+        distances *= -2.0
+        distances += norms
+        distances += query_norm
+        return distances
+
+    def search(self, query, weights, current_distance, rerank=32):
+        # Same contract as the exact linear search: best valid feature vector
+        # closer than current_distance (or -1) and its exact distance
+        distances = self.approximate_distances(query, weights)
+        k = min(rerank, distances.shape[0])
+        candidates = np.argpartition(distances, k - 1)[:k]
+        candidates = candidates[np.isfinite(distances[candidates])]
+        if candidates.shape[0] == 0:
+            return -1, current_distance
+        candidates = np.sort(candidates)  # sequential reads if memory-mapped
+        diff = np.asarray(self.features[candidates], dtype=np.float32) - query
+        exact = np.einsum("ij,ij,j->i", diff, diff, weights)
+        best = int(np.argmin(exact))
+        if exact[best] < current_distance:
+            return int(candidates[best]), float(exact[best])
+        return -1, current_distance
+
+
+def exact_search(features, valid, query, weights):
+    # Reference float32 search (same as LinearMotionMatchingSearchBurst)
+    diff = features - query
+    distances = np.einsum("ij,ij,j->i", diff, diff, weights)
+    distances[~valid] = np.inf
+    best = int(np.argmin(distances))
+    return best, float(distances[best])
+
+
+def make_queries(features, valid, number_queries, noise, pose_offset, seed=0):
+    # Queries are valid feature vectors with a perturbed trajectory (the pose
+    # part of a real query is a database vector)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(np.flatnonzero(valid), size=number_queries)
+    queries = np.array(features[rows], dtype=np.float32)
+    queries[:, :pose_offset] += rng.normal(
+        0.0, noise, (number_queries, pose_offset)
+    ).astype(np.float32)
+    return queries
+
+
+def evaluate(path, precision, number_queries=200, rerank=32, noise=0.5, seed=0):
+    database = features_dataset.features_dataset(path)
+    features = database.features
+    valid = database.valid
+    weights = np.ones(database.feature_size, dtype=np.float32)
+    queries = make_queries(
+        features, valid, number_queries, noise, database.pose_offset, seed
+    )
+
+    start = time.perf_counter()
+    compact = build(features, valid, precision)
+    build_seconds = time.perf_counter() - start
+    compact.search(queries[0], weights, np.inf, rerank)  # weighted norms
+
+    exact_results = []
+    start = time.perf_counter()
+    for query in queries:
+        exact_results.append(exact_search(features, valid, query, weights))
+    exact_seconds = time.perf_counter() - start
+
+    compact_results = []
+    start = time.perf_counter()
+    for query in queries:
+        compact_results.append(compact.search(query, weights, np.inf, rerank))
+    compact_seconds = time.perf_counter() - start
+
+    changed = [e[0] != c[0] for e, c in zip(exact_results, compact_results)]
+    cost_increase = [
+        c[1] / e[1] - 1.0
+        for e, c, ch in zip(exact_results, compact_results, changed)
+        if ch and e[1] > 0.0
+    ]
+    float32_bytes = features.shape[0] * features.shape[1] * 4
+    return {
+        "precision": precision,
+        "feature_vectors": features.shape[0],
+        "feature_size": features.shape[1],
+        "queries": number_queries,
+        "rerank": rerank,
+        "float32_mb": float32_bytes / 2**20,
+        "compact_mb": compact.nbytes() / 2**20,
+        "memory_saved": 1.0 - compact.nbytes() / float32_bytes,
+        "build_seconds": build_seconds,
+        "exact_ms": 1000.0 * exact_seconds / number_queries,
+        "compact_ms": 1000.0 * compact_seconds / number_queries,
+        "speed_up": exact_seconds / compact_seconds,
+        "best_changed": float(np.mean(changed)),
+        "mean_cost_increase_when_changed": (
+            float(np.mean(cost_increase)) if len(cost_increase) > 0 else 0.0
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare reduced-precision and exact feature search"
+    )
+    parser.add_argument("features", help=".mmfeatures database")
+    parser.add_argument("--precision", choices=precisions, action="append")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank", type=int, default=32)
+    parser.add_argument(
+        "--noise", type=float, default=0.5, help="trajectory noise of the queries"
+    )
+    args = parser.parse_args(argv)
+    for precision in args.precision or ["float16", "int8"]:
+        result = evaluate(
+            args.features, precision, args.queries, args.rerank, args.noise
+        )
+        print(
+            "{}: {:.1f} MB -> {:.1f} MB ({:.0%} saved), {:.3f} ms -> {:.3f} ms "
+            "per query ({:.2f}x), best match changed in {:.1%} of the queries "
+            "(+{:.2%} cost when changed)".format(
+                result["precision"],
+                result["float32_mb"],
+                result["compact_mb"],
+                result["memory_saved"],
+                result["exact_ms"],
+                result["compact_ms"],
+                result["speed_up"],
+                result["best_changed"],
+                result["mean_cost_increase_when_changed"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+import numpy as np
+import torch
+import streaming_predictor
+import trackers_info_dataset
+
+# Local direction prediction service for several avatars (e.g., multi-user
+# sessions). Clients send one tracker frame per avatar and the service keeps
+# the autoregressive state (previous direction) of every avatar. Pending
+# frames are predicted together in one batched forward when every active
+# avatar has sent its frame, when 'max_batch' frames are pending or when the
+# oldest pending frame has waited 'deadline' seconds.
+#
+# Protocol (Unix stream socket, little endian):
+#   server -> client on connect: uint number_features, uint max_avatars
+#   request:  uint avatar, uint flags (1: reset the avatar), number_features
+#             float trackers (not normalized, as in streaming_predictor)
+#   response: uint avatar, 6 float direction (continuous representation
+#             relative to the HMD projected on the ground)
+# Responses of one avatar are sent in order, responses of different avatars
+# may be reordered. A request with avatar = stats_avatar returns (instead of a
+# direction) requests, batches, mean batch size, mean forward milliseconds,
+# max batch size and active avatars since the last stats request.
+
+flag_reset = 1
+stats_avatar = 0xFFFFFFFF
+default_socket = "/tmp/mmvr_direction.sock"
+
+
+class request:
+    def __init__(self, avatar, flags, trackers, writer):
+        self.avatar = avatar
+        self.flags = flags
+        self.trackers = trackers
+        self.writer = writer
+
+
+class direction_service:
+    def __init__(self, predictor, max_batch=64, deadline=0.002):
+        self.predictor = predictor
+        self.number_features = predictor.number_features
+        self.max_avatars = predictor.previous_dir.shape[0]
+        self.request_size = 8 + self.number_features * 4
+        self.max_batch = max_batch
+        self.deadline = deadline
+        self.pending = []
+        self.pending_avatars = set()
+        self.deferred = []  # second frame of an avatar already pending
+        self.active_avatars = {}  # avatar -> number of connections using it
+        self.timer = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats_requests = 0
+        self.stats_batches = 0
+        self.stats_max_batch = 0
+        self.stats_forward_seconds = 0.0
+
+    def stats(self):
+        batches = max(self.stats_batches, 1)
+        return [
+            self.stats_requests,
+            self.stats_batches,
+            self.stats_requests / batches,
+            1000.0 * self.stats_forward_seconds / batches,
+            self.stats_max_batch,
+            len(self.active_avatars),
+        ]
+
+    async def handle(self, reader, writer):
+        writer.write(struct.pack("<II", self.number_features, self.max_avatars))
+        avatars = set()
+        try:
+            while True:
+                data = await reader.readexactly(self.request_size)
+                avatar, flags = struct.unpack_from("<II", data)
+                if avatar == stats_avatar:
+                    stats = np.array(self.stats(), dtype="<f4")
+                    writer.write(struct.pack("<I", avatar) + stats.tobytes())
+                    self.reset_stats()
+                    continue
+                if avatar >= self.max_avatars:
+                    print("Avatar {} out of range, closing connection".format(avatar))
+                    break
+                if avatar not in avatars:
+                    avatars.add(avatar)
+                    self.active_avatars[avatar] = self.active_avatars.get(avatar, 0) + 1
+                trackers = np.frombuffer(data, dtype="<f4", offset=8)
+                self.add(request(avatar, flags, trackers, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for avatar in avatars:
+                self.active_avatars[avatar] -= 1
+                if self.active_avatars[avatar] == 0:
+                    del self.active_avatars[avatar]
+            writer.close()
+            # The avatars of this connection are no longer waited for
+            if len(self.pending) > 0 and self.ready():
+                self.flush()
+
+    def add(self, r):
+        if r.avatar in self.pending_avatars:
+            self.deferred.append(r)
+            return
+        self.pending.append(r)
+        self.pending_avatars.add(r.avatar)
+        if self.ready():
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.deadline, self.flush
+            )
+
+    def ready(self):
+        return len(self.pending) >= self.max_batch or len(self.pending_avatars) >= len(
+            self.active_avatars
+        )
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.pending
+        self.pending = []
+        self.pending_avatars = set()
+        if len(batch) > 0:
+            start = time.perf_counter()
+            for r in batch:
+                if r.flags & flag_reset:
+                    self.predictor.reset_avatar(r.avatar)
+            avatars = torch.tensor([r.avatar for r in batch])
+            trackers = np.stack([r.trackers for r in batch])
+            directions = self.predictor.predict(trackers, avatars).astype("<f4")
+            self.stats_forward_seconds += time.perf_counter() - start
+            self.stats_requests += len(batch)
+            self.stats_batches += 1
+            self.stats_max_batch = max(self.stats_max_batch, len(batch))
+            for r, direction in zip(batch, directions):
+                if not r.writer.is_closing():
+                    r.writer.write(struct.pack("<I", r.avatar) + direction.tobytes())
+        # Frames that had to wait for the previous frame of their avatar
+        deferred = self.deferred
+        self.deferred = []
+        for r in deferred:
+            self.add(r)
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        print(
+            "Serving on {} ({} features, {} avatars, max batch {}, deadline {:.1f} ms)".format(
+                path,
+                self.number_features,
+                self.max_avatars,
+                self.max_batch,
+                self.deadline * 1000.0,
+            ),
+            flush=True,
+        )
+        async with server:
+            await server.serve_forever()
+
+
+class direction_client:
+    # Blocking client (one connection, any number of avatars)
+    def __init__(self, path=default_socket):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.number_features, self.max_avatars = struct.unpack("<II", self._receive(8))
+
+    def send(self, avatar, trackers, reset=False):
+        trackers = np.asarray(trackers, dtype="<f4")
+        assert trackers.shape == (self.number_features,)
+        flags = flag_reset if reset else 0
+        self.socket.sendall(struct.pack("<II", avatar, flags) + trackers.tobytes())
+
+    def receive(self):
+        # Returns (avatar, direction)
+        data = self._receive(28)
+        return struct.unpack_from("<I", data)[0], np.frombuffer(
+            data, dtype="<f4", offset=4
+        )
+
+    def predict(self, avatar, trackers, reset=False):
+        self.send(avatar, trackers, reset)
+        return self.receive()[1]
+
+    def stats(self):
+        self.send(stats_avatar, np.zeros(self.number_features))
+        return self.receive()[1]
+
+    def close(self):
+        self.socket.close()
+
+    def _receive(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed")
+            data += chunk
+        return data
+
+
+# Load generator ---------------------------------------------------------------
+async def replay_avatar(path, avatar, frames, rate, end_time, latencies):
+    # Sends the frames of one avatar (own connection) at 'rate' frames per
+    # second (0: as fast as responses arrive) and records the latencies
+    reader, writer = await asyncio.open_unix_connection(path)
+    number_features, _ = struct.unpack("<II", await reader.readexactly(8))
+    assert number_features == frames.shape[1]
+    loop = asyncio.get_running_loop()
+    next_time = loop.time()
+    i = avatar * 997 % frames.shape[0]  # different start per avatar
+    flags = flag_reset
+    while loop.time() < end_time:
+        start = time.perf_counter()
+        writer.write(struct.pack("<II", avatar, flags) + frames[i].tobytes())
+        await reader.readexactly(28)
+        latencies.append(time.perf_counter() - start)
+        flags = 0
+        i = (i + 1) % frames.shape[0]
+        if rate > 0:
+            next_time += 1.0 / rate
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+    writer.close()
+
+
+async def replay(path, frames, number_avatars, rate, duration):
+    latencies = [[] for _ in range(number_avatars)]
+    loop = asyncio.get_running_loop()
+    end_time = loop.time() + duration
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            replay_avatar(path, a, frames, rate, end_time, latencies[a])
+            for a in range(number_avatars)
+        ]
+    )
+    seconds = time.perf_counter() - start
+    latencies = np.concatenate([np.array(l) for l in latencies]) * 1000.0
+    return {
+        "avatars": number_avatars,
+        "predictions_per_second": latencies.shape[0] / seconds,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def start_server(args, max_batch, path):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "serve",
+        args.checkpoint,
+        args.path_training,
+        "--socket",
+        path,
+        "--max-avatars",
+        str(max(max(args.avatars), 1)),
+        "--max-batch",
+        str(max_batch),
+        "--deadline-ms",
+        str(args.deadline_ms),
+    ]
+    if os.path.exists(path):
+        os.remove(path)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    while not os.path.exists(path):
+        if process.poll() is not None:
+            raise RuntimeError("The service could not be started")
+        time.sleep(0.1)
+    return process
+
+
+def load(args):
+    trackers = trackers_info_dataset.trackers_info_dataset(args.trackers, memmap=True)
+    # Not normalized, as sent by the application
+    frames = (np.asarray(trackers.info) * trackers.std + trackers.mean).astype("<f4")
+    max_batches = args.max_batch if args.checkpoint is not None else [None]
+    for max_batch in max_batches:
+        process = None
+        if max_batch is not None:
+            process = start_server(args, max_batch, args.socket)
+        try:
+            print(
+                "max batch: {}".format(max_batch if max_batch else "(running service)")
+            )
+            for number_avatars in args.avatars:
+                client = direction_client(args.socket)
+                client.stats()  # reset
+                result = asyncio.run(
+                    replay(
+                        args.socket, frames, number_avatars, args.rate, args.duration
+                    )
+                )
+                stats = client.stats()
+                client.close()
+                print(
+                    "  {avatars:>4} avatars: {predictions_per_second:>8.0f} predictions/s, "
+                    "latency p50 {latency_p50_ms:.2f} ms p95 {latency_p95_ms:.2f} ms "
+                    "p99 {latency_p99_ms:.2f} ms, ".format(**result)
+                    + "mean batch {:.1f}, forward {:.3f} ms".format(stats[2], stats[3])
+                )
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+def serve(args):
+    torch.set_num_threads(args.threads)
+    path_training = os.path.join(args.path_training, "")
+    predictor = streaming_predictor.streaming_predictor(
+        args.checkpoint,
+        path_training + "TrainingMSData.mstrackers",
+        path_training + "TrainingMSData.mspose",
+        args.max_avatars,
+        args.device,
+    )
+    service = direction_service(predictor, args.max_batch, args.deadline_ms / 1000.0)
+    try:
+        asyncio.run(service.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-avatar direction service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve")
+    load_parser = subparsers.add_parser(
+        "load", help="replay a .mstrackers for several avatars"
+    )
+    for p in (serve_parser, load_parser):
+        p.add_argument("--socket", default=default_socket)
+        p.add_argument("--deadline-ms", type=float, default=2.0)
+    serve_parser.add_argument("checkpoint", help="checkpoint file or folder")
+    serve_parser.add_argument("path_training", help="folder with TrainingMSData")
+    serve_parser.add_argument("--max-avatars", type=int, default=256)
+    serve_parser.add_argument("--max-batch", type=int, default=64)
+    serve_parser.add_argument("--device", default="cpu")
+    serve_parser.add_argument("--threads", type=int, default=1)
+    load_parser.add_argument("trackers", help=".mstrackers to replay")
+    load_parser.add_argument("--avatars", type=int, nargs="+", default=[1, 4, 16, 64])
+    load_parser.add_argument(
+        "--rate", type=float, default=60.0, help="frames per second (0: no limit)"
+    )
+    load_parser.add_argument("--duration", type=float, default=5.0)
+    load_parser.add_argument(
+        "--checkpoint",
+        help="start a service with this checkpoint (default: use --socket)",
+    )
+    load_parser.add_argument("--path-training", help="with --checkpoint")
+    load_parser.add_argument(
+        "--max-batch",
+        type=int,
+        nargs="+",
+        default=[64, 1],
+        help="with --checkpoint: services to compare (1: no batching)",
+    )
+    args = parser.parse_args(argv)
+    if args.command == "load" and args.checkpoint is not None:
+        if args.path_training is None:
+            load_parser.error("--checkpoint needs --path-training")
+    if args.command == "serve":
+        serve(args)
+    else:
+        load(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import copy
+import queue
+import time
+import traceback
+import torch
+import torch.multiprocessing as mp
+
+# Evaluates the test set in a separate process so training does not wait for
+# it. The process loads its own copy of the test data once (training data is
+# never sent) and receives a snapshot of the weights after each epoch. Results
+# (epoch, test loss, seconds) are returned in order as they become available.
+
+
+def _run(config, settings, data, device, number_threads, requests, results):
+    # Imported here: train_direction imports this module
+    import train_direction
+
+    try:
+        torch.set_num_threads(number_threads)
+        test_dataloader = train_direction.create_test_dataloader(config, settings, data)
+        loss_fn = train_direction.get_loss_fn(settings, data, device)
+        direction_model = train_direction.create_model(config, settings, data, device)
+        direction_model.eval()
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            epoch, state_dict = request
+            start = time.perf_counter()
+            direction_model.load_state_dict(state_dict)
+            loss = direction_model.test_loop(test_dataloader, loss_fn)
+            results.put((epoch, loss, time.perf_counter() - start))
+    except Exception:
+        results.put(("error", traceback.format_exc(), 0.0))
+
+
+class evaluation_worker:
+    def __init__(
+        self, config, settings, data, device="cpu", number_threads=1, max_pending=2
+    ):
+        # 'data' is a train_direction.direction_data, only its test part is sent
+        test_data = copy.copy(data)
+        test_data.training_trackers = None
+        test_data.training_poses = None
+        context = mp.get_context("spawn")  # safe with CUDA and threads
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.process = context.Process(
+            target=_run,
+            args=(
+                config,
+                settings,
+                test_data,
+                device,
+                number_threads,
+                self.requests,
+                self.results,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+
+    def submit(self, epoch, model):
+        # Snapshot of the weights (training keeps updating the model). Blocks
+        # while 'max_pending' evaluations are running and returns the results
+        # that had to be waited for
+        finished = []
+        while self.pending >= self.max_pending:
+            finished.append(self._get(block=True))
+        state_dict = {
+            key: value.detach().to("cpu", copy=True)
+            for key, value in model.state_dict().items()
+        }
+        self.requests.put((epoch, state_dict))
+        self.pending += 1
+        return finished
+
+    def poll(self):
+        # Results available now (without blocking)
+        finished = []
+        while self.pending > 0:
+            result = self._get(block=False)
+            if result is None:
+                break
+            finished.append(result)
+        return finished
+
+    def close(self):
+        # Waits for every pending evaluation and returns their results
+        finished = []
+        while self.pending > 0:
+            finished.append(self._get(block=True))
+        self.requests.put(None)
+        self.process.join()
+        return finished
+
+    def terminate(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+    def _get(self, block):
+        while True:
+            try:
+                result = self.results.get(timeout=1.0 if block else None, block=block)
+                break
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.process.is_alive():
+                    raise RuntimeError("Evaluation worker died")
+        if result[0] == "error":
+            self.terminate()
+            raise RuntimeError("Evaluation worker failed:\n" + result[1])
+        self.pending -= 1
+        return result
@@ -0,0 +1,88 @@
+import numpy as np
+import serializer_helper as sh
+
+
+class features_dataset:
+    # Reads the Motion Matching feature database (.mmfeatures) written by
+    # FeatureSerializer.cs. Features are stored normalized.
+    # The file does not say which features are trajectory features (FeatureSet
+    # takes them from MMData.TrajectoryFeatures), pass number_trajectory_features
+    # to set the split, otherwise it is guessed (see import_mean_std).
+    def __init__(
+        self, path, only_mean_std=False, memmap=False, number_trajectory_features=None
+    ):
+        if only_mean_std:
+            self.import_mean_std(path, number_trajectory_features)
+        else:
+            self.import_features(path, memmap, number_trajectory_features)
+
+    def import_mean_std(self, path, number_trajectory_features=None):
+        # Open as read binary
+        with open(path, "rb") as f:
+            # Read Header
+            self.number_feature_vectors = sh.read_uint(f)
+            self.feature_size = sh.read_uint(f)
+            self.number_features = sh.read_uint(f)
+            # Mean and Standard Deviation
+            self.mean = np.zeros(self.feature_size, dtype=np.float32)
+            self.std = np.zeros(self.feature_size, dtype=np.float32)
+            for i in range(self.feature_size):
+                self.mean[i] = sh.read_float(f)
+                self.std[i] = sh.read_float(f)
+            # Features description: name, floats per element, number of elements
+            # Trajectory features come first, pose features have 3 floats and 1 element
+            self.names = []
+            self.number_floats = []
+            self.number_elements = []
+            self.offsets = []
+            offset = 0
+            for i in range(self.number_features):
+                self.names.append(sh.read_string(f))
+                self.number_floats.append(sh.read_uint(f))
+                self.number_elements.append(sh.read_uint(f))
+                self.offsets.append(offset)
+                offset += self.number_floats[i] * self.number_elements[i]
+            assert offset == self.feature_size
+            self.header_size = f.tell()
+        if number_trajectory_features is not None:
+            assert 0 <= number_trajectory_features <= self.number_features
+            self.number_trajectory_features = number_trajectory_features
+        else:
+            # Heuristic: pose features are float3 x 1 element and come last, so
+            # a non-projected trajectory feature with a single prediction is
+            # taken as a pose feature
+            self.number_trajectory_features = self.number_features
+            while (
+                self.number_trajectory_features > 0
+                and self.number_floats[self.number_trajectory_features - 1] == 3
+                and self.number_elements[self.number_trajectory_features - 1] == 1
+            ):
+                self.number_trajectory_features -= 1
+        self.pose_offset = (
+            self.offsets[self.number_trajectory_features]
+            if self.number_trajectory_features < self.number_features
+            else self.feature_size
+        )
+
+    def import_features(self, path, memmap=False, number_trajectory_features=None):
+        self.import_mean_std(path, number_trajectory_features)
+        # Each feature vector is stored as: uint valid + feature_size floats
+        shape = (self.number_feature_vectors, 1 + self.feature_size)
+        if memmap:
+            records = np.memmap(
+                path, dtype="<f4", mode="r", offset=self.header_size, shape=shape
+            )
+        else:
+            with open(path, "rb") as f:
+                f.seek(self.header_size)
+                records = np.fromfile(f, dtype="<f4", count=shape[0] * shape[1])
+            records = records.reshape(shape)
+        self.valid = records[:, 0].view("<u4") != 0
+        self.features = records[:, 1:]
+        if not memmap:
+            self.features = np.ascontiguousarray(self.features, dtype=np.float32)
+
+    def trajectory_slice(self, feature_index):
+        offset = self.offsets[feature_index]
+        size = self.number_floats[feature_index] * self.number_elements[feature_index]
+        return slice(offset, offset + size)
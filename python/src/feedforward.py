@@ -1,8 +1,15 @@
 import torch
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 import numpy as np
 
 
+def to_tensor(array, device):
+    if array is None:
+        return None
+    return torch.from_numpy(array.astype(np.float32)).to(device)
+
+
 class FeedForward(nn.Module):
     def __init__(
         self,
@@ -16,21 +23,19 @@ class FeedForward(nn.Module):
         output_size,
         number_recursions,
         device,
+        checkpoint_segment=0,
     ):
         super(FeedForward, self).__init__()
 
-        self.training_trackers = torch.from_numpy(
-            training_trackers.astype(np.float32)
-        ).to(device)
-        self.training_poses = torch.from_numpy(training_poses.astype(np.float32)).to(
-            device
-        )
-        self.test_trackers = torch.from_numpy(test_trackers.astype(np.float32)).to(
-            device
-        )
-        self.test_poses = torch.from_numpy(test_poses.astype(np.float32)).to(device)
+        # Datasets can be None (e.g. only exporting or evaluating)
+        self.training_trackers = to_tensor(training_trackers, device)
+        self.training_poses = to_tensor(training_poses, device)
+        self.test_trackers = to_tensor(test_trackers, device)
+        self.test_poses = to_tensor(test_poses, device)
 
         self.number_recursions = number_recursions
+        # Recursions per gradient checkpoint segment (0: disabled), see rollout()
+        self.checkpoint_segment = checkpoint_segment
         self.input_size = input_size
         self.device = device
         self.number_hidden_layers = number_hidden_layers
@@ -48,30 +53,77 @@ class FeedForward(nn.Module):
     def forward(self, x):
         return self.linear_stack(x)
 
-    def train_loop(self, train_dataloader, loss_fn, optimizer):
+    def rollout(self, trackers, previous_dir):
+        # trackers: [batch, number_recursions, features], previous_dir: [batch, 6]
+        if self.checkpoint_segment > 0 and torch.is_grad_enabled():
+            # Gradient checkpointing: only the direction between segments is
+            # kept for backward, the activations of each segment are recomputed
+            # during backward (memory grows with the number of segments instead
+            # of the number of recursions, at the cost of one more forward)
+            predicted_dir = previous_dir
+            for start in range(0, self.number_recursions, self.checkpoint_segment):
+                end = min(start + self.checkpoint_segment, self.number_recursions)
+                predicted_dir = checkpoint(
+                    self.rollout_segment,
+                    trackers[:, start:end, :],
+                    predicted_dir,
+                    use_reentrant=False,
+                )
+            return predicted_dir
+        return self.rollout_segment(trackers, previous_dir)
+
+    def rollout_segment(self, trackers, previous_dir):
+        predicted_dir = previous_dir
+        for i in range(trackers.shape[1]):
+            input = torch.cat((trackers[:, i, :], predicted_dir), dim=-1)
+            predicted_dir = self(input)
+        return predicted_dir
+
+    def get_batch(self, batch, trackers, poses):
+        # A batch is either a tensor of start indices (idx) into the in-memory
+        # datasets or the (trackers, previous_dir, target_dir) windows produced
+        # by streaming_dataset
+        if not torch.is_tensor(batch):
+            return tuple(t.to(self.device) for t in batch)
+        idx = batch.to(self.device)
+        window = idx.unsqueeze(-1) + torch.arange(
+            self.number_recursions, device=self.device
+        )
+        return (
+            trackers[window, :],
+            poses[idx - 1, :6],
+            poses[idx + self.number_recursions - 1, :6],
+        )
+
+    def train_loop(self, train_dataloader, loss_fn, optimizer, sampler=None):
+        # With a prioritized_sampler, loss_fn returns the loss of each sample:
+        # they are weighted by the importance weights and become the new priorities
         size = len(train_dataloader.dataset)
         train_loss = 0
+        number_batches = 0
+        current = 0
 
-        for batch, (idx) in enumerate(train_dataloader):
+        for batch, data in enumerate(train_dataloader):
             self.zero_grad()
 
-            idx = idx.to(self.device)
+            trackers, previous_dir, target_dir = self.get_batch(
+                data, self.training_trackers, self.training_poses
+            )
 
             # Compute prediction
-            input = torch.cat(
-                (self.training_trackers[idx, :], self.training_poses[idx - 1, :6]),
-                dim=-1,
-            )
-            for i in range(self.number_recursions):
-                predicted_dir = self(input)
-                input = self.training_trackers[idx + (i + 1), :]
-                input = torch.cat((input, predicted_dir), dim=-1)
-
-            loss = loss_fn(
-                predicted_dir,
-                self.training_poses[idx + self.number_recursions - 1, :6],
-            )
-            train_loss += loss.item()  # mean of losses in this batch
+            predicted_dir = self.rollout(trackers, previous_dir)
+
+            if sampler is None:
+                loss = loss_fn(predicted_dir, target_dir)
+                train_loss += loss.item()  # mean of losses in this batch
+            else:
+                indices, weights = sampler.next_batch()
+                sample_losses = loss_fn(predicted_dir, target_dir)
+                sampler.update(indices, sample_losses)
+                loss = torch.mean(sample_losses * weights.to(self.device))
+                train_loss += sample_losses.mean().item()  # not weighted
+            number_batches += 1
+            current += target_dir.shape[0]
 
             # Backpropagation
             loss.backward()
@@ -79,39 +131,29 @@ class FeedForward(nn.Module):
 
             # Print progress
             if batch % 100 == 0:
-                loss, current = loss.item(), batch * len(idx)
+                loss = loss.item()
                 print(f"train loss: {loss:>7f}  [{current:>5d}/{size:>5d}]")
 
-        return train_loss / len(train_dataloader)  # divide by number of batches
+        return train_loss / number_batches  # divide by number of batches
 
     def test_loop(self, test_dataloader, loss_fn):
-        num_batches = len(test_dataloader)
         test_loss = 0
+        number_batches = 0
 
         with torch.no_grad():
-            for idx in test_dataloader:
-                idx = idx.to(self.device)
+            for data in test_dataloader:
+                trackers, previous_dir, target_dir = self.get_batch(
+                    data, self.test_trackers, self.test_poses
+                )
 
                 # Compute prediction
-                input = torch.cat(
-                    (
-                        self.test_trackers[idx, :],
-                        self.test_poses[idx - 1, :6],
-                    ),
-                    dim=-1,
-                )
-                for i in range(self.number_recursions):
-                    predicted_dir = self(input)
-                    input = self.test_trackers[idx + (i + 1), :]
-                    input = torch.cat((input, predicted_dir), dim=-1)
+                predicted_dir = self.rollout(trackers, previous_dir)
 
-                loss = loss_fn(
-                    predicted_dir,
-                    self.test_poses[idx + self.number_recursions - 1, :6],
-                )
+                loss = loss_fn(predicted_dir, target_dir)
                 test_loss += loss.item()
+                number_batches += 1
 
-        test_loss /= num_batches
+        test_loss /= number_batches
         print(f"Test Error: \n Avg loss: {test_loss:>8f}")
         return test_loss
 
@@ -0,0 +1,275 @@
+import argparse
+import time
+import numpy as np
+import torch
+import pose_set
+import rotations_torch as rot
+import skeleton_dataset
+
+# Batched forward kinematics. Joints are grouped by depth in the hierarchy and
+# all joints (and frames) of one level are composed at once, so a pose batch
+# [..., J] needs a few kernel calls per level instead of one per joint:
+#   world_rotation = parent_world_rotation * local_rotation (one matmul per level)
+#   world_position = sum over the ancestors (and itself) of
+#                    parent_world_rotation * local_position (one matmul and one
+#                    product with the ancestors matrix for all joints)
+# Everything is differentiable (no in-place writes), it can be used in losses.
+
+representations = ["quat", "continuous", "matrix"]
+
+
+def to_matrices(rotations, representation):
+    # Returns [..., 3, 3] (rows) from quaternions (..., 4), continuous (..., 6)
+    # or rotations_torch matrices (..., 9)
+    if representation == "quat":
+        rotations = rot.quat_to_matrix3x3(rotations)
+    elif representation == "continuous":
+        rotations = rot.continuous_to_mat(rotations)
+    # rotations_torch stores matrices by columns
+    return rotations.unflatten(-1, (3, 3)).transpose(-1, -2)
+
+
+def from_matrices(matrices, representation):
+    matrices = matrices.transpose(-1, -2).flatten(-2)
+    if representation == "quat":
+        shape = matrices.shape[:-1]
+        return rot.matrix3x3_to_quat(matrices.reshape(-1, 9)).reshape(shape + (4,))
+    elif representation == "continuous":
+        return rot.mat_to_continuous(matrices)
+    return matrices
+
+
+class forward_kinematics:
+    def __init__(self, parents, offsets, device="cpu"):
+        # parents: [J] (joint 0 is the root, its parent is ignored)
+        # offsets: [J, 3] local positions used when none are given
+        parents = np.asarray(parents, dtype=np.int64)
+        self.number_joints = parents.shape[0]
+        depths = np.zeros(self.number_joints, dtype=np.int64)
+        for i in range(1, self.number_joints):
+            assert parents[i] < i, "Joints must be stored after their parents"
+            depths[i] = depths[parents[i]] + 1
+        # Joints are sorted by level and moved to the first dimension, so every
+        # level is a contiguous slice. The parents of a level are all in the
+        # previous level, they are indexed inside it
+        order = np.argsort(depths, kind="stable")
+        position_in_level = np.zeros(self.number_joints, dtype=np.int64)
+        self.levels = []
+        start = 0
+        for depth in range(depths.max() + 1):
+            joints = order[depths[order] == depth]
+            position_in_level[joints] = np.arange(joints.shape[0])
+            parents_in_level = torch.from_numpy(position_in_level[parents[joints]])
+            self.levels.append(
+                (start, start + joints.shape[0], parents_in_level.to(device))
+            )
+            start += joints.shape[0]
+        inverse_order = np.argsort(order)
+        # Parent of each joint and ancestors matrix (joint, ancestor or itself),
+        # both in level order
+        self.level_parents = torch.from_numpy(inverse_order[parents[order]]).to(device)
+        ancestors = np.zeros((self.number_joints, self.number_joints), dtype=np.float32)
+        for i in range(self.number_joints):
+            j = i
+            ancestors[inverse_order[i], inverse_order[j]] = 1.0
+            while j != 0:
+                j = parents[j]
+                ancestors[inverse_order[i], inverse_order[j]] = 1.0
+        self.ancestors = torch.from_numpy(ancestors).to(device)
+        self.order = torch.from_numpy(order).to(device)
+        self.inverse_order = torch.from_numpy(inverse_order).to(device)
+        self.parents = parents
+        self.offsets = torch.as_tensor(np.asarray(offsets), dtype=torch.float32).to(
+            device
+        )
+        self.device = device
+
+    @staticmethod
+    def from_skeleton(path, device="cpu"):
+        skeleton = skeleton_dataset.skeleton_dataset(path)
+        return forward_kinematics(skeleton.parents, skeleton.offsets, device)
+
+    def __call__(self, rotations, positions=None, representation="quat", output=None):
+        # rotations: [..., J, 4 | 6 | 9] local rotations (see representation)
+        # positions: [..., J, 3] local positions (the root one is its world
+        #            position), if None the offsets are used (root at the origin)
+        # Returns world positions [..., J, 3] and world rotations in the
+        # 'output' representation (default: same as the input)
+        assert representation in representations
+        # [J (level order), ..., 3, 3], reordered before the conversion (fewer floats)
+        local_rotations = to_matrices(
+            rotations.movedim(-2, 0).index_select(0, self.order), representation
+        )
+        if positions is None:
+            positions = self.offsets.to(local_rotations.dtype)[self.order].reshape(
+                (self.number_joints,) + (1,) * (local_rotations.dim() - 3) + (3,)
+            )
+        else:
+            positions = positions.movedim(-2, 0).index_select(0, self.order)
+        start, end, _ = self.levels[0]
+        world_rotations = [local_rotations[start:end]]
+        for start, end, parents in self.levels[1:]:
+            world_rotations.append(
+                torch.matmul(
+                    world_rotations[-1].index_select(0, parents),
+                    local_rotations[start:end],
+                )
+            )
+        world_rotations = torch.cat(world_rotations, 0)
+        # Local positions rotated by the parent, then accumulated over the ancestors
+        root = self.levels[0][1]
+        positions = positions.expand(local_rotations.shape[:-1])
+        rotated = torch.matmul(
+            world_rotations.index_select(0, self.level_parents[root:]),
+            positions[root:].unsqueeze(-1),
+        ).squeeze(-1)
+        world_positions = torch.tensordot(
+            self.ancestors.to(rotated.dtype),
+            torch.cat((positions[:root], rotated), 0),
+            dims=([1], [0]),
+        )
+        world_positions = world_positions.index_select(0, self.inverse_order).movedim(
+            0, -2
+        )
+        world_rotations = world_rotations.index_select(0, self.inverse_order).movedim(
+            0, -3
+        )
+        return world_positions, from_matrices(
+            world_rotations, output if output is not None else representation
+        )
+
+    def mspose(self, poses, hips, mean, std):
+        # World positions/rotations (matrices) of normalized .mspose poses
+        # [..., J * 6] and hips [..., 3]. Joint 0 is the simulation bone w.r.t.
+        # the HMD projected on the ground and hips are in its local space, so
+        # the result is in the space of the projected HMD (see PoseDataset.cs)
+        mean = torch.as_tensor(mean, dtype=poses.dtype, device=poses.device)
+        std = torch.as_tensor(std, dtype=poses.dtype, device=poses.device)
+        Fp = poses.shape[-1]
+        poses = poses * std[:Fp] + mean[:Fp]
+        hips = hips * std[Fp:] + mean[Fp:]
+        rotations = poses.unflatten(-1, (self.number_joints, 6))
+        positions = self.offsets.to(poses.dtype).expand(rotations.shape[:-1] + (3,))
+        positions = torch.cat(
+            (
+                torch.zeros_like(positions[..., :1, :]),
+                hips.unsqueeze(-2),
+                positions[..., 2:, :],
+            ),
+            -2,
+        )
+        return self(rotations, positions, "continuous", "matrix")
+
+    def joint_by_joint(self, rotations, positions=None, representation="quat"):
+        # Reference implementation (one joint at a time), world rotations are
+        # returned as [..., J, 3, 3]
+        local_rotations = to_matrices(rotations, representation)
+        if positions is None:
+            positions = self.offsets.to(local_rotations).expand(
+                local_rotations.shape[:-2] + (3,)
+            )
+        world_rotations = [local_rotations[..., 0, :, :]]
+        world_positions = [positions[..., 0, :]]
+        for i in range(1, self.number_joints):
+            parent = self.parents[i]
+            world_positions.append(
+                world_positions[parent]
+                + torch.matmul(
+                    world_rotations[parent], positions[..., i, :].unsqueeze(-1)
+                ).squeeze(-1)
+            )
+            world_rotations.append(
+                torch.matmul(world_rotations[parent], local_rotations[..., i, :, :])
+            )
+        return torch.stack(world_positions, -2), torch.stack(world_rotations, -3)
+
+
+def benchmark(fk, rotations, positions, batch_sizes, repeats, device):
+    def timed(function):
+        function()  # warm up
+        if device != "cpu":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        if device != "cpu":
+            torch.cuda.synchronize()
+        return (time.perf_counter() - start) / repeats
+
+    results = []
+    for batch_size in batch_sizes:
+        index = torch.arange(batch_size) % rotations.shape[0]
+        r = rotations[index].to(device)
+        p = positions[index].to(device)
+        world_levels, _ = fk(r, p, "quat", "matrix")
+        world_joints, _ = fk.joint_by_joint(r, p, "quat")
+        levels_seconds = timed(lambda: fk(r, p, "quat", "matrix"))
+        joints_seconds = timed(lambda: fk.joint_by_joint(r, p, "quat"))
+        r_grad = r.clone().requires_grad_(True)
+        backward_seconds = timed(
+            lambda: fk(r_grad, p, "quat", "matrix")[0].square().sum().backward()
+        )
+        joints_backward_seconds = timed(
+            lambda: fk.joint_by_joint(r_grad, p, "quat")[0].square().sum().backward()
+        )
+        results.append(
+            {
+                "batch_size": batch_size,
+                "levels_frames_per_second": batch_size / levels_seconds,
+                "joint_by_joint_frames_per_second": batch_size / joints_seconds,
+                "speed_up": joints_seconds / levels_seconds,
+                "forward_backward_frames_per_second": batch_size / backward_seconds,
+                "joint_by_joint_forward_backward_frames_per_second": batch_size
+                / joints_backward_seconds,
+                "max_difference": float(
+                    torch.max(torch.abs(world_levels - world_joints))
+                ),
+            }
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Forward kinematics throughput")
+    parser.add_argument("skeleton", help=".mmskeleton file")
+    parser.add_argument(
+        "--poses", help=".mmpose with the same skeleton (default: random rotations)"
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 64, 1024, 16384]
+    )
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args(argv)
+
+    fk = forward_kinematics.from_skeleton(args.skeleton, args.device)
+    if args.poses is not None:
+        poses = pose_set.pose_set(args.poses)
+        assert poses.number_joints == fk.number_joints
+        rotations = torch.from_numpy(np.array(poses.rotations))
+        positions = torch.from_numpy(np.array(poses.positions))
+    else:
+        rotations = torch.nn.functional.normalize(
+            torch.randn(max(args.batch_sizes), fk.number_joints, 4), dim=-1
+        )
+        positions = fk.offsets.cpu().expand(rotations.shape[:-1] + (3,))
+    print(
+        "{} joints, {} levels, device: {}".format(
+            fk.number_joints, len(fk.levels), args.device
+        )
+    )
+    for result in benchmark(
+        fk, rotations, positions, args.batch_sizes, args.repeats, args.device
+    ):
+        print(
+            "batch {batch_size}: {levels_frames_per_second:.0f} frames/s "
+            "(joint by joint {joint_by_joint_frames_per_second:.0f} frames/s, "
+            "{speed_up:.1f}x), forward+backward "
+            "{forward_backward_frames_per_second:.0f} frames/s (joint by joint "
+            "{joint_by_joint_forward_backward_frames_per_second:.0f} frames/s), "
+            "max difference {max_difference:.2e}".format(**result)
+        )
+
+
+if __name__ == "__main__":
+    main()
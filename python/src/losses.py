@@ -3,10 +3,12 @@ import rotations_torch as rot
 
 
 class dot_loss:
-    def __init__(self, mean, std, device):
+    # reduction: "mean" (of the batch) or "none" (one loss per sample)
+    def __init__(self, mean, std, device, reduction="mean"):
         self.mean = torch.from_numpy(mean).to(device)
         self.std = torch.from_numpy(std).to(device)
         self.device = device
+        self.reduction = reduction
 
     def __call__(self, predicted_dir, target_dir):
         # predicted_dir and target_dir are continuous (2-axis) rotations
@@ -24,8 +26,17 @@ class dot_loss:
         target_forward = rot.mul_mat_vec(target_rot, forwards)
 
         # Compute dot product
-        return torch.mean(
+        loss = (
             ((-(predicted_forward * target_forward).sum(-1))
             + 1  # +1 so it goes from 0 to 2
             ) / 2.0 # /2 so it goes from 0 to 1
         ) # the result is negated because we want to minimize the loss
+        if self.reduction == "none":
+            return loss
+        return torch.mean(loss)
+
+
+class mse_loss:
+    # Mean squared error of each sample (same as nn.MSELoss when averaged)
+    def __call__(self, predicted_dir, target_dir):
+        return torch.mean(torch.square(predicted_dir - target_dir), dim=-1)
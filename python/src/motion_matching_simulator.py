@@ -0,0 +1,669 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import compact_features
+import features_dataset
+import pose_dataset
+import pose_set
+import rotations_numpy as rot
+import serializer_helper as sh
+import spring
+import trackers_info_dataset
+
+# Headless replay of motion matching over recorded tracker sessions.
+# Mirrors VRCharacterController.cs (trajectory prediction, adjustment and
+# clamping) and MotionMatchingController.cs (query, search and frame stepping)
+# without the skeleton, inertialization and foot lock, which do not change
+# which frames are selected.
+
+default_settings = {
+    # MotionMatchingController
+    "search_time": 10.0 / 60.0,
+    "responsiveness": 1.0,
+    "quality": 1.0,
+    "feature_weights": None,  # one weight per feature (default 1.0)
+    # "exact" or a compact_features precision ("float32", "float16", "int8")
+    # scanned before re-ranking the 'rerank' closest candidates
+    "feature_precision": "exact",
+    "rerank": 32,
+    # VRCharacterController
+    "direction": "hmd",  # "hmd", "ground_truth" (needs .mspose) or "model"
+    "responsiveness_positions": 0.75,
+    "responsiveness_directions": 0.75,
+    "threshold_notify_velocity_change": 0.1,
+    "prediction_frames": [20, 40, 60],
+    "do_adjustment": True,
+    "position_adjustment_halflife": 0.1,
+    "rotation_adjustment_halflife": 0.1,
+    "pos_maximum_adjustment_ratio": 0.1,
+    "rot_maximum_adjustment_ratio": 0.1,
+    "do_clamping": True,
+    "max_distance_simulation_bone_and_object": 0.1,
+    # Trajectory feature types ("position" or "direction"), by default
+    # features with "dir" in their name are directions
+    "trajectory_types": None,
+    # Number of trajectory features (MMData.TrajectoryFeatures), by default
+    # guessed from the shapes (see features_dataset)
+    "number_trajectory_features": None,
+    # Direction predictor (direction = "model")
+    "checkpoint": None,
+    "path_training": None,  # folder with TrainingMSData (mean/std of the predictor)
+    # Skip the predictor while the trackers barely move (see streaming_predictor)
+    "skip_threshold": 0.0,
+    "refresh_interval": 30,
+}
+
+forward = np.array([0.0, 0.0, 1.0])
+
+
+class motion_database:
+    # Feature and pose databases needed by the search. Arrays are read-only and
+    # can be placed in shared memory to be used by several processes.
+    def __init__(self, arrays, info):
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.info = info
+        self.frame_time = info["frame_time"]
+        self.feature_size = info["feature_size"]
+        self.pose_offset = info["pose_offset"]
+        self.trajectory = info["trajectory"]  # [(offset, floats, elements, type)]
+        self.number_features = info["number_features"]
+        self.number_feature_vectors = self.features.shape[0]
+        self.first_valid = int(np.argmax(self.valid))
+        self.shared = []
+        self.compact = None
+        if "codes" in arrays:
+            self.compact = compact_features.compact_features(
+                self.features, self.valid, self.codes, arrays.get("scale")
+            )
+        self.rerank = info["rerank"]
+
+    @staticmethod
+    def load(
+        path_features,
+        path_poses,
+        trajectory_types=None,
+        precision="exact",
+        rerank=32,
+        number_trajectory_features=None,
+    ):
+        features = features_dataset.features_dataset(
+            path_features, number_trajectory_features=number_trajectory_features
+        )
+        poses = pose_set.pose_set(path_poses, memmap=True)
+        assert features.number_feature_vectors == poses.number_poses
+        trajectory = []
+        for i in range(features.number_trajectory_features):
+            if trajectory_types is not None:
+                feature_type = trajectory_types[i]
+            else:
+                is_dir = "dir" in features.names[i].lower()
+                feature_type = "direction" if is_dir else "position"
+            trajectory.append(
+                (
+                    features.offsets[i],
+                    features.number_floats[i],
+                    features.number_elements[i],
+                    feature_type,
+                )
+            )
+        arrays = {
+            "features": features.features,
+            "valid": features.valid,
+            "mean": features.mean,
+            "std": features.std,
+            "root_positions": np.ascontiguousarray(
+                poses.positions[:, 0], dtype=np.float64
+            ),
+            "root_rotations": np.ascontiguousarray(
+                poses.rotations[:, 0], dtype=np.float64
+            ),
+        }
+        if precision != "exact":
+            compact = compact_features.build(
+                features.features, features.valid, precision
+            )
+            arrays["codes"] = compact.codes
+            if compact.scale is not None:
+                arrays["scale"] = compact.scale
+        info = {
+            "rerank": rerank,
+            "frame_time": float(poses.frame_time),
+            "feature_size": features.feature_size,
+            "pose_offset": features.pose_offset,
+            "trajectory": trajectory,
+            "number_features": features.number_features,
+        }
+        return motion_database(arrays, info)
+
+    def share(self):
+        # Copies the arrays to shared memory, returns what attach() needs
+        descriptor = {"info": self.info, "arrays": {}}
+        for name, array in self.arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            self.shared.append(block)
+            descriptor["arrays"][name] = (block.name, array.shape, array.dtype.str)
+        return descriptor
+
+    @staticmethod
+    def attach(descriptor):
+        arrays = {}
+        blocks = []
+        for name, (block_name, shape, dtype) in descriptor["arrays"].items():
+            block = shared_memory.SharedMemory(name=block_name)
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            arrays[name] = array
+            blocks.append(block)
+        database = motion_database(arrays, descriptor["info"])
+        database.shared = blocks  # keep the mappings alive
+        return database
+
+    def release(self, unlink=False):
+        for block in self.shared:
+            block.close()
+            if unlink:
+                block.unlink()
+        self.shared = []
+
+    def feature_weights(self, settings):
+        # Same as MotionMatchingController.UpdateAndGetFeatureWeights
+        weights = settings["feature_weights"] or [1.0] * self.number_features
+        w = np.zeros(self.feature_size, dtype=np.float32)
+        for i, (offset, floats, elements, _) in enumerate(self.trajectory):
+            w[offset : offset + floats * elements] = (
+                weights[i] * settings["responsiveness"]
+            )
+        for i in range(len(self.trajectory), self.number_features):
+            offset = self.pose_offset + (i - len(self.trajectory)) * 3
+            w[offset : offset + 3] = weights[i] * settings["quality"]
+        return w
+
+    def search(self, query, weights, current_distance):
+        # Linear search (LinearMotionMatchingSearchBurst): best valid feature
+        # vector closer than current_distance, or -1
+        if self.compact is not None:
+            best, distance = self.compact.search(
+                query, weights, current_distance, self.rerank
+            )
+            return best, distance, self.number_feature_vectors
+        diff = self.features - query
+        distances = np.einsum("ij,ij,j->i", diff, diff, weights)
+        distances[~self.valid] = np.inf
+        best = int(np.argmin(distances))
+        if distances[best] < current_distance:
+            return best, float(distances[best]), self.number_feature_vectors
+        return -1, current_distance, self.number_feature_vectors
+
+
+def read_trackers_debug(path):
+    # .mstrackersdebug (TrackersDataset.cs): uint number of frames, then per
+    # frame WorldHMD (float3) and WorldProjectedDirHMD (quaternion xyzw)
+    with open(path, "rb") as f:
+        number_frames = sh.read_uint(f)
+        data = np.fromfile(f, dtype="<f4", count=number_frames * 7)
+    data = data.reshape(number_frames, 7).astype(np.float64)
+    return data[:, 0:3], data[:, 3:7]
+
+
+class session:
+    # A recorded tracker stream (.mstrackers). The world-space HMD trajectory is
+    # read from the .mstrackersdebug written next to it by TrackersDataset.cs.
+    # Without it, the trajectory is dead-reckoned from the HMD velocity and yaw
+    # rate stored in the features (relative to the HMD projected on the
+    # ground), which drifts over the session.
+    def __init__(self, path_trackers, frame_time):
+        self.path = path_trackers
+        trackers = trackers_info_dataset.trackers_info_dataset(
+            path_trackers, memmap=True
+        )
+        self.trackers = (
+            np.array(trackers.info, dtype=np.float64) * trackers.std + trackers.mean
+        )
+        self.number_frames = self.trackers.shape[0]
+        hmd = self.trackers[:, 0:12]
+        path_debug = os.path.splitext(path_trackers)[0] + ".mstrackersdebug"
+        self.dead_reckoned = not os.path.exists(path_debug)
+        if not self.dead_reckoned:
+            self.hmd_pos, self.projected_hmd_rot = read_trackers_debug(path_debug)
+            assert self.hmd_pos.shape[0] == self.number_frames
+        else:
+            yaw = np.concatenate(([0.0], np.cumsum(hmd[:-1, 10] * frame_time)))
+            self.projected_hmd_rot = rot.quat_from_yaw(yaw)
+            world_vel = rot.mul_quat_vec(self.projected_hmd_rot, hmd[:, 6:9])
+            self.hmd_pos = np.zeros((self.number_frames, 3))
+            self.hmd_pos[1:] = np.cumsum(world_vel[:-1] * frame_time, axis=0)
+            self.hmd_pos[:, 1] = np.array(trackers.positions[:, 0, 1])
+        self.hmd_rot = rot.mul_quat(
+            self.projected_hmd_rot, rot.continuous_to_quat(hmd[:, 0:6])
+        )
+        # Ground truth direction (simulation bone) if the .mspose is next to it
+        self.ground_truth_dir = None
+        path_poses = os.path.splitext(path_trackers)[0] + ".mspose"
+        if os.path.exists(path_poses):
+            poses = pose_dataset.pose_dataset(path_poses, memmap=True)
+            assert poses.number_poses == self.number_frames
+            self.ground_truth_dir = (
+                np.array(poses.poses[:, :6], dtype=np.float64) * poses.std[:6]
+                + poses.mean[:6]
+            )
+
+    def desired_rotations(self, settings):
+        # Desired rotation of the character for each frame (VRDirectionPredictor)
+        if settings["direction"] == "hmd":
+            return self.hmd_rot, None
+        if settings["direction"] == "ground_truth":
+            assert self.ground_truth_dir is not None, "No .mspose for " + self.path
+            directions = self.ground_truth_dir
+        else:
+            import streaming_predictor
+
+            path_training = os.path.join(settings["path_training"], "")
+            predictor = streaming_predictor.streaming_predictor(
+                settings["checkpoint"],
+                path_training + "TrainingMSData.mstrackers",
+                path_training + "TrainingMSData.mspose",
+                skip_threshold=settings["skip_threshold"],
+                refresh_interval=settings["refresh_interval"],
+            )
+            directions = np.concatenate(
+                [
+                    predictor.predict(self.trackers[i : i + 1])
+                    for i in range(self.number_frames)
+                ]
+            ).astype(np.float64)
+        rotations = rot.mul_quat(
+            self.projected_hmd_rot, rot.continuous_to_quat(directions)
+        )
+        # Keep only the rotation around the up axis
+        angle_axis = rot.quat_to_scaled_angle_axis(rotations)
+        angle_axis[:, 0] = 0.0
+        angle_axis[:, 2] = 0.0
+        return rot.quat_from_scaled_angle_axis(angle_axis), directions
+
+
+def predict_trajectory(sess, desired_rot, frame_time, settings):
+    # VRCharacterController's tracker: predicted positions and rotations for
+    # every frame. They only depend on the input, so all frames are computed
+    # at once (the rotation state is the only sequential part).
+    T = sess.number_frames
+    frames = np.array(settings["prediction_frames"], dtype=np.float64)
+    # Current position: position of the previous frame (PositionHMD)
+    current_pos = np.concatenate((sess.hmd_pos[:1], sess.hmd_pos[:-1]))
+    desired_vel = np.zeros((T, 3))
+    desired_vel[1:] = (sess.hmd_pos[1:] - sess.hmd_pos[:-1]) / frame_time
+    speed_sq = np.sum(desired_vel * desired_vel, axis=-1)
+    threshold = settings["threshold_notify_velocity_change"]
+    input_changed = np.zeros(T, dtype=bool)
+    input_changed[1:] = speed_sq[1:] - speed_sq[:-1] > threshold * threshold
+    # Rotation state (RotationHMD and AngularVelocity through ComputeNewRot)
+    half_life_dir = 1.0 - settings["responsiveness_directions"]
+    # (state before the update of every frame)
+    rotations, angular_velocities = spring.simple_spring_damper_implicit_quat_sequence(
+        desired_rot[0], np.zeros(3), desired_rot[:-1], half_life_dir, frame_time
+    )
+    current_rot = np.concatenate((desired_rot[:1], rotations))
+    current_ang_vel = np.concatenate((np.zeros((1, 3)), angular_velocities))
+    # PredictRotations: [T, predictions, 4]
+    predicted_rot, _ = spring.simple_spring_damper_implicit_quat(
+        current_rot[:, None],
+        current_ang_vel[:, None],
+        desired_rot[:, None],
+        half_life_dir,
+        (frames * frame_time)[:, None],
+    )
+    predicted_dir = rot.mul_quat_vec(
+        predicted_rot, np.broadcast_to(forward, predicted_rot.shape[:-1] + (3,))
+    )
+    # PredictPositions: [T, predictions, 3] (velocity and acceleration start at zero)
+    half_life_pos = 1.0 - settings["responsiveness_positions"]
+    predicted_pos = np.zeros((T, len(frames), 3))
+    pos = current_pos
+    vel = np.zeros((T, 3))
+    acc = np.zeros((T, 3))
+    last = 0.0
+    for i, f in enumerate(frames):
+        pos, vel, acc = spring.character_position_update(
+            pos, vel, acc, desired_vel, half_life_pos, (f - last) * frame_time
+        )
+        last = f
+        predicted_pos[:, i] = pos
+    # Projected on the ground
+    predicted_pos[..., 1] = 0.0
+    predicted_dir[..., 1] = 0.0
+    predicted_dir /= np.linalg.norm(predicted_dir, axis=-1, keepdims=True)
+    return predicted_pos, predicted_dir, input_changed
+
+
+def simulate(database, sess, settings):
+    # Returns the quality and search cost metrics of one session
+    dt = database.frame_time
+    desired_rot, directions = sess.desired_rotations(settings)
+    predicted_pos, predicted_dir, input_changed = predict_trajectory(
+        sess, desired_rot, dt, settings
+    )
+    weights = database.feature_weights(settings)
+    po = database.pose_offset
+    T = sess.number_frames
+    N = database.number_feature_vectors
+
+    # Simulation bone (world) and motion matching state
+    sim_pos = sess.hmd_pos[0] * np.array([1.0, 0.0, 1.0])
+    sim_rot = desired_rot[0]
+    sim_vel = np.zeros(3)
+    sim_ang_vel = np.zeros(3)
+    current_frame = database.first_valid
+    anim_origin_pos = database.root_positions[current_frame]
+    inv_anim_origin_rot = rot.inverse_quat(database.root_rotations[current_frame])
+    mm_origin_pos = sim_pos.copy()
+    mm_origin_rot = sim_rot.copy()
+    search_time_left = 0.0
+    query = np.zeros(database.feature_size, dtype=np.float32)
+
+    metrics = {
+        "session": sess.path,
+        "frames": T,
+        # HMD path without .mstrackersdebug: errors are against a drifting path
+        "dead_reckoned": sess.dead_reckoned,
+        "searches": 0,
+        "transitions": 0,
+        "candidates": 0,
+        "search_seconds": 0.0,
+        "search_cost": 0.0,
+        "position_error": 0.0,
+        "max_position_error": 0.0,
+        "direction_error": 0.0,
+        "frames_out_of_range": 0,
+    }
+    position_errors = np.zeros(T)
+    direction_errors = np.zeros(T)
+    for t in range(T):
+        hmd = sess.hmd_pos[t] * np.array([1.0, 0.0, 1.0])
+        # Adjustment and clamping (VRCharacterController)
+        if settings["do_adjustment"]:
+            difference = hmd - sim_pos
+            difference[1] = 0.0
+            adjustment = spring.damp_adjustment_implicit(
+                difference, settings["position_adjustment_halflife"], dt
+            )
+            max_length = (
+                settings["pos_maximum_adjustment_ratio"] * np.linalg.norm(sim_vel) * dt
+            )
+            length = np.linalg.norm(adjustment)
+            if length > max_length:
+                adjustment = adjustment * (max_length / length)
+            mm_origin_pos = mm_origin_pos + adjustment
+            # Rotation towards the HMD direction (around the up axis)
+            hmd_forward = rot.mul_quat_vec(sess.hmd_rot[t], forward)
+            sim_forward = rot.mul_quat_vec(sim_rot, forward)
+            angle = rot.yaw_from_direction(hmd_forward) - rot.yaw_from_direction(
+                sim_forward
+            )
+            angle = (angle + np.pi) % (2.0 * np.pi) - np.pi
+            adjustment_rot = spring.damp_adjustment_implicit_quat(
+                rot.quat_from_yaw(angle), settings["rotation_adjustment_halflife"], dt
+            )
+            max_length = (
+                settings["rot_maximum_adjustment_ratio"]
+                * np.linalg.norm(sim_ang_vel)
+                * dt
+            )
+            angle_axis = rot.quat_to_scaled_angle_axis(adjustment_rot)
+            length = np.linalg.norm(angle_axis)
+            if length > max_length:
+                adjustment_rot = rot.quat_from_scaled_angle_axis(
+                    angle_axis * (max_length / length)
+                )
+            mm_origin_rot = rot.mul_quat(adjustment_rot, mm_origin_rot)
+        if settings["do_clamping"]:
+            sim_ground = sim_pos * np.array([1.0, 0.0, 1.0])
+            distance = np.linalg.norm(sim_ground - hmd)
+            max_distance = settings["max_distance_simulation_bone_and_object"]
+            if distance > max_distance:
+                clamped = max_distance * (sim_ground - hmd) / distance + hmd
+                mm_origin_pos = mm_origin_pos + (clamped - sim_ground)
+
+        # Motion matching search (MotionMatchingController)
+        if search_time_left <= 0.0 or input_changed[t]:
+            query[po:] = database.features[current_frame, po:]
+            inv_sim_rot = rot.inverse_quat(sim_rot)
+            for offset, floats, elements, feature_type in database.trajectory:
+                if feature_type == "position":
+                    values = rot.mul_quat_vec(inv_sim_rot, predicted_pos[t] - sim_pos)
+                else:
+                    values = rot.mul_quat_vec(inv_sim_rot, predicted_dir[t])
+                values = values[:elements]
+                values = values[:, [0, 2]] if floats == 2 else values
+                query[offset : offset + floats * elements] = values.reshape(-1)
+            query[:po] = (query[:po] - database.mean[:po]) / database.std[:po]
+
+            current_distance = np.inf
+            current_valid = bool(database.valid[current_frame])
+            if current_valid:
+                diff = database.features[current_frame, :po] - query[:po]
+                current_distance = float(np.sum(diff * diff * weights[:po]))
+            start = time.perf_counter()
+            best, cost, candidates = database.search(query, weights, current_distance)
+            metrics["search_seconds"] += time.perf_counter() - start
+            metrics["searches"] += 1
+            metrics["candidates"] += candidates
+            metrics["search_cost"] += cost if np.isfinite(cost) else 0.0
+            if best == -1:
+                best = current_frame
+            if best != current_frame:
+                metrics["transitions"] += 1
+                current_frame = best
+                anim_origin_pos = database.root_positions[current_frame]
+                inv_anim_origin_rot = rot.inverse_quat(
+                    database.root_rotations[current_frame]
+                )
+                mm_origin_pos = sim_pos.copy()
+                mm_origin_rot = sim_rot.copy()
+            search_time_left = settings["search_time"]
+        else:
+            search_time_left -= dt
+        # Always advance one frame (the simulation runs at the database frame rate)
+        current_frame += 1
+        if current_frame >= N:
+            current_frame = N - 1
+            metrics["frames_out_of_range"] += 1
+
+        # Update the simulation bone
+        previous_pos = sim_pos
+        previous_rot = sim_rot
+        local_pos = rot.mul_quat_vec(
+            inv_anim_origin_rot,
+            database.root_positions[current_frame] - anim_origin_pos,
+        )
+        local_rot = rot.mul_quat(
+            inv_anim_origin_rot, database.root_rotations[current_frame]
+        )
+        sim_pos = rot.mul_quat_vec(mm_origin_rot, local_pos) + mm_origin_pos
+        sim_rot = rot.mul_quat(mm_origin_rot, local_rot)
+        sim_vel = (sim_pos - previous_pos) / dt
+        sim_ang_vel = (
+            rot.quat_to_scaled_angle_axis(
+                rot.abs_quat(rot.mul_quat(sim_rot, rot.inverse_quat(previous_rot)))
+            )
+            / dt
+        )
+
+        # Quality: distance to the HMD and to the desired direction
+        position_errors[t] = np.linalg.norm((sim_pos - hmd) * np.array([1.0, 0.0, 1.0]))
+        sim_forward = rot.mul_quat_vec(sim_rot, forward)
+        desired_forward = rot.mul_quat_vec(desired_rot[t], forward)
+        angle = rot.yaw_from_direction(desired_forward) - rot.yaw_from_direction(
+            sim_forward
+        )
+        direction_errors[t] = abs((angle + np.pi) % (2.0 * np.pi) - np.pi)
+
+    metrics["position_error"] = float(np.mean(position_errors))
+    metrics["max_position_error"] = float(np.max(position_errors))
+    metrics["direction_error"] = float(np.degrees(np.mean(direction_errors)))
+    if directions is not None and sess.ground_truth_dir is not None:
+        # Error of the direction used (predicted or ground truth) against the ground truth
+        error = rot.angle_between_quat(
+            rot.continuous_to_quat(directions),
+            rot.continuous_to_quat(sess.ground_truth_dir),
+        )
+        metrics["direction_prediction_error"] = float(np.degrees(np.mean(error)))
+    return metrics
+
+
+# Process pool: every worker attaches to the shared databases once
+_worker_database = None
+_worker_settings = None
+
+
+def _init_worker(descriptor, settings):
+    global _worker_database, _worker_settings
+    _worker_database = motion_database.attach(descriptor)
+    _worker_settings = settings
+
+
+def _simulate_session(path_trackers):
+    start = time.perf_counter()
+    sess = session(path_trackers, _worker_database.frame_time)
+    metrics = simulate(_worker_database, sess, _worker_settings)
+    metrics["seconds"] = time.perf_counter() - start
+    return metrics
+
+
+def aggregate(results):
+    # Totals and frame-weighted means over all sessions
+    frames = sum(r["frames"] for r in results)
+    searches = sum(r["searches"] for r in results)
+    search_seconds = sum(r["search_seconds"] for r in results)
+    summary = {
+        "sessions": len(results),
+        "frames": frames,
+        "searches": searches,
+        "transitions": sum(r["transitions"] for r in results),
+        "candidates": sum(r["candidates"] for r in results),
+        "search_seconds": search_seconds,
+        "mean_search_ms": 1000.0 * search_seconds / max(searches, 1),
+        "mean_search_cost": sum(r["search_cost"] for r in results) / max(searches, 1),
+        "frames_out_of_range": sum(r["frames_out_of_range"] for r in results),
+        "dead_reckoned_sessions": sum(r["dead_reckoned"] for r in results),
+        "max_position_error": max(
+            (r["max_position_error"] for r in results), default=0.0
+        ),
+    }
+    for key in ["position_error", "direction_error", "direction_prediction_error"]:
+        weighted = [(r[key], r["frames"]) for r in results if key in r]
+        if len(weighted) > 0:
+            summary[key] = sum(v * f for v, f in weighted) / sum(f for _, f in weighted)
+    return summary
+
+
+def run(path_features, path_poses, sessions, settings, processes=None):
+    database = motion_database.load(
+        path_features,
+        path_poses,
+        settings["trajectory_types"],
+        settings["feature_precision"],
+        settings["rerank"],
+        settings["number_trajectory_features"],
+    )
+    start = time.perf_counter()
+    if processes == 1:
+        results = []
+        for path in sessions:
+            session_start = time.perf_counter()
+            metrics = simulate(database, session(path, database.frame_time), settings)
+            metrics["seconds"] = time.perf_counter() - session_start
+            results.append(metrics)
+    else:
+        descriptor = database.share()
+        try:
+            with multiprocessing.Pool(
+                processes, initializer=_init_worker, initargs=(descriptor, settings)
+            ) as pool:
+                results = list(pool.imap_unordered(_simulate_session, sessions))
+        finally:
+            database.release(unlink=True)
+    summary = aggregate(results)
+    summary["wall_seconds"] = time.perf_counter() - start
+    summary["frames_per_second"] = summary["frames"] / summary["wall_seconds"]
+    return results, summary
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless motion matching simulator")
+    parser.add_argument("features", help=".mmfeatures database")
+    parser.add_argument("poses", help=".mmpose database")
+    parser.add_argument("sessions", nargs="+", help=".mstrackers files or folders")
+    parser.add_argument("--processes", type=int, help="default: number of CPUs")
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a setting, e.g. --set direction=ground_truth",
+    )
+    parser.add_argument("--output", help="write per-session and summary metrics (JSON)")
+    args = parser.parse_args(argv)
+
+    settings = dict(default_settings)
+    for item in args.set:
+        key, _, value = item.partition("=")
+        if key not in settings:
+            parser.error("Unknown setting: " + key)
+        settings[key] = parse_value(value)
+    if settings["direction"] == "model" and (
+        settings["checkpoint"] is None or settings["path_training"] is None
+    ):
+        parser.error(
+            "direction=model needs --set checkpoint=... --set path_training=..."
+        )
+
+    sessions = []
+    for path in args.sessions:
+        if os.path.isdir(path):
+            sessions += sorted(glob.glob(os.path.join(path, "*.mstrackers")))
+        else:
+            sessions.append(path)
+
+    results, summary = run(
+        args.features, args.poses, sessions, settings, args.processes
+    )
+    for metrics in sorted(results, key=lambda r: r["session"]):
+        print(
+            "{}: {} frames, {} searches, {} transitions, "
+            "position error {:.3f} m, direction error {:.1f} deg".format(
+                metrics["session"],
+                metrics["frames"],
+                metrics["searches"],
+                metrics["transitions"],
+                metrics["position_error"],
+                metrics["direction_error"],
+            )
+            + (" (dead-reckoned HMD path)" if metrics["dead_reckoned"] else "")
+        )
+    print(json.dumps(summary, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"settings": settings, "sessions": results, "summary": summary},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
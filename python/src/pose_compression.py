@@ -0,0 +1,533 @@
+import argparse
+import os
+import struct
+import time
+import zlib
+import numpy as np
+import pose_dataset
+import pose_set
+import rotations_numpy as rot
+import serializer_helper as sh
+
+# Compressed versions of the pose databases:
+#   .mmposez: .mmpose (pose_set), compressed per clip
+#   .msposez: .mspose (pose_dataset), compressed per block of frames
+# Every value is quantized with a fixed step (bounded error) and stored as
+# keyframe + delta integer codes: every 'keyframe_interval' frames the codes
+# are stored as they are, and the frames in between store the difference with
+# the previous frame. Deltas of integer codes are lossless, so the error never
+# accumulates. Each clip/block is compressed (zlib) on its own and decoded on
+# demand. Velocities of .mmpose can be dropped and re-derived on decode as in
+# PoseExtractor.cs.
+
+mmposez_magic = b"MMPZ"
+msposez_magic = b"MSPZ"
+version = 1
+int_types = [np.int8, np.int16, np.int32, np.int64]
+
+
+def rotation_step(bits):
+    # Quantization step of values in [-1, 1] with 'bits' bits
+    return 1.0 / (2 ** (bits - 1) - 1)
+
+
+def write_uint(f, value):
+    f.write(struct.pack("<I", value))
+
+
+def write_float(f, value):
+    f.write(struct.pack("<f", value))
+
+
+# Streams ----------------------------------------------------------------------
+def encode_stream(values, step, keyframe_interval):
+    # values: [frames, ...] -> bytes
+    codes = np.rint(np.asarray(values, dtype=np.float64) / step).astype(np.int64)
+    frames = codes.shape[0]
+    codes = codes.reshape(frames, -1)
+    deltas = codes.copy()
+    deltas[1:] -= codes[:-1]
+    deltas[::keyframe_interval] = codes[::keyframe_interval]
+    # Smallest integer type that fits
+    max_abs = int(np.max(np.abs(deltas))) if deltas.size > 0 else 0
+    type_index = 0
+    while max_abs > np.iinfo(int_types[type_index]).max:
+        type_index += 1
+    return (
+        struct.pack("<BI", type_index, deltas.shape[1])
+        + deltas.astype(int_types[type_index]).tobytes()
+    )
+
+
+def decode_stream(data, offset, frames, step, keyframe_interval, first=0, last=None):
+    # Returns (values [last - first, size] float32, next offset)
+    # Only the keyframe segments covering [first, last) are accumulated
+    type_index, size = struct.unpack_from("<BI", data, offset)
+    offset += 5
+    dtype = np.dtype(int_types[type_index])
+    deltas = np.frombuffer(data, dtype=dtype, count=frames * size, offset=offset)
+    offset += frames * size * dtype.itemsize
+    if last is None:
+        last = frames
+    start = (first // keyframe_interval) * keyframe_interval
+    deltas = deltas.reshape(frames, size)[start:last].astype(np.int64)
+    # Cumulative sum inside each keyframe segment (vectorized)
+    number_segments = -(-deltas.shape[0] // keyframe_interval)
+    padded = np.zeros((number_segments * keyframe_interval, size), dtype=np.int64)
+    padded[: deltas.shape[0]] = deltas
+    codes = np.cumsum(
+        padded.reshape(number_segments, keyframe_interval, size), axis=1
+    ).reshape(-1, size)
+    codes = codes[first - start : last - start]
+    return (codes * step).astype(np.float32), offset
+
+
+def continuous_quaternions(rotations):
+    # Flips the sign of the quaternions so consecutive frames are close
+    # (same rotations, smaller deltas): rotations [frames, joints, 4]
+    rotations = np.array(rotations, dtype=np.float64)
+    dots = np.sum(rotations[1:] * rotations[:-1], axis=-1)
+    flips = np.concatenate(
+        (np.zeros((1,) + dots.shape[1:], dtype=bool), dots < 0.0), axis=0
+    )
+    signs = np.where(np.cumsum(flips, axis=0) % 2 == 1, -1.0, 1.0)
+    return rotations * signs[..., None]
+
+
+def derive_velocities(positions, rotations, frame_time):
+    # Local velocities and angular velocities of one clip (PoseExtractor.cs):
+    # backward differences, zero for the first frame
+    velocities = np.zeros(positions.shape, dtype=np.float32)
+    angular_velocities = np.zeros(positions.shape, dtype=np.float32)
+    velocities[1:] = (positions[1:] - positions[:-1]) / frame_time
+    difference = rot.abs_quat(
+        rot.mul_quat(rotations[1:], rot.inverse_quat(rotations[:-1]))
+    )
+    angular_velocities[1:] = rot.quat_to_scaled_angle_axis(difference) / frame_time
+    return velocities, angular_velocities
+
+
+# .mmposez ---------------------------------------------------------------------
+def write_mmposez(
+    path,
+    poses,
+    rotation_bits=16,
+    position_step=1e-4,
+    velocity_step=1e-3,
+    keyframe_interval=32,
+    derive=False,
+):
+    # poses: pose_set. derive=True drops the velocities (re-derived on decode)
+    blobs = []
+    for start, end in poses.clips:
+        r = continuous_quaternions(poses.rotations[start:end])
+        data = encode_stream(
+            poses.positions[start:end], position_step, keyframe_interval
+        )
+        data += encode_stream(r, rotation_step(rotation_bits), keyframe_interval)
+        if not derive:
+            data += encode_stream(
+                poses.velocities[start:end], velocity_step, keyframe_interval
+            )
+            data += encode_stream(
+                poses.angular_velocities[start:end], velocity_step, keyframe_interval
+            )
+        contacts = np.stack(
+            (poses.left_foot_contact[start:end], poses.right_foot_contact[start:end]),
+            axis=-1,
+        )
+        data += np.packbits(contacts.reshape(-1)).tobytes()
+        blobs.append(zlib.compress(data, 9))
+    with open(path, "wb") as f:
+        f.write(mmposez_magic)
+        write_uint(f, version)
+        write_uint(f, poses.number_clips)
+        for start, end in poses.clips:
+            write_uint(f, int(start))
+            write_uint(f, int(end))
+            write_float(f, poses.frame_time)
+        write_uint(f, poses.number_poses)
+        write_uint(f, poses.number_joints)
+        write_uint(f, rotation_bits)
+        write_float(f, position_step)
+        write_float(f, velocity_step)
+        write_uint(f, keyframe_interval)
+        write_uint(f, 1 if derive else 0)
+        # Clip table (sizes), then the compressed clips
+        for blob in blobs:
+            write_uint(f, len(blob))
+        for blob in blobs:
+            f.write(blob)
+
+
+class compressed_pose_set:
+    # Reader of .mmposez with the same arrays as pose_set (decode()) or per
+    # clip on demand (clip(i))
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            assert f.read(4) == mmposez_magic, "Not a .mmposez file"
+            assert sh.read_uint(f) == version
+            self.number_clips = sh.read_uint(f)
+            self.clips = np.zeros((self.number_clips, 2), dtype=np.int64)
+            self.frame_time = -1.0
+            for i in range(self.number_clips):
+                self.clips[i][0] = sh.read_uint(f)
+                self.clips[i][1] = sh.read_uint(f)
+                frame_time = sh.read_float(f)
+                if self.frame_time == -1.0:
+                    self.frame_time = frame_time
+            self.number_poses = sh.read_uint(f)
+            self.number_joints = sh.read_uint(f)
+            self.rotation_bits = sh.read_uint(f)
+            self.position_step = sh.read_float(f)
+            self.velocity_step = sh.read_float(f)
+            self.keyframe_interval = sh.read_uint(f)
+            self.derive = sh.read_uint(f) == 1
+            sizes = [sh.read_uint(f) for _ in range(self.number_clips)]
+            self.blobs = [f.read(size) for size in sizes]
+        self.cache = {}
+
+    def clip(self, clip_index, first=0, last=None):
+        # Decodes frames [first, last) of a clip (relative to the clip start)
+        start, end = self.clips[clip_index]
+        frames = int(end - start)
+        if last is None:
+            last = frames
+        data = self.cache.get(clip_index)
+        if data is None:
+            data = zlib.decompress(self.blobs[clip_index])
+            self.cache = {clip_index: data}  # keep only the last clip
+        J = self.number_joints
+        k = self.keyframe_interval
+        # Derived velocities need the previous frame
+        decode_first = max(first - 1, 0) if self.derive else first
+        positions, offset = decode_stream(
+            data, 0, frames, self.position_step, k, decode_first, last
+        )
+        rotations, offset = decode_stream(
+            data,
+            offset,
+            frames,
+            rotation_step(self.rotation_bits),
+            k,
+            decode_first,
+            last,
+        )
+        positions = positions.reshape(-1, J, 3)
+        rotations = rotations.reshape(-1, J, 4)
+        rotations /= np.linalg.norm(rotations, axis=-1, keepdims=True)
+        if self.derive:
+            velocities, angular_velocities = derive_velocities(
+                positions, rotations, self.frame_time
+            )
+            if first > 0:
+                # The first decoded frame was only needed for the differences
+                positions = positions[1:]
+                rotations = rotations[1:]
+                velocities = velocities[1:]
+                angular_velocities = angular_velocities[1:]
+        else:
+            velocities, offset = decode_stream(
+                data, offset, frames, self.velocity_step, k, first, last
+            )
+            angular_velocities, offset = decode_stream(
+                data, offset, frames, self.velocity_step, k, first, last
+            )
+            velocities = velocities.reshape(-1, J, 3)
+            angular_velocities = angular_velocities.reshape(-1, J, 3)
+        contacts = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=offset))
+        contacts = contacts[: frames * 2].reshape(frames, 2)[first:last].astype(bool)
+        return {
+            "positions": positions,
+            "rotations": rotations,
+            "velocities": velocities,
+            "angular_velocities": angular_velocities,
+            "left_foot_contact": contacts[:, 0],
+            "right_foot_contact": contacts[:, 1],
+        }
+
+    def decode(self):
+        # Decodes every clip, same attributes as pose_set
+        J = self.number_joints
+        self.positions = np.zeros((self.number_poses, J, 3), dtype=np.float32)
+        self.rotations = np.zeros((self.number_poses, J, 4), dtype=np.float32)
+        self.velocities = np.zeros((self.number_poses, J, 3), dtype=np.float32)
+        self.angular_velocities = np.zeros((self.number_poses, J, 3), dtype=np.float32)
+        self.left_foot_contact = np.zeros(self.number_poses, dtype=bool)
+        self.right_foot_contact = np.zeros(self.number_poses, dtype=bool)
+        for i, (start, end) in enumerate(self.clips):
+            for name, values in self.clip(i).items():
+                getattr(self, name)[start:end] = values
+        return self
+
+
+# .msposez ---------------------------------------------------------------------
+def write_msposez(
+    path,
+    poses,
+    rotation_bits=16,
+    position_step=1e-4,
+    block_size=4096,
+    keyframe_interval=32,
+):
+    # poses: pose_dataset. Values are quantized denormalized (rotations are the
+    # 6D continuous representation, in [-1, 1], hips are positions)
+    denormalized_poses = (
+        np.asarray(poses.poses, dtype=np.float64)
+        * poses.std[: poses.number_features_pose]
+        + poses.mean[: poses.number_features_pose]
+    )
+    denormalized_hips = (
+        np.asarray(poses.hips, dtype=np.float64)
+        * poses.std[poses.number_features_pose :]
+        + poses.mean[poses.number_features_pose :]
+    )
+    blobs = []
+    for start in range(0, poses.number_poses, block_size):
+        end = min(start + block_size, poses.number_poses)
+        data = encode_stream(
+            denormalized_poses[start:end],
+            rotation_step(rotation_bits),
+            keyframe_interval,
+        )
+        data += encode_stream(
+            denormalized_hips[start:end], position_step, keyframe_interval
+        )
+        blobs.append(zlib.compress(data, 9))
+    with open(path, "wb") as f:
+        f.write(msposez_magic)
+        write_uint(f, version)
+        write_uint(f, poses.number_poses)
+        write_uint(f, poses.number_features_pose)
+        write_uint(f, poses.number_features_hips)
+        write_uint(f, poses.number_joints)
+        for i in range(poses.number_features_pose + poses.number_features_hips):
+            write_float(f, poses.mean[i])
+            write_float(f, poses.std[i])
+        for i in range(poses.number_joints):
+            for j in range(3):
+                write_float(f, poses.joint_local_offsets[i][j])
+        write_uint(f, rotation_bits)
+        write_float(f, position_step)
+        write_uint(f, block_size)
+        write_uint(f, keyframe_interval)
+        write_uint(f, len(blobs))
+        for blob in blobs:
+            write_uint(f, len(blob))
+        for blob in blobs:
+            f.write(blob)
+
+
+class compressed_pose_dataset:
+    # Reader of .msposez with the same attributes as pose_dataset (poses and
+    # hips normalized). Blocks are decoded on demand with block(i) or all at
+    # once with decode()
+    def __init__(self, path, decode=True):
+        with open(path, "rb") as f:
+            assert f.read(4) == msposez_magic, "Not a .msposez file"
+            assert sh.read_uint(f) == version
+            self.number_poses = sh.read_uint(f)
+            self.number_features_pose = sh.read_uint(f)
+            self.number_features_hips = sh.read_uint(f)
+            self.number_joints = sh.read_uint(f)
+            number_features = self.number_features_pose + self.number_features_hips
+            self.mean = np.zeros(number_features, dtype=np.float32)
+            self.std = np.zeros(number_features, dtype=np.float32)
+            for i in range(number_features):
+                self.mean[i] = sh.read_float(f)
+                self.std[i] = sh.read_float(f)
+            self.joint_local_offsets = np.zeros(
+                (self.number_joints, 3), dtype=np.float32
+            )
+            for i in range(self.number_joints):
+                for j in range(3):
+                    self.joint_local_offsets[i][j] = sh.read_float(f)
+            self.rotation_bits = sh.read_uint(f)
+            self.position_step = sh.read_float(f)
+            self.block_size = sh.read_uint(f)
+            self.keyframe_interval = sh.read_uint(f)
+            number_blocks = sh.read_uint(f)
+            sizes = [sh.read_uint(f) for _ in range(number_blocks)]
+            self.blobs = [f.read(size) for size in sizes]
+        if decode:
+            self.decode()
+
+    def block(self, block_index):
+        # Returns normalized (poses, hips) of the frames in the block
+        start = block_index * self.block_size
+        frames = min(self.block_size, self.number_poses - start)
+        data = zlib.decompress(self.blobs[block_index])
+        Fp = self.number_features_pose
+        poses, offset = decode_stream(
+            data, 0, frames, rotation_step(self.rotation_bits), self.keyframe_interval
+        )
+        hips, offset = decode_stream(
+            data, offset, frames, self.position_step, self.keyframe_interval
+        )
+        poses = (poses - self.mean[:Fp]) / self.std[:Fp]
+        hips = (hips - self.mean[Fp:]) / self.std[Fp:]
+        return poses, hips
+
+    def decode(self):
+        self.poses = np.zeros(
+            (self.number_poses, self.number_features_pose), dtype=np.float32
+        )
+        self.hips = np.zeros(
+            (self.number_poses, self.number_features_hips), dtype=np.float32
+        )
+        for i in range(len(self.blobs)):
+            start = i * self.block_size
+            poses, hips = self.block(i)
+            self.poses[start : start + poses.shape[0]] = poses
+            self.hips[start : start + hips.shape[0]] = hips
+        return self
+
+
+# Report -----------------------------------------------------------------------
+def angular_error(quaternions1, quaternions2):
+    # Angle (radians) between rotations, computed in float64 from the
+    # difference quaternion (arccos of the dot product is not precise near 1)
+    quaternions1 = np.asarray(quaternions1, dtype=np.float64)
+    quaternions2 = np.asarray(quaternions2, dtype=np.float64)
+    quaternions1 = quaternions1 / np.linalg.norm(quaternions1, axis=-1, keepdims=True)
+    quaternions2 = quaternions2 / np.linalg.norm(quaternions2, axis=-1, keepdims=True)
+    difference = rot.abs_quat(
+        rot.mul_quat(quaternions1, rot.inverse_quat(quaternions2))
+    )
+    return np.linalg.norm(rot.quat_to_scaled_angle_axis(difference), axis=-1)
+
+
+def report_mmpose(path, output, args):
+    original = pose_set.pose_set(path)
+    start = time.perf_counter()
+    write_mmposez(
+        output,
+        original,
+        args.rotation_bits,
+        args.position_step,
+        args.velocity_step,
+        args.keyframe_interval,
+        args.derive_velocities,
+    )
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = compressed_pose_set(output).decode()
+    decode_seconds = time.perf_counter() - start
+    angular_errors = angular_error(original.rotations, decoded.rotations)
+    result = {
+        "frames": original.number_poses,
+        "encode_seconds": encode_seconds,
+        "decode_seconds": decode_seconds,
+        "decode_frames_per_second": original.number_poses / decode_seconds,
+        "max_angular_error_deg": float(np.degrees(np.max(angular_errors))),
+        "max_position_error": float(
+            np.max(np.abs(original.positions - decoded.positions))
+        ),
+        "max_velocity_error": float(
+            np.max(np.abs(original.velocities - decoded.velocities))
+        ),
+        "max_angular_velocity_error": float(
+            np.max(np.abs(original.angular_velocities - decoded.angular_velocities))
+        ),
+        "contacts_equal": bool(
+            np.array_equal(original.left_foot_contact, decoded.left_foot_contact)
+            and np.array_equal(original.right_foot_contact, decoded.right_foot_contact)
+        ),
+    }
+    # Lazy access: decode a single clip
+    reader = compressed_pose_set(output)
+    start = time.perf_counter()
+    reader.clip(0)
+    result["first_clip_seconds"] = time.perf_counter() - start
+    return result
+
+
+def report_mspose(path, output, args):
+    original = pose_dataset.pose_dataset(path, memmap=True)
+    start = time.perf_counter()
+    write_msposez(
+        output,
+        original,
+        args.rotation_bits,
+        args.position_step,
+        args.block_size,
+        args.keyframe_interval,
+    )
+    encode_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = compressed_pose_dataset(output)
+    decode_seconds = time.perf_counter() - start
+    Fp = original.number_features_pose
+    J = Fp // 6
+
+    def quaternions(poses):
+        poses = (
+            np.asarray(poses, dtype=np.float64) * original.std[:Fp] + original.mean[:Fp]
+        )
+        return rot.continuous_to_quat(poses.reshape(-1, J, 6))
+
+    def hips(values):
+        return (
+            np.asarray(values, dtype=np.float64) * original.std[Fp:]
+            + original.mean[Fp:]
+        )
+
+    angular_errors = angular_error(
+        quaternions(original.poses), quaternions(decoded.poses)
+    )
+    return {
+        "frames": original.number_poses,
+        "encode_seconds": encode_seconds,
+        "decode_seconds": decode_seconds,
+        "decode_frames_per_second": original.number_poses / decode_seconds,
+        "max_angular_error_deg": float(np.degrees(np.max(angular_errors))),
+        "max_rotation_6d_error": float(
+            np.max(np.abs((original.poses - decoded.poses) * original.std[:Fp]))
+        ),
+        "max_position_error": float(
+            np.max(np.abs(hips(original.hips) - hips(decoded.hips)))
+        ),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compress a .mmpose/.mspose database and report size, decode throughput and error"
+    )
+    parser.add_argument("input", help=".mmpose or .mspose file")
+    parser.add_argument("--output", help="default: input + 'z'")
+    parser.add_argument("--rotation-bits", type=int, default=16)
+    parser.add_argument("--position-step", type=float, default=1e-4)
+    parser.add_argument("--velocity-step", type=float, default=1e-3)
+    parser.add_argument("--keyframe-interval", type=int, default=32)
+    parser.add_argument("--block-size", type=int, default=4096, help=".mspose only")
+    parser.add_argument(
+        "--derive-velocities",
+        action="store_true",
+        help=".mmpose only: do not store velocities, re-derive them on decode",
+    )
+    args = parser.parse_args(argv)
+
+    output = args.output or args.input + "z"
+    if args.input.endswith(".mmpose"):
+        result = report_mmpose(args.input, output, args)
+    elif args.input.endswith(".mspose"):
+        result = report_mspose(args.input, output, args)
+    else:
+        parser.error("Unknown extension: " + args.input)
+    original_size = os.path.getsize(args.input)
+    compressed_size = os.path.getsize(output)
+    print(
+        "{}: {:.2f} MB -> {:.2f} MB ({:.1f}x)".format(
+            output,
+            original_size / 2**20,
+            compressed_size / 2**20,
+            original_size / compressed_size,
+        )
+    )
+    for key, value in result.items():
+        print("  {}: {}".format(key, value))
+
+
+if __name__ == "__main__":
+    main()
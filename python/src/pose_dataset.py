@@ -3,9 +3,11 @@ import serializer_helper as sh
 
 
 class pose_dataset:
-    def __init__(self, path, only_mean_std=False):
+    def __init__(self, path, only_mean_std=False, memmap=False):
         if only_mean_std:
             self.import_mean_std(path)
+        elif memmap:
+            self.import_poses_memmap(path)
         else:
             self.import_poses(path)
 
@@ -58,3 +60,34 @@ class pose_dataset:
             for i in range(number_features):
                 self.mean[i] = sh.read_float(f)
                 self.std[i] = sh.read_float(f)
+            self.header_size = f.tell()
+
+    def import_poses_memmap(self, path):
+        # Poses and hips are memory-mapped (float32) instead of read into memory
+        self.import_mean_std(path)
+        with open(path, "rb") as f:
+            f.seek(self.header_size)
+            # JointLocalOffsets
+            self.joint_local_offsets = np.zeros(
+                (self.number_joints, 3), dtype=np.float32
+            )
+            for i in range(self.number_joints):
+                self.joint_local_offsets[i][0] = sh.read_float(f)
+                self.joint_local_offsets[i][1] = sh.read_float(f)
+                self.joint_local_offsets[i][2] = sh.read_float(f)
+        offset = self.header_size + self.number_joints * 3 * 4
+        self.poses = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r",
+            offset=offset,
+            shape=(self.number_poses, self.number_features_pose),
+        )
+        offset += self.number_poses * self.number_features_pose * 4
+        self.hips = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r",
+            offset=offset,
+            shape=(self.number_poses, self.number_features_hips),
+        )
@@ -0,0 +1,60 @@
+import numpy as np
+import serializer_helper as sh
+
+
+class pose_set:
+    # Reads the Motion Matching pose database (.mmpose) written by
+    # PoseSerializer.cs. Joint 0 is the simulation bone.
+    #   positions: [number_poses, number_joints, 3] local positions
+    #   rotations: [number_poses, number_joints, 4] local rotations (x, y, z, w)
+    #   velocities, angular_velocities: [number_poses, number_joints, 3]
+    #   left_foot_contact, right_foot_contact: [number_poses] bool
+    #   clips: [number_clips, 2] (start, end) with end exclusive
+    def __init__(self, path, memmap=False):
+        self.import_poses(path, memmap)
+
+    def import_header(self, f):
+        # Clips
+        self.number_clips = sh.read_uint(f)
+        self.clips = np.zeros((self.number_clips, 2), dtype=np.int64)
+        self.frame_time = -1.0
+        for i in range(self.number_clips):
+            self.clips[i][0] = sh.read_uint(f)
+            self.clips[i][1] = sh.read_uint(f)
+            frame_time = sh.read_float(f)
+            if self.frame_time == -1.0:
+                self.frame_time = frame_time
+        # Poses
+        self.number_poses = sh.read_uint(f)
+        self.number_joints = sh.read_uint(f)
+        self.header_size = f.tell()
+
+    def import_poses(self, path, memmap=False):
+        with open(path, "rb") as f:
+            self.import_header(f)
+            shape = (self.number_poses, self.pose_size(self.number_joints))
+            if not memmap:
+                records = np.fromfile(f, dtype="<f4", count=shape[0] * shape[1])
+                records = records.reshape(shape)
+        if memmap:
+            records = np.memmap(
+                path, dtype="<f4", mode="r", offset=self.header_size, shape=shape
+            )
+        J = self.number_joints
+        self.positions = records[:, 0 : J * 3].reshape(-1, J, 3)
+        self.rotations = records[:, J * 3 : J * 7].reshape(-1, J, 4)
+        self.velocities = records[:, J * 7 : J * 10].reshape(-1, J, 3)
+        self.angular_velocities = records[:, J * 10 : J * 13].reshape(-1, J, 3)
+        contacts = records[:, J * 13 : J * 13 + 2].view("<u4")
+        self.left_foot_contact = contacts[:, 0] == 1
+        self.right_foot_contact = contacts[:, 1] == 1
+
+    @staticmethod
+    def pose_size(number_joints):
+        # Floats (4 bytes) per pose: positions, rotations, velocities,
+        # angular velocities and the two foot contacts (uint)
+        return number_joints * 13 + 2
+
+    def clip_index(self, pose_index):
+        # Index of the clip containing the pose
+        return int(np.searchsorted(self.clips[:, 1], pose_index, side="right"))
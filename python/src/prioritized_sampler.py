@@ -0,0 +1,192 @@
+import argparse
+import collections
+import math
+import os
+import tempfile
+import time
+import torch
+
+# Samples training windows proportionally to their last training loss
+# (prioritized experience replay, Schaul et al. 2016), so hard windows (turns,
+# sidesteps) are seen more often than easy straight walking:
+#   P(i) = (loss_i + epsilon) ^ alpha / sum_j (loss_j + epsilon) ^ alpha
+# The loss of each sample is multiplied by its importance weight
+#   w_i = (N * P(i)) ^ -beta / sum_j P(j) (N * P(j)) ^ -beta
+# which corrects the bias of the sampling (completely when beta = 1, beta is
+# annealed towards 1 during training). Weights are normalized to a mean of 1
+# so the learning rate keeps its meaning. Losses are refreshed from the training
+# batches (no extra forward passes) and windows never sampled use the largest
+# known loss. Indices are drawn for 'refresh_batches' batches at once, so the
+# O(N) pass over the priorities is amortized.
+
+
+class prioritized_sampler(torch.utils.data.Sampler):
+    def __init__(
+        self,
+        number_windows,
+        batch_size,
+        alpha=0.6,
+        beta=0.4,
+        epsilon=1e-3,
+        refresh_batches=50,
+        generator=None,
+    ):
+        self.number_windows = number_windows
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.initial_beta = beta
+        self.beta = beta
+        self.epsilon = epsilon
+        self.refresh_batches = refresh_batches
+        self.generator = generator
+        self.priorities = torch.full((number_windows,), math.nan)
+        self.pending = collections.deque()  # (indices, weights) of yielded batches
+
+    def __len__(self):
+        # Same number of batches per epoch as uniform sampling
+        return math.ceil(self.number_windows / self.batch_size)
+
+    def __iter__(self):
+        # Batches of window indices (use it as the batch_sampler of a DataLoader)
+        self.pending.clear()
+        number_batches = len(self)
+        for first in range(0, number_batches, self.refresh_batches):
+            batches = min(self.refresh_batches, number_batches - first)
+            probabilities = self.probabilities()
+            # Inverse transform sampling (torch.multinomial is limited to 2^24 windows)
+            cdf = torch.cumsum(probabilities.double(), 0)
+            u = torch.rand(batches * self.batch_size, generator=self.generator)
+            indices = torch.searchsorted(cdf, u.double() * cdf[-1]).clamp_(
+                max=self.number_windows - 1
+            )
+            weights = torch.pow(self.number_windows * probabilities, -self.beta)
+            weights = (weights[indices] / torch.sum(probabilities * weights)).float()
+            for b in range(batches):
+                batch = slice(b * self.batch_size, (b + 1) * self.batch_size)
+                self.pending.append((indices[batch], weights[batch]))
+                yield indices[batch].tolist()
+
+    def probabilities(self):
+        known = ~torch.isnan(self.priorities)
+        if torch.any(known):
+            priorities = torch.where(
+                known, self.priorities, self.priorities[known].max()
+            )
+        else:
+            priorities = torch.ones(self.number_windows)
+        priorities = torch.pow(priorities + self.epsilon, self.alpha)
+        return priorities / priorities.sum()
+
+    def next_batch(self):
+        # Indices and importance weights of the oldest batch not updated yet
+        return self.pending.popleft()
+
+    def update(self, indices, losses):
+        self.priorities[indices] = losses.detach().float().cpu()
+
+    def set_epoch(self, epoch, epochs):
+        # beta goes linearly from its initial value to 1 in the last epoch
+        t = min(epoch / max(epochs - 1, 1), 1.0)
+        self.beta = self.initial_beta + (1.0 - self.initial_beta) * t
+
+    def state_dict(self):
+        return {"priorities": self.priorities.clone()}
+
+    def load_state_dict(self, state):
+        # Priorities of another number of windows (different dataset or
+        # number_recursions) do not match, they are discarded
+        if state["priorities"].shape != (self.number_windows,):
+            print(
+                "Ignoring priorities of {} windows ({} windows)".format(
+                    state["priorities"].shape[0], self.number_windows
+                )
+            )
+            self.priorities = torch.full((self.number_windows,), math.nan)
+            return
+        self.priorities = state["priorities"].clone()
+
+
+# Benchmark ----------------------------------------------------------------------
+def convergence(train_direction, config, settings, data, sampler, seed):
+    # Test loss and seconds since the start of training after every epoch
+    history = []
+    with tempfile.TemporaryDirectory() as path_checkpoints:
+        settings = dict(
+            settings, sampler=sampler, path_checkpoints=path_checkpoints + "/"
+        )
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        train_direction.train_direction(
+            config,
+            settings,
+            data,
+            on_test_loss=lambda epoch, loss: history.append(
+                (epoch, loss, time.perf_counter() - start)
+            ),
+        )
+    return history
+
+
+def main(argv=None):
+    # Imported here: train_direction imports this module
+    import train_direction
+
+    parser = argparse.ArgumentParser(
+        description="Epochs and time to reach the final test loss of uniform sampling"
+    )
+    parser.add_argument("--path-training", help="folder with TrainingMSData")
+    parser.add_argument("--path-test", help="folder with TestMSData")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a setting or hyperparameter of train_direction",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    settings = dict(train_direction.default_settings, epochs=args.epochs)
+    config = dict(train_direction.default_config)
+    if args.path_training is not None:
+        settings["path_training"] = os.path.join(args.path_training, "")
+    if args.path_test is not None:
+        settings["path_test"] = os.path.join(args.path_test, "")
+    for item in args.set:
+        key, _, value = item.partition("=")
+        value = train_direction.parse_value(value)
+        if key in config:
+            config[key] = value
+        else:
+            settings[key] = value
+    data = train_direction.load_data(settings)
+
+    histories = {
+        sampler: convergence(
+            train_direction, config, settings, data, sampler, args.seed
+        )
+        for sampler in ["uniform", "prioritized"]
+    }
+    target = histories["uniform"][-1][1]
+    print("Target test loss (uniform, last epoch): {:.6f}".format(target))
+    for sampler, history in histories.items():
+        print(
+            "{}: ".format(sampler)
+            + ", ".join("{:.6f}".format(loss) for _, loss, _ in history)
+        )
+        reached = [
+            (epoch, seconds) for epoch, loss, seconds in history if loss <= target
+        ]
+        if len(reached) > 0:
+            print(
+                "  reached the target after {} epochs ({:.1f}s)".format(
+                    reached[0][0] + 1, reached[0][1]
+                )
+            )
+        else:
+            print("  target not reached ({:.1f}s)".format(history[-1][2]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import numpy as np
+
+# NumPy counterparts of Unity.Mathematics/MathExtensions used to replay the
+# Unity controllers offline. Quaternions are (x, y, z, w) as in rotations_torch.
+
+
+def mul_quat(quaternions1: np.ndarray, quaternions2: np.ndarray) -> np.ndarray:
+    """
+    Multiplies two quaternions (not standardized, as math.mul in Unity).
+    Args:
+        quaternions1: (x, y, z, w) as array of shape (..., 4).
+        quaternions2: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    x1, y1, z1, w1 = np.moveaxis(quaternions1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(quaternions2, -1, 0)
+    rw = w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2
+    rx = w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2
+    ry = w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2
+    rz = w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2
+    return np.stack((rx, ry, rz, rw), -1)
+
+
+def inverse_quat(quaternions: np.ndarray) -> np.ndarray:
+    """
+    Inverse of unit quaternions (conjugate).
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    return quaternions * np.array([-1.0, -1.0, -1.0, 1.0], dtype=quaternions.dtype)
+
+
+def mul_quat_vec(quaternions: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """
+    Rotates vectors by unit quaternions.
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+        vectors: as array of shape (..., 3).
+    Returns:
+        vectors: as array of shape (..., 3).
+    """
+    q = quaternions[..., :3]
+    w = quaternions[..., 3:]
+    t = 2.0 * np.cross(q, vectors)
+    return vectors + w * t + np.cross(q, t)
+
+
+def abs_quat(quaternions: np.ndarray) -> np.ndarray:
+    """
+    Forces the quaternions to take the shortest path (w >= 0).
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    return np.where(quaternions[..., 3:] < 0.0, -quaternions, quaternions)
+
+
+def quat_to_scaled_angle_axis(quaternions: np.ndarray, eps=1e-8) -> np.ndarray:
+    """
+    Logarithm map of unit quaternions scaled by 2 (axis * angle).
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        scaled angle axis: as array of shape (..., 3).
+    """
+    v = quaternions[..., :3]
+    length = np.linalg.norm(v, axis=-1, keepdims=True)
+    half_angle = np.arccos(np.clip(quaternions[..., 3:], -1.0, 1.0))
+    scale = np.where(length < eps, 1.0, half_angle / np.maximum(length, eps))
+    return 2.0 * v * scale
+
+
+def quat_from_scaled_angle_axis(angle_axis: np.ndarray, eps=1e-8) -> np.ndarray:
+    """
+    Exponential map of scaled angle axis (axis * angle) to unit quaternions.
+    Args:
+        angle_axis: as array of shape (..., 3).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    v = angle_axis * 0.5
+    half_angle = np.linalg.norm(v, axis=-1, keepdims=True)
+    small = half_angle < eps
+    s = np.where(small, 1.0, np.sin(half_angle) / np.maximum(half_angle, eps))
+    c = np.where(small, 1.0, np.cos(half_angle))
+    q = np.concatenate((s * v, c), -1)
+    # Small angles are normalized (as in MathExtensions.Exp)
+    return np.where(small, q / np.linalg.norm(q, axis=-1, keepdims=True), q)
+
+
+def quat_from_yaw(angles: np.ndarray) -> np.ndarray:
+    """
+    Rotations around the up axis (y).
+    Args:
+        angles: in radians as array of shape (...).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    angles = np.asarray(angles) * 0.5
+    zeros = np.zeros_like(angles)
+    return np.stack((zeros, np.sin(angles), zeros, np.cos(angles)), -1)
+
+
+def yaw_from_direction(directions: np.ndarray) -> np.ndarray:
+    """
+    Angle around the up axis (y) that rotates forward (0, 0, 1) to the
+    projected direction.
+    Args:
+        directions: as array of shape (..., 3).
+    Returns:
+        angles: in radians as array of shape (...).
+    """
+    return np.arctan2(directions[..., 0], directions[..., 2])
+
+
+def continuous_to_quat(rotations: np.ndarray) -> np.ndarray:
+    """
+    Converts the 6D continuous representation (first two columns of the
+    rotation matrix) to quaternions (as MathExtensions.QuaternionFromContinuous).
+    Args:
+        rotations: (c0.x, c0.y, c0.z, c1.x, c1.y, c1.z) as array of shape (..., 6).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    """
+    a1 = rotations[..., 0:3]
+    a2 = rotations[..., 3:6]
+    b1 = a1 / np.linalg.norm(a1, axis=-1, keepdims=True)
+    b2 = a2 - np.sum(b1 * a2, axis=-1, keepdims=True) * b1
+    b2 = b2 / np.linalg.norm(b2, axis=-1, keepdims=True)
+    b3 = np.cross(b1, b2)
+    return matrix_to_quat(np.stack((b1, b2, b3), -1))
+
+
+def matrix_to_quat(matrices: np.ndarray) -> np.ndarray:
+    """
+    Converts rotation matrices to quaternions.
+    Args:
+        matrices: as array of shape (..., 3, 3) (matrices[..., :, i] is column i).
+    Returns:
+        quaternions: (x, y, z, w) as array of shape (..., 4) with w >= 0.
+    """
+    m = matrices
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    candidates = np.stack(
+        (
+            # w largest
+            np.stack(
+                (
+                    m[..., 2, 1] - m[..., 1, 2],
+                    m[..., 0, 2] - m[..., 2, 0],
+                    m[..., 1, 0] - m[..., 0, 1],
+                    1.0 + m00 + m11 + m22,
+                ),
+                -1,
+            ),
+            # x largest
+            np.stack(
+                (
+                    1.0 + m00 - m11 - m22,
+                    m[..., 0, 1] + m[..., 1, 0],
+                    m[..., 0, 2] + m[..., 2, 0],
+                    m[..., 2, 1] - m[..., 1, 2],
+                ),
+                -1,
+            ),
+            # y largest
+            np.stack(
+                (
+                    m[..., 0, 1] + m[..., 1, 0],
+                    1.0 - m00 + m11 - m22,
+                    m[..., 1, 2] + m[..., 2, 1],
+                    m[..., 0, 2] - m[..., 2, 0],
+                ),
+                -1,
+            ),
+            # z largest
+            np.stack(
+                (
+                    m[..., 0, 2] + m[..., 2, 0],
+                    m[..., 1, 2] + m[..., 2, 1],
+                    1.0 - m00 - m11 + m22,
+                    m[..., 1, 0] - m[..., 0, 1],
+                ),
+                -1,
+            ),
+        ),
+        -2,
+    )
+    # Use the best conditioned candidate (largest component)
+    best = np.argmax(np.stack((m00 + m11 + m22, m00, m11, m22), -1), axis=-1)
+    q = np.take_along_axis(candidates, best[..., None, None], axis=-2)[..., 0, :]
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    return abs_quat(q)
+
+
+def quat_to_matrix(quaternions: np.ndarray) -> np.ndarray:
+    """
+    Converts unit quaternions to rotation matrices.
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        matrices: as array of shape (..., 3, 3) (matrices[..., :, i] is column i).
+    """
+    x, y, z, w = np.moveaxis(quaternions, -1, 0)
+    return np.stack(
+        (
+            np.stack(
+                (1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+                -1,
+            ),
+            np.stack(
+                (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+                -1,
+            ),
+            np.stack(
+                (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)),
+                -1,
+            ),
+        ),
+        -2,
+    )
+
+
+def quat_to_continuous(quaternions: np.ndarray) -> np.ndarray:
+    """
+    Converts quaternions to the 6D continuous representation.
+    Args:
+        quaternions: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        rotations: (c0.x, c0.y, c0.z, c1.x, c1.y, c1.z) as array of shape (..., 6).
+    """
+    m = quat_to_matrix(quaternions)
+    return np.concatenate((m[..., :, 0], m[..., :, 1]), -1)
+
+
+def angle_between_quat(
+    quaternions1: np.ndarray, quaternions2: np.ndarray
+) -> np.ndarray:
+    """
+    Angle (radians) of the rotation between unit quaternions.
+    Args:
+        quaternions1: (x, y, z, w) as array of shape (..., 4).
+        quaternions2: (x, y, z, w) as array of shape (..., 4).
+    Returns:
+        angles: as array of shape (...).
+    """
+    dot = np.abs(np.sum(quaternions1 * quaternions2, axis=-1))
+    return 2.0 * np.arccos(np.clip(dot, -1.0, 1.0))
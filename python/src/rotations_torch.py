@@ -214,6 +214,71 @@ def quat_to_matrix3x3(quaternions: torch.Tensor) -> torch.Tensor:
     return torch.stack([r00, r10, r20, r01, r11, r21, r02, r12, r22], -1)
 
 
+def inverse_quat(quaternions: torch.Tensor) -> torch.Tensor:
+    """
+    Inverse of unit quaternions (conjugate).
+    Args:
+        quaternions: (x, y, z, w) as tensor of shape (..., 4).
+    Returns:
+        quaternions: (x, y, z, w) as tensor of shape (..., 4).
+    """
+    return quaternions * quaternions.new_tensor([-1.0, -1.0, -1.0, 1.0])
+
+
+def mul_quat_vec(quaternions: torch.Tensor, vectors: torch.Tensor) -> torch.Tensor:
+    """
+    Rotates vectors by unit quaternions.
+    Args:
+        quaternions: (x, y, z, w) as tensor of shape (..., 4).
+        vectors: as tensor of shape (..., 3).
+    Returns:
+        vectors: as tensor of shape (..., 3).
+    """
+    q = quaternions[..., :3].expand(vectors.shape[:-1] + (3,))
+    w = quaternions[..., 3:]
+    t = 2.0 * torch.linalg.cross(q, vectors)
+    return vectors + w * t + torch.linalg.cross(q, t)
+
+
+def quat_to_scaled_angle_axis(quaternions: torch.Tensor, eps=1e-8) -> torch.Tensor:
+    """
+    Logarithm map of unit quaternions scaled by 2 (axis * angle).
+    Args:
+        quaternions: (x, y, z, w) as tensor of shape (..., 4).
+    Returns:
+        scaled angle axis: as tensor of shape (..., 3).
+    """
+    v = quaternions[..., :3]
+    length = torch.linalg.norm(v, dim=-1, keepdim=True)
+    half_angle = torch.arccos(torch.clamp(quaternions[..., 3:], -1.0, 1.0))
+    scale = torch.where(
+        length < eps, torch.ones_like(length), half_angle / length.clamp(min=eps)
+    )
+    return 2.0 * v * scale
+
+
+def quat_from_scaled_angle_axis(angle_axis: torch.Tensor, eps=1e-8) -> torch.Tensor:
+    """
+    Exponential map of scaled angle axis (axis * angle) to unit quaternions.
+    Args:
+        angle_axis: as tensor of shape (..., 3).
+    Returns:
+        quaternions: (x, y, z, w) as tensor of shape (..., 4).
+    """
+    v = angle_axis * 0.5
+    half_angle = torch.linalg.norm(v, dim=-1, keepdim=True)
+    small = half_angle < eps
+    s = torch.where(
+        small,
+        torch.ones_like(half_angle),
+        torch.sin(half_angle) / half_angle.clamp(min=eps),
+    )
+    c = torch.where(small, torch.ones_like(half_angle), torch.cos(half_angle))
+    q = torch.cat((s * v, c), -1)
+    # Small angles are normalized (as in MathExtensions.Exp)
+    return torch.where(small, F.normalize(q, dim=-1), q)
+
+
 def test_quat_matrix3x3():
     # Test from Unity
     q1 = torch.tensor([0.0, 0.0, 1.0, -4.371139e-08])
@@ -0,0 +1,36 @@
+import numpy as np
+import serializer_helper as sh
+
+
+class skeleton_dataset:
+    # Reads the skeleton (.mmskeleton) written by PoseSerializer.cs next to the
+    # .mmpose. Joint 0 is the simulation bone (its parent is itself) and joints
+    # are stored after their parents.
+    #   parents: [number_joints] parent index of each joint
+    #   offsets: [number_joints, 3] local offsets
+    #   types: [number_joints] HumanBodyBones (55 is LastBone, i.e., none)
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.number_joints = sh.read_uint(f)
+            self.names = []
+            self.parents = np.zeros(self.number_joints, dtype=np.int64)
+            self.offsets = np.zeros((self.number_joints, 3), dtype=np.float32)
+            self.types = np.zeros(self.number_joints, dtype=np.int64)
+            for i in range(self.number_joints):
+                self.names.append(sh.read_string(f))
+                assert sh.read_uint(f) == i
+                self.parents[i] = sh.read_uint(f)
+                for j in range(3):
+                    self.offsets[i][j] = sh.read_float(f)
+                self.types[i] = sh.read_uint(f)
+
+    def depths(self):
+        # Depth of each joint in the hierarchy (root is 0)
+        depths = np.zeros(self.number_joints, dtype=np.int64)
+        for i in range(1, self.number_joints):
+            assert self.parents[i] < i, "Joints must be stored after their parents"
+            depths[i] = depths[self.parents[i]] + 1
+        return depths
+
+    def find(self, name):
+        return self.names.index(name)
@@ -0,0 +1,362 @@
+import numpy as np
+import rotations_numpy as rot
+
+# NumPy port of MotionMatching/Utils/Spring.cs and the offset decay of
+# MotionMatching/Inertialization/Inertialization.cs (see spring_torch.py)
+# Thanks to: https://theorangeduck.com/page/spring-roll-call
+# Instead of 'ref' arguments, the updated values are returned.
+# Every argument broadcasts, so many characters can be updated at once.
+
+LN2f = 0.69314718056
+
+
+def half_life_to_damping(half_life, eps=1e-5):
+    return (4.0 * LN2f) / (half_life + eps)
+
+
+def fast_negexp(x):
+    return 1.0 / (1.0 + x + 0.48 * x * x + 0.235 * x * x * x)
+
+
+def damp_adjustment_implicit(goal, half_life, dt, eps=1e-5):
+    # Damps a point starting at zero moving toward the desired difference
+    return goal * (1.0 - fast_negexp((LN2f * dt) / (half_life + eps)))
+
+
+def damp_adjustment_implicit_quat(goal, half_life, dt, eps=1e-5):
+    # Damps a rotation starting at the identity toward the desired difference
+    t = 1.0 - fast_negexp((LN2f * dt) / (half_life + eps))
+    return slerp_identity(goal, t)
+
+
+def slerp_identity(goal, t):
+    # math.slerp(quaternion.identity, goal, t)
+    t = np.asarray(t)[..., None] if np.ndim(t) > 0 else t
+    identity = np.zeros_like(goal)
+    identity[..., 3] = 1.0
+    dot = goal[..., 3:]
+    goal = np.where(dot < 0.0, -goal, goal)
+    dot = np.abs(dot)
+    angle = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_angle = np.sin(angle)
+    linear = sin_angle < 1e-6
+    sin_angle = np.where(linear, 1.0, sin_angle)
+    w0 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * angle) / sin_angle)
+    w1 = np.where(linear, t, np.sin(t * angle) / sin_angle)
+    q = w0 * identity + w1 * goal
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def character_position_update(
+    pos, velocity, acceleration, velocity_goal, half_life, delta_time
+):
+    # Returns the new position, velocity and acceleration after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = velocity - velocity_goal
+    j1 = acceleration + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_pos = (
+        eyedt * (((-j1) / (y * y)) + ((-j0 - j1 * delta_time) / y))
+        + (j1 / (y * y))
+        + j0 / y
+        + velocity_goal * delta_time
+        + pos
+    )
+    new_velocity = eyedt * (j0 + j1 * delta_time) + velocity_goal
+    new_acceleration = eyedt * (acceleration - j1 * y * delta_time)
+    return new_pos, new_velocity, new_acceleration
+
+
+def simple_spring_damper_implicit_quat(
+    rot_q, angular_vel, rot_goal, half_life, delta_time
+):
+    # Returns the new rotation and angular velocity after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = rot.quat_to_scaled_angle_axis(
+        rot.abs_quat(rot.mul_quat(rot_q, rot.inverse_quat(rot_goal)))
+    )
+    j1 = angular_vel + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_rot = rot.mul_quat(
+        rot.quat_from_scaled_angle_axis(eyedt * (j0 + j1 * delta_time)), rot_goal
+    )
+    new_angular_vel = eyedt * (angular_vel - j1 * y * delta_time)
+    return new_rot, new_angular_vel
+
+
+def character_rotation_update(
+    rot_q,
+    angular_velocity,
+    angular_acceleration,
+    angular_velocity_goal,
+    half_life,
+    delta_time,
+):
+    # Returns the new rotation, angular velocity and angular acceleration
+    scaled_angle_axis, angular_velocity, angular_acceleration = (
+        character_position_update(
+            rot.quat_to_scaled_angle_axis(rot_q),
+            angular_velocity,
+            angular_acceleration,
+            angular_velocity_goal,
+            half_life,
+            delta_time,
+        )
+    )
+    return (
+        rot.quat_from_scaled_angle_axis(scaled_angle_axis),
+        angular_velocity,
+        angular_acceleration,
+    )
+
+
+def simple_spring_damper_implicit(pos, velocity, pos_goal, half_life, delta_time):
+    # Returns the new position and velocity after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = pos - pos_goal
+    j1 = velocity + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_pos = eyedt * (j0 + j1 * delta_time) + pos_goal
+    new_velocity = eyedt * (velocity - j1 * y * delta_time)
+    return new_pos, new_velocity
+
+
+def decay_spring_damper_implicit(pos, velocity, half_life, delta_time, steps=1):
+    # Spring toward zero, returns the new position and velocity after 'steps'
+    # updates of delta_time. The update is linear and j1 = velocity + pos * y
+    # decays by eyedt every update, so n updates are exactly
+    #   pos = eyedt^n * (pos + j1 * n * delta_time)
+    # (the same values as n calls, instead of fast_negexp(y * n * delta_time))
+    y = half_life_to_damping(half_life) / 2.0
+    j1 = velocity + pos * y
+    eyedt = fast_negexp(y * delta_time) ** steps
+    t = steps * delta_time
+
+    new_pos = eyedt * (pos + j1 * t)
+    new_velocity = eyedt * (velocity - j1 * y * t)
+    return new_pos, new_velocity
+
+
+def decay_spring_damper_implicit_quat(
+    rot_q, angular_vel, half_life, delta_time, steps=1
+):
+    # Spring toward the identity (see decay_spring_damper_implicit)
+    scaled_angle_axis, angular_vel = decay_spring_damper_implicit(
+        rot.quat_to_scaled_angle_axis(rot_q), angular_vel, half_life, delta_time, steps
+    )
+    return rot.quat_from_scaled_angle_axis(scaled_angle_axis), angular_vel
+
+
+def simple_spring_damper_implicit_quat_sequence(
+    rot_q, angular_vel, rot_goals, half_life, delta_time
+):
+    # Updates toward rot_goals[..., t, :] every frame t (leading dimensions,
+    # e.g., sessions, are updated at once). Returns the rotations [..., T, 4]
+    # and angular velocities [..., T, 3] after every update
+    rotations = np.zeros(rot_goals.shape, dtype=rot_goals.dtype)
+    angular_velocities = np.zeros(rot_goals.shape[:-1] + (3,), dtype=rot_goals.dtype)
+    for t in range(rot_goals.shape[-2]):
+        rot_q, angular_vel = simple_spring_damper_implicit_quat(
+            rot_q, angular_vel, rot_goals[..., t, :], half_life, delta_time
+        )
+        rotations[..., t, :] = rot_q
+        angular_velocities[..., t, :] = angular_vel
+    return rotations, angular_velocities
+
+
+# Inertialization.cs
+def inertialize_transition(source, source_vel, target, target_vel, offset, offset_vel):
+    # Returns the offset and offset velocity from the target to the source
+    # (offsets are accumulated if a previous inertialization is in progress)
+    return (source + offset) - target, (source_vel + offset_vel) - target_vel
+
+
+def inertialize_transition_quat(
+    source_rot, source_ang_vel, target_rot, target_ang_vel, offset_rot, offset_ang_vel
+):
+    offset_rot = rot.abs_quat(
+        rot.mul_quat(rot.inverse_quat(target_rot), rot.mul_quat(source_rot, offset_rot))
+    )
+    offset_rot = offset_rot / np.linalg.norm(offset_rot, axis=-1, keepdims=True)
+    return offset_rot, (source_ang_vel + offset_ang_vel) - target_ang_vel
+
+
+def inertialize_update(target, target_vel, offset, offset_vel, half_life, delta_time):
+    # Returns the inertialized value and velocity and the decayed offsets
+    offset, offset_vel = decay_spring_damper_implicit(
+        offset, offset_vel, half_life, delta_time
+    )
+    return target + offset, target_vel + offset_vel, offset, offset_vel
+
+
+def inertialize_update_quat(
+    target_rot, target_ang_vel, offset_rot, offset_ang_vel, half_life, delta_time
+):
+    offset_rot, offset_ang_vel = decay_spring_damper_implicit_quat(
+        offset_rot, offset_ang_vel, half_life, delta_time
+    )
+    return (
+        rot.mul_quat(target_rot, offset_rot),
+        target_ang_vel + offset_ang_vel,
+        offset_rot,
+        offset_ang_vel,
+    )
+
+
+def inertialize_sequence(
+    target, target_vel, source, source_vel, transitions, half_life, delta_time
+):
+    # Inertialization of whole sequences [..., T, J, 3] (e.g., sessions, frames,
+    # joints) as done frame by frame by MotionMatchingController: on frames
+    # where transitions[..., T] is True, PoseTransition(source -> target) is
+    # called, then Update(target) is called every frame. source/source_vel are
+    # only read on transitions. Offsets are only computed on transitions, the
+    # rest of the frames decay them in closed form (decay_spring_damper_implicit).
+    # Returns the inertialized values and velocities [..., T, J, 3]
+    offsets, offset_vels, last, steps = _transition_offsets(
+        inertialize_transition,
+        decay_spring_damper_implicit,
+        np.zeros(target.shape[:-3] + target.shape[-2:], dtype=target.dtype),
+        np.zeros(target_vel.shape[:-3] + target_vel.shape[-2:], dtype=target_vel.dtype),
+        target,
+        target_vel,
+        source,
+        source_vel,
+        transitions,
+        half_life,
+        delta_time,
+    )
+    offset, offset_vel = decay_spring_damper_implicit(
+        _gather_transitions(offsets, last),
+        _gather_transitions(offset_vels, last),
+        half_life,
+        delta_time,
+        steps[..., None, None],
+    )
+    return target + offset, target_vel + offset_vel
+
+
+def inertialize_sequence_quat(
+    target_rot,
+    target_ang_vel,
+    source_rot,
+    source_ang_vel,
+    transitions,
+    half_life,
+    delta_time,
+):
+    # Same as inertialize_sequence for joint rotations [..., T, J, 4] and
+    # angular velocities [..., T, J, 3]
+    identity = np.zeros(
+        target_rot.shape[:-3] + target_rot.shape[-2:], dtype=target_rot.dtype
+    )
+    identity[..., 3] = 1.0
+    offset_rots, offset_ang_vels, last, steps = _transition_offsets(
+        inertialize_transition_quat,
+        decay_spring_damper_implicit_quat,
+        identity,
+        np.zeros(
+            target_ang_vel.shape[:-3] + target_ang_vel.shape[-2:],
+            dtype=target_ang_vel.dtype,
+        ),
+        target_rot,
+        target_ang_vel,
+        source_rot,
+        source_ang_vel,
+        transitions,
+        half_life,
+        delta_time,
+    )
+    # Decayed in scaled angle axis (the logarithm is only taken per transition)
+    scaled_angle_axis, offset_ang_vel = decay_spring_damper_implicit(
+        _gather_transitions(rot.quat_to_scaled_angle_axis(offset_rots), last),
+        _gather_transitions(offset_ang_vels, last),
+        half_life,
+        delta_time,
+        steps[..., None, None],
+    )
+    offset_rot = rot.quat_from_scaled_angle_axis(scaled_angle_axis)
+    return rot.mul_quat(target_rot, offset_rot), target_ang_vel + offset_ang_vel
+
+
+def _transition_offsets(
+    transition,
+    decay,
+    offset,
+    offset_vel,
+    target,
+    target_vel,
+    source,
+    source_vel,
+    transitions,
+    half_life,
+    delta_time,
+):
+    # Offsets after every transition [..., K + 1, J, :] (index 0: before the
+    # first one), the index of the last transition of every frame [..., T] and
+    # the number of updates since then (including the frame's own update). Only
+    # the transitions are visited in order: the k-th transition of every
+    # sequence is computed at once
+    batch_shape = transitions.shape[:-1]
+    T = transitions.shape[-1]
+    transitions = transitions.reshape(-1, T)
+    B = transitions.shape[0]
+    reshape = lambda x: x.reshape((B, T) + x.shape[-2:])
+    target, target_vel, source, source_vel = map(
+        reshape, (target, target_vel, source, source_vel)
+    )
+    offset = offset.reshape((B,) + offset.shape[-2:])
+    offset_vel = offset_vel.reshape((B,) + offset_vel.shape[-2:])
+    counts = transitions.sum(-1)
+    K = int(counts.max()) if B > 0 else 0
+    # Transition frames in order (first K columns)
+    frames = np.argsort(~transitions, axis=-1, kind="stable")[:, :K]
+    rows = np.arange(B)
+    offsets = np.zeros((B, K + 1) + offset.shape[-2:], dtype=offset.dtype)
+    offset_vels = np.zeros((B, K + 1) + offset_vel.shape[-2:], dtype=offset_vel.dtype)
+    offsets[:, 0] = offset  # before the first transition (decaying it is a no-op)
+    offset_vels[:, 0] = offset_vel
+    previous_frame = np.zeros(B, dtype=np.int64)
+    for k in range(K):
+        frame = frames[:, k]
+        valid = (k < counts)[:, None, None]
+        # Decayed by the updates since the previous transition
+        steps = np.maximum(frame - previous_frame, 0)[:, None, None].astype(
+            offset.dtype
+        )
+        new_offset, new_offset_vel = transition(
+            source[rows, frame],
+            source_vel[rows, frame],
+            target[rows, frame],
+            target_vel[rows, frame],
+            *decay(offset, offset_vel, half_life, delta_time, steps)
+        )
+        offset = np.where(valid, new_offset, offset)
+        offset_vel = np.where(valid, new_offset_vel, offset_vel)
+        offsets[:, k + 1] = offset
+        offset_vels[:, k + 1] = offset_vel
+        previous_frame = np.where(valid[:, 0, 0], frame, previous_frame)
+    # Last transition of every frame (0: none)
+    last = np.cumsum(transitions, axis=-1)
+    last_frame = (
+        np.where(
+            last > 0, np.take_along_axis(frames, np.maximum(last - 1, 0), axis=-1), -1
+        )
+        if K > 0
+        else np.full((B, T), -1)
+    )
+    steps = np.where(last > 0, np.arange(T) - last_frame + 1, 0).astype(offset.dtype)
+    return (
+        offsets.reshape(batch_shape + offsets.shape[1:]),
+        offset_vels.reshape(batch_shape + offset_vels.shape[1:]),
+        last.reshape(batch_shape + (T,)),
+        steps.reshape(batch_shape + (T,)),
+    )
+
+
+def _gather_transitions(values, last):
+    # values[..., last[..., t], J, :] for every frame t
+    return np.take_along_axis(values, last[..., None, None], axis=-3)
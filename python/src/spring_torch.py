@@ -0,0 +1,337 @@
+import torch
+import torch.nn.functional as F
+import rotations_torch as rot
+
+# PyTorch version of spring.py (same functions and arguments), to update
+# batches of [sessions, frames, joints] on the GPU or inside a model.
+# Quaternions are standardized (w >= 0) by rotations_torch.mul_quat.
+
+LN2f = 0.69314718056
+
+
+def half_life_to_damping(half_life, eps=1e-5):
+    return (4.0 * LN2f) / (half_life + eps)
+
+
+def fast_negexp(x):
+    return 1.0 / (1.0 + x + 0.48 * x * x + 0.235 * x * x * x)
+
+
+def damp_adjustment_implicit(goal, half_life, dt, eps=1e-5):
+    # Damps a point starting at zero moving toward the desired difference
+    return goal * (1.0 - fast_negexp((LN2f * dt) / (half_life + eps)))
+
+
+def damp_adjustment_implicit_quat(goal, half_life, dt, eps=1e-5):
+    # Damps a rotation starting at the identity toward the desired difference
+    t = 1.0 - fast_negexp((LN2f * dt) / (half_life + eps))
+    return slerp_identity(goal, t)
+
+
+def slerp_identity(goal, t):
+    # math.slerp(quaternion.identity, goal, t)
+    t = torch.as_tensor(t, dtype=goal.dtype, device=goal.device)
+    t = t.unsqueeze(-1) if t.dim() > 0 else t
+    identity = torch.zeros_like(goal)
+    identity[..., 3] = 1.0
+    goal = rot.standardize_quaternion(goal)
+    angle = torch.arccos(torch.clamp(goal[..., 3:], -1.0, 1.0))
+    sin_angle = torch.sin(angle)
+    linear = sin_angle < 1e-6
+    sin_angle = torch.where(linear, torch.ones_like(sin_angle), sin_angle)
+    w0 = torch.where(linear, 1.0 - t, torch.sin((1.0 - t) * angle) / sin_angle)
+    w1 = torch.where(linear, t, torch.sin(t * angle) / sin_angle)
+    return F.normalize(w0 * identity + w1 * goal, dim=-1)
+
+
+def character_position_update(
+    pos, velocity, acceleration, velocity_goal, half_life, delta_time
+):
+    # Returns the new position, velocity and acceleration after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = velocity - velocity_goal
+    j1 = acceleration + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_pos = (
+        eyedt * (((-j1) / (y * y)) + ((-j0 - j1 * delta_time) / y))
+        + (j1 / (y * y))
+        + j0 / y
+        + velocity_goal * delta_time
+        + pos
+    )
+    new_velocity = eyedt * (j0 + j1 * delta_time) + velocity_goal
+    new_acceleration = eyedt * (acceleration - j1 * y * delta_time)
+    return new_pos, new_velocity, new_acceleration
+
+
+def character_rotation_update(
+    rot_q,
+    angular_velocity,
+    angular_acceleration,
+    angular_velocity_goal,
+    half_life,
+    delta_time,
+):
+    # Returns the new rotation, angular velocity and angular acceleration
+    scaled_angle_axis, angular_velocity, angular_acceleration = (
+        character_position_update(
+            rot.quat_to_scaled_angle_axis(rot_q),
+            angular_velocity,
+            angular_acceleration,
+            angular_velocity_goal,
+            half_life,
+            delta_time,
+        )
+    )
+    return (
+        rot.quat_from_scaled_angle_axis(scaled_angle_axis),
+        angular_velocity,
+        angular_acceleration,
+    )
+
+
+def simple_spring_damper_implicit(pos, velocity, pos_goal, half_life, delta_time):
+    # Returns the new position and velocity after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = pos - pos_goal
+    j1 = velocity + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_pos = eyedt * (j0 + j1 * delta_time) + pos_goal
+    new_velocity = eyedt * (velocity - j1 * y * delta_time)
+    return new_pos, new_velocity
+
+
+def simple_spring_damper_implicit_quat(
+    rot_q, angular_vel, rot_goal, half_life, delta_time
+):
+    # Returns the new rotation and angular velocity after delta_time
+    y = half_life_to_damping(half_life) / 2.0
+    j0 = rot.quat_to_scaled_angle_axis(rot.mul_quat(rot_q, rot.inverse_quat(rot_goal)))
+    j1 = angular_vel + j0 * y
+    eyedt = fast_negexp(y * delta_time)
+
+    new_rot = rot.mul_quat(
+        rot.quat_from_scaled_angle_axis(eyedt * (j0 + j1 * delta_time)), rot_goal
+    )
+    new_angular_vel = eyedt * (angular_vel - j1 * y * delta_time)
+    return new_rot, new_angular_vel
+
+
+def decay_spring_damper_implicit(pos, velocity, half_life, delta_time, steps=1):
+    # Spring toward zero after 'steps' updates of delta_time (closed form, see
+    # spring.decay_spring_damper_implicit)
+    y = half_life_to_damping(half_life) / 2.0
+    j1 = velocity + pos * y
+    eyedt = fast_negexp(y * delta_time) ** steps
+    t = steps * delta_time
+
+    new_pos = eyedt * (pos + j1 * t)
+    new_velocity = eyedt * (velocity - j1 * y * t)
+    return new_pos, new_velocity
+
+
+def decay_spring_damper_implicit_quat(
+    rot_q, angular_vel, half_life, delta_time, steps=1
+):
+    # Spring toward the identity (see decay_spring_damper_implicit)
+    scaled_angle_axis, angular_vel = decay_spring_damper_implicit(
+        rot.quat_to_scaled_angle_axis(rot_q), angular_vel, half_life, delta_time, steps
+    )
+    return rot.quat_from_scaled_angle_axis(scaled_angle_axis), angular_vel
+
+
+def simple_spring_damper_implicit_quat_sequence(
+    rot_q, angular_vel, rot_goals, half_life, delta_time
+):
+    # Updates toward rot_goals[..., t, :] every frame t. Returns the rotations
+    # [..., T, 4] and angular velocities [..., T, 3] after every update
+    rotations = []
+    angular_velocities = []
+    for t in range(rot_goals.shape[-2]):
+        rot_q, angular_vel = simple_spring_damper_implicit_quat(
+            rot_q, angular_vel, rot_goals[..., t, :], half_life, delta_time
+        )
+        rotations.append(rot_q)
+        angular_velocities.append(angular_vel)
+    return torch.stack(rotations, -2), torch.stack(angular_velocities, -2)
+
+
+# Inertialization.cs
+def inertialize_transition(source, source_vel, target, target_vel, offset, offset_vel):
+    # Returns the offset and offset velocity from the target to the source
+    # (offsets are accumulated if a previous inertialization is in progress)
+    return (source + offset) - target, (source_vel + offset_vel) - target_vel
+
+
+def inertialize_transition_quat(
+    source_rot, source_ang_vel, target_rot, target_ang_vel, offset_rot, offset_ang_vel
+):
+    offset_rot = rot.mul_quat(
+        rot.inverse_quat(target_rot), rot.mul_quat(source_rot, offset_rot)
+    )
+    return (
+        F.normalize(offset_rot, dim=-1),
+        (source_ang_vel + offset_ang_vel) - target_ang_vel,
+    )
+
+
+def inertialize_update(target, target_vel, offset, offset_vel, half_life, delta_time):
+    # Returns the inertialized value and velocity and the decayed offsets
+    offset, offset_vel = decay_spring_damper_implicit(
+        offset, offset_vel, half_life, delta_time
+    )
+    return target + offset, target_vel + offset_vel, offset, offset_vel
+
+
+def inertialize_update_quat(
+    target_rot, target_ang_vel, offset_rot, offset_ang_vel, half_life, delta_time
+):
+    offset_rot, offset_ang_vel = decay_spring_damper_implicit_quat(
+        offset_rot, offset_ang_vel, half_life, delta_time
+    )
+    return (
+        rot.mul_quat(target_rot, offset_rot),
+        target_ang_vel + offset_ang_vel,
+        offset_rot,
+        offset_ang_vel,
+    )
+
+
+def inertialize_sequence(
+    target, target_vel, source, source_vel, transitions, half_life, delta_time
+):
+    # Inertialization of whole sequences [..., T, J, 3] (see
+    # spring.inertialize_sequence)
+    offsets, offset_vels, last, steps = _transition_offsets(
+        inertialize_transition,
+        decay_spring_damper_implicit,
+        target.new_zeros(target.shape[:-3] + target.shape[-2:]),
+        target_vel.new_zeros(target_vel.shape[:-3] + target_vel.shape[-2:]),
+        target,
+        target_vel,
+        source,
+        source_vel,
+        transitions,
+        half_life,
+        delta_time,
+    )
+    offset, offset_vel = decay_spring_damper_implicit(
+        _gather_transitions(offsets, last),
+        _gather_transitions(offset_vels, last),
+        half_life,
+        delta_time,
+        steps[..., None, None],
+    )
+    return target + offset, target_vel + offset_vel
+
+
+def inertialize_sequence_quat(
+    target_rot,
+    target_ang_vel,
+    source_rot,
+    source_ang_vel,
+    transitions,
+    half_life,
+    delta_time,
+):
+    # Same as inertialize_sequence for joint rotations [..., T, J, 4] and
+    # angular velocities [..., T, J, 3]
+    identity = target_rot.new_zeros(target_rot.shape[:-3] + target_rot.shape[-2:])
+    identity[..., 3] = 1.0
+    offset_rots, offset_ang_vels, last, steps = _transition_offsets(
+        inertialize_transition_quat,
+        decay_spring_damper_implicit_quat,
+        identity,
+        target_ang_vel.new_zeros(target_ang_vel.shape[:-3] + target_ang_vel.shape[-2:]),
+        target_rot,
+        target_ang_vel,
+        source_rot,
+        source_ang_vel,
+        transitions,
+        half_life,
+        delta_time,
+    )
+    scaled_angle_axis, offset_ang_vel = decay_spring_damper_implicit(
+        _gather_transitions(rot.quat_to_scaled_angle_axis(offset_rots), last),
+        _gather_transitions(offset_ang_vels, last),
+        half_life,
+        delta_time,
+        steps[..., None, None],
+    )
+    offset_rot = rot.quat_from_scaled_angle_axis(scaled_angle_axis)
+    return rot.mul_quat(target_rot, offset_rot), target_ang_vel + offset_ang_vel
+
+
+def _transition_offsets(
+    transition,
+    decay,
+    offset,
+    offset_vel,
+    target,
+    target_vel,
+    source,
+    source_vel,
+    transitions,
+    half_life,
+    delta_time,
+):
+    # See spring._transition_offsets
+    batch_shape = transitions.shape[:-1]
+    T = transitions.shape[-1]
+    transitions = transitions.reshape(-1, T)
+    B = transitions.shape[0]
+    target, target_vel, source, source_vel = (
+        x.reshape((B, T) + x.shape[-2:])
+        for x in (target, target_vel, source, source_vel)
+    )
+    offset = offset.reshape((B,) + offset.shape[-2:])
+    offset_vel = offset_vel.reshape((B,) + offset_vel.shape[-2:])
+    counts = transitions.sum(-1)
+    K = int(counts.max()) if B > 0 else 0
+    # Transition frames in order (first K columns)
+    frames = torch.argsort((~transitions).to(torch.int8), dim=-1, stable=True)[:, :K]
+    rows = torch.arange(B, device=transitions.device)
+    offsets = [offset]  # before the first transition (decaying it is a no-op)
+    offset_vels = [offset_vel]
+    previous_frame = torch.zeros(B, dtype=torch.int64, device=transitions.device)
+    for k in range(K):
+        frame = frames[:, k]
+        valid = (k < counts)[:, None, None]
+        # Decayed by the updates since the previous transition
+        steps = torch.clamp(frame - previous_frame, min=0)[:, None, None]
+        new_offset, new_offset_vel = transition(
+            source[rows, frame],
+            source_vel[rows, frame],
+            target[rows, frame],
+            target_vel[rows, frame],
+            *decay(offset, offset_vel, half_life, delta_time, steps.to(offset.dtype))
+        )
+        offset = torch.where(valid, new_offset, offset)
+        offset_vel = torch.where(valid, new_offset_vel, offset_vel)
+        offsets.append(offset)
+        offset_vels.append(offset_vel)
+        previous_frame = torch.where(valid[:, 0, 0], frame, previous_frame)
+    # Last transition of every frame (0: none)
+    last = torch.cumsum(transitions.to(torch.int64), dim=-1)
+    if K > 0:
+        last_frame = torch.gather(frames, -1, torch.clamp(last - 1, min=0))
+    else:
+        last_frame = torch.zeros_like(last)
+    steps = torch.arange(T, device=transitions.device) - last_frame + 1
+    steps = torch.where(last > 0, steps, torch.zeros_like(steps)).to(offset.dtype)
+    offsets = torch.stack(offsets, 1)
+    offset_vels = torch.stack(offset_vels, 1)
+    return (
+        offsets.reshape(batch_shape + offsets.shape[1:]),
+        offset_vels.reshape(batch_shape + offset_vels.shape[1:]),
+        last.reshape(batch_shape + (T,)),
+        steps.reshape(batch_shape + (T,)),
+    )
+
+
+def _gather_transitions(values, last):
+    # values[..., last[..., t], J, :] for every frame t
+    index = last[..., None, None].expand(last.shape + values.shape[-2:])
+    return torch.gather(values, -3, index)
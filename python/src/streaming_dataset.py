@@ -0,0 +1,147 @@
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset
+from torch.utils.data import get_worker_info
+import trackers_info_dataset
+import pose_dataset
+
+
+class streaming_dataset(IterableDataset):
+    # Streams training windows from memory-mapped .mstrackers/.mspose files, so
+    # memory stays flat regardless of the dataset size.
+    # Frames are read in large sequential chunks, and windows go through a
+    # bounded shuffle buffer. Chunks are sharded among DataLoader workers.
+    # Each item is already a batch (use DataLoader(..., batch_size=None)):
+    #   trackers: [batch, number_recursions, number_features] frames idx..idx+R-1
+    #   previous_dir: [batch, 6] pose (direction) at frame idx-1
+    #   target_dir: [batch, 6] pose (direction) at frame idx+R-1
+    # which are the same start indices (idx) used by dataset_input
+    def __init__(
+        self,
+        path_trackers,
+        path_poses,
+        number_recursions,
+        batch_size,
+        chunk_size=65536,
+        shuffle_buffer=4096,
+        shuffle=True,
+        seed=0,
+    ):
+        # Only the headers are read here, files are memory-mapped by each worker
+        self.path_trackers = path_trackers
+        self.path_poses = path_poses
+        trackers_header = trackers_info_dataset.trackers_info_dataset(
+            path_trackers, only_mean_std=True
+        )
+        poses_header = pose_dataset.pose_dataset(path_poses, only_mean_std=True)
+        assert trackers_header.number_poses == poses_header.number_poses
+        self.number_poses = trackers_header.number_poses
+        self.number_features = trackers_header.number_features
+        self.number_recursions = number_recursions
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.shuffle_buffer = max(shuffle_buffer, batch_size)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        # Start indices: [first, end)
+        self.first = 1
+        self.end = max(self.first, self.number_poses - number_recursions)
+
+    def __len__(self):
+        # Number of windows (not batches)
+        return self.end - self.first
+
+    def set_epoch(self, epoch):
+        # Chunk order and shuffling only depend on (seed, epoch)
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id = 0 if worker is None else worker.id
+        number_workers = 1 if worker is None else worker.num_workers
+        rng = np.random.default_rng((self.seed, self.epoch, worker_id))
+
+        trackers = trackers_info_dataset.trackers_info_dataset(
+            self.path_trackers, memmap=True
+        ).info
+        poses = pose_dataset.pose_dataset(self.path_poses, memmap=True).poses
+
+        chunks = np.arange(self.first, self.end, self.chunk_size)
+        if self.shuffle:
+            chunks = np.random.default_rng((self.seed, self.epoch)).permutation(chunks)
+        chunks = chunks[worker_id::number_workers]
+
+        if self.shuffle:
+            return self._iter_shuffled(chunks, trackers, poses, rng)
+        return self._iter_sequential(chunks, trackers, poses)
+
+    def _read_chunk(self, chunk_start, trackers, poses):
+        # One sequential read covers every window starting in the chunk
+        chunk_end = min(chunk_start + self.chunk_size, self.end)
+        last = chunk_end + self.number_recursions - 1
+        chunk_trackers = np.array(trackers[chunk_start:last], dtype=np.float32)
+        chunk_poses = np.array(poses[chunk_start - 1 : last, :6], dtype=np.float32)
+        return chunk_trackers, chunk_poses, chunk_end - chunk_start
+
+    def _windows(self, chunk_trackers, chunk_poses, starts):
+        # 'starts' are relative to the chunk
+        offsets = np.arange(self.number_recursions)
+        return (
+            chunk_trackers[starts[:, None] + offsets],
+            chunk_poses[starts],
+            chunk_poses[starts + self.number_recursions],
+        )
+
+    def _to_batch(self, windows):
+        return tuple(torch.from_numpy(w) for w in windows)
+
+    def _iter_sequential(self, chunks, trackers, poses):
+        for chunk_start in chunks:
+            chunk_trackers, chunk_poses, number_windows = self._read_chunk(
+                chunk_start, trackers, poses
+            )
+            for start in range(0, number_windows, self.batch_size):
+                starts = np.arange(start, min(start + self.batch_size, number_windows))
+                yield self._to_batch(
+                    self._windows(chunk_trackers, chunk_poses, starts)
+                )
+
+    def _iter_shuffled(self, chunks, trackers, poses, rng):
+        buffer = (
+            np.empty(
+                (self.shuffle_buffer, self.number_recursions, self.number_features),
+                dtype=np.float32,
+            ),
+            np.empty((self.shuffle_buffer, 6), dtype=np.float32),
+            np.empty((self.shuffle_buffer, 6), dtype=np.float32),
+        )
+        count = 0
+        for chunk_start in chunks:
+            chunk_trackers, chunk_poses, number_windows = self._read_chunk(
+                chunk_start, trackers, poses
+            )
+            order = rng.permutation(number_windows)
+            i = 0
+            # Fill the buffer
+            if count < self.shuffle_buffer:
+                n = min(self.shuffle_buffer - count, number_windows)
+                windows = self._windows(chunk_trackers, chunk_poses, order[:n])
+                for b, w in zip(buffer, windows):
+                    b[count : count + n] = w
+                count += n
+                i = n
+            # Emit random elements of the buffer and replace them with new windows
+            while i < number_windows:
+                n = min(self.batch_size, number_windows - i)
+                slots = rng.choice(self.shuffle_buffer, size=n, replace=False)
+                yield self._to_batch(tuple(b[slots] for b in buffer))
+                windows = self._windows(chunk_trackers, chunk_poses, order[i : i + n])
+                for b, w in zip(buffer, windows):
+                    b[slots] = w
+                i += n
+        # Drain
+        order = rng.permutation(count)
+        for start in range(0, count, self.batch_size):
+            slots = order[start : start + self.batch_size]
+            yield self._to_batch(tuple(b[slots] for b in buffer))
@@ -0,0 +1,209 @@
+import argparse
+import numpy as np
+import torch
+import feedforward
+import pose_dataset
+import rotations_numpy as rot
+import trackers_info_dataset
+import train_direction
+
+# Continuous (2-axis) representation of the identity rotation
+identity_direction = np.array([1.0, 0.0, 0.0, 0.0, 1.0, 0.0], dtype=np.float32)
+
+
+class streaming_predictor:
+    # Frame by frame direction prediction for one or more avatars, as done by
+    # VRDirectionPredictor.cs: the input is the current tracker features plus
+    # the previous predicted direction (autoregressive state kept per avatar).
+    # Inputs and outputs are not normalized, the mean/std of the training set
+    # are used to normalize them for the network.
+    # With skip_threshold > 0 the network is only evaluated for an avatar when
+    # its normalized tracker features changed more than skip_threshold (max
+    # absolute difference) since its last evaluation, or when refresh_interval
+    # frames passed since then; otherwise its previous direction is reused.
+    def __init__(
+        self,
+        checkpoint,
+        path_trackers,
+        path_poses,
+        number_avatars=1,
+        device="cpu",
+        skip_threshold=0.0,
+        refresh_interval=30,
+    ):
+        # 'checkpoint' is a checkpoint file or folder (see train_direction.load_checkpoint)
+        # path_trackers/path_poses are the training .mstrackers/.mspose (only headers are read)
+        trackers_header = trackers_info_dataset.trackers_info_dataset(
+            path_trackers, only_mean_std=True
+        )
+        poses_header = pose_dataset.pose_dataset(path_poses, only_mean_std=True)
+        self.device = device
+        self.number_features = trackers_header.number_features
+        self.trackers_mean = torch.tensor(trackers_header.mean, dtype=torch.float32)
+        self.trackers_std = torch.tensor(trackers_header.std, dtype=torch.float32)
+        self.dir_mean = torch.tensor(poses_header.mean[:6], dtype=torch.float32)
+        self.dir_std = torch.tensor(poses_header.std[:6], dtype=torch.float32)
+        self.skip_threshold = skip_threshold
+        self.refresh_interval = refresh_interval
+
+        state = train_direction.load_checkpoint(checkpoint, device)
+        self.model = feedforward.FeedForward(
+            None,
+            None,
+            None,
+            None,
+            self.number_features + 6,
+            state["config"]["hidden_size"],
+            state["config"]["number_hidden_layers"],
+            6,
+            1,
+            device,
+        ).to(device)
+        self.model.load_state_dict(state["model"])
+        self.model.eval()
+        self.reset(number_avatars)
+
+    def reset(self, number_avatars=None):
+        # Every avatar starts looking forward (identity direction)
+        if number_avatars is None:
+            number_avatars = self.previous_dir.shape[0]
+        self.previous_dir = torch.from_numpy(
+            np.tile(identity_direction, (number_avatars, 1))
+        )
+        # Normalized trackers of the last evaluation (NaN: evaluate next frame)
+        # and frames since then, used by the skipping
+        self.last_trackers = torch.full((number_avatars, self.number_features), np.nan)
+        self.frames_since_evaluation = torch.zeros(number_avatars, dtype=torch.int64)
+        self.evaluated_frames = 0
+        self.skipped_frames = 0
+
+    def reset_avatar(self, avatar):
+        self.previous_dir[avatar] = torch.from_numpy(identity_direction)
+        self.last_trackers[avatar] = np.nan
+        self.frames_since_evaluation[avatar] = 0
+
+    @torch.no_grad()
+    def predict(self, trackers, avatars=None):
+        # trackers: [number_avatars, number_features] (or [len(avatars), ...])
+        # Returns the predicted directions [.., 6] (continuous representation
+        # relative to the HMD projected on the ground)
+        trackers = torch.as_tensor(np.asarray(trackers, dtype=np.float32))
+        trackers = (trackers - self.trackers_mean) / self.trackers_std
+        if self.skip_threshold <= 0.0:
+            self.evaluated_frames += trackers.shape[0]
+            return self._evaluate(trackers, avatars).numpy()
+        rows = (
+            torch.arange(self.previous_dir.shape[0])
+            if avatars is None
+            else torch.as_tensor(avatars)
+        )
+        # NaN (never evaluated) compares as False, so it is evaluated
+        delta = torch.amax(torch.abs(trackers - self.last_trackers[rows]), dim=-1)
+        skip = (delta < self.skip_threshold) & (
+            self.frames_since_evaluation[rows] + 1 < self.refresh_interval
+        )
+        evaluate = ~skip
+        rows_evaluated = rows[evaluate]
+        if rows_evaluated.shape[0] > 0:
+            self._evaluate(trackers[evaluate], rows_evaluated)
+            self.last_trackers[rows_evaluated] = trackers[evaluate]
+        self.frames_since_evaluation[rows] = torch.where(
+            skip, self.frames_since_evaluation[rows] + 1, 0
+        )
+        self.evaluated_frames += rows_evaluated.shape[0]
+        self.skipped_frames += rows.shape[0] - rows_evaluated.shape[0]
+        return self.previous_dir[rows].numpy()
+
+    def _evaluate(self, trackers, avatars):
+        # trackers are normalized, updates and returns the avatars' directions
+        previous_dir = (
+            self.previous_dir if avatars is None else self.previous_dir[avatars]
+        )
+        input = torch.cat(
+            (trackers, (previous_dir - self.dir_mean) / self.dir_std), dim=-1
+        ).to(self.device)
+        predicted_dir = self.model(input).cpu() * self.dir_std + self.dir_mean
+        if avatars is None:
+            self.previous_dir = predicted_dir
+        else:
+            self.previous_dir[avatars] = predicted_dir
+        return predicted_dir
+
+
+def replay_skipping(predictor, trackers, thresholds, number_avatars):
+    # Replays the (not normalized) trackers [N, F] split in 'number_avatars'
+    # consecutive segments predicted in parallel. Returns, for each threshold,
+    # the fraction of network evaluations saved and the angular error (degrees)
+    # with respect to evaluating every frame
+    frames = trackers.shape[0] // number_avatars
+    segments = trackers[: frames * number_avatars].reshape(number_avatars, frames, -1)
+
+    def run(threshold):
+        predictor.skip_threshold = threshold
+        predictor.reset(number_avatars)
+        directions = np.stack(
+            [predictor.predict(segments[:, i]) for i in range(frames)], axis=1
+        )
+        return directions, predictor.skipped_frames / (frames * number_avatars)
+
+    reference, _ = run(0.0)
+    reference = rot.continuous_to_quat(reference.astype(np.float64))
+    results = []
+    for threshold in thresholds:
+        directions, saved = run(threshold)
+        errors = np.degrees(
+            rot.angle_between_quat(
+                reference, rot.continuous_to_quat(directions.astype(np.float64))
+            )
+        )
+        results.append(
+            {
+                "threshold": threshold,
+                "saved": saved,
+                "mean_error": float(np.mean(errors)),
+                "p95_error": float(np.percentile(errors, 95)),
+                "max_error": float(np.max(errors)),
+            }
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Network evaluations saved by skipping vs angular error"
+    )
+    parser.add_argument("checkpoint", help="checkpoint file or folder")
+    parser.add_argument("path_training", help="folder with TrainingMSData")
+    parser.add_argument("trackers", nargs="+", help=".mstrackers to replay")
+    parser.add_argument(
+        "--thresholds", type=float, nargs="+", default=[0.01, 0.02, 0.05, 0.1, 0.2]
+    )
+    parser.add_argument("--refresh-interval", type=int, default=30)
+    parser.add_argument(
+        "--avatars", type=int, default=64, help="segments replayed in parallel"
+    )
+    args = parser.parse_args(argv)
+
+    path_training = args.path_training.rstrip("/\\") + "/"
+    predictor = streaming_predictor(
+        args.checkpoint,
+        path_training + "TrainingMSData.mstrackers",
+        path_training + "TrainingMSData.mspose",
+        refresh_interval=args.refresh_interval,
+    )
+    for path in args.trackers:
+        dataset = trackers_info_dataset.trackers_info_dataset(path)
+        trackers = np.asarray(dataset.info) * dataset.std + dataset.mean
+        print("{} ({} frames)".format(path, trackers.shape[0]))
+        for result in replay_skipping(
+            predictor, trackers, args.thresholds, args.avatars
+        ):
+            print(
+                "  threshold {threshold:.3f}: {saved:.1%} evaluations saved, "
+                "angular error mean {mean_error:.3f} p95 {p95_error:.3f} "
+                "max {max_error:.3f} degrees".format(**result)
+            )
+
+
+if __name__ == "__main__":
+    main()
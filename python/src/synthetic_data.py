@@ -0,0 +1,165 @@
+import argparse
+import os
+import struct
+import numpy as np
+import rotations_numpy as rot
+
+# Writes valid .mstrackers/.mspose files (same layout as TrackersDataset.cs and
+# PoseDataset.cs) of any size with smooth synthetic motion, for benchmarks and
+# tests that cannot depend on the real MMData:
+#   - the HMD walks around turning slowly, two controllers swing next to it
+#   - tracker features are expressed w.r.t. the HMD projected on the ground
+#   - joint 0 of the poses is the simulation bone direction w.r.t. the HMD
+#     projected on the ground, the rest are smooth local rotations
+
+
+def smooth_noise(rng, number_poses, shape, frequency=0.5, frame_time=1.0 / 60.0):
+    # Sum of a few random sinusoids per value: [number_poses, *shape]
+    t = np.arange(number_poses)[:, None] * frame_time
+    size = int(np.prod(shape))
+    result = np.zeros((number_poses, size))
+    for _ in range(3):
+        f = rng.uniform(0.2, 2.0, size) * frequency
+        phase = rng.uniform(0.0, 2.0 * np.pi, size)
+        result += np.sin(2.0 * np.pi * f * t + phase) / 3.0
+    return result.reshape((number_poses,) + tuple(shape))
+
+
+def normalize(data, groups):
+    # Mean per dimension, standard deviation averaged over each group of
+    # dimensions (as done by the C# datasets)
+    mean = data.mean(axis=0)
+    std_dimension = data.std(axis=0)
+    std = np.zeros_like(mean)
+    start = 0
+    for size in groups:
+        std[start : start + size] = max(
+            np.mean(std_dimension[start : start + size]), 1e-5
+        )
+        start += size
+    return (data - mean) / std, mean, std
+
+
+def write_header(f, values):
+    f.write(struct.pack("<" + str(len(values)) + "I", *values))
+
+
+def write_mean_std(f, mean, std):
+    f.write(np.stack((mean, std), axis=-1).astype("<f4").tobytes())
+
+
+def generate_hmd(number_poses, rng, frame_time=1.0 / 60.0):
+    # World positions [N, 3] and projected direction (yaw) [N] of the HMD
+    yaw = np.cumsum(smooth_noise(rng, number_poses, (), 0.3) * 1.5 * frame_time)
+    speed = 0.8 + 0.6 * smooth_noise(rng, number_poses, (), 0.1)
+    positions = np.zeros((number_poses, 3))
+    positions[:, 0] = np.cumsum(np.sin(yaw) * speed * frame_time)
+    positions[:, 2] = np.cumsum(np.cos(yaw) * speed * frame_time)
+    positions[:, 1] = 1.65 + 0.02 * smooth_noise(rng, number_poses, (), 2.0)
+    return positions, yaw
+
+
+def write_trackers(path, number_poses, seed=0, frame_time=1.0 / 60.0):
+    rng = np.random.default_rng(seed)
+    number_trackers = 3  # HMD, left and right controllers
+    hmd_positions, yaw = generate_hmd(number_poses, rng, frame_time)
+    projected = rot.quat_from_yaw(yaw)[:, None, :]
+    # World rotations: heading plus smooth swinging
+    swing = smooth_noise(rng, number_poses, (number_trackers, 3), 1.0) * 0.5
+    swing[:, 0, 1] = 0.0  # the HMD heading is the projected direction
+    rotations = rot.mul_quat(projected, rot.quat_from_scaled_angle_axis(swing))
+    # World positions: controllers next to the HMD
+    offsets = np.array([[0.0, 0.0, 0.0], [-0.25, -0.5, 0.25], [0.25, -0.5, 0.25]])
+    local_positions = offsets + 0.15 * smooth_noise(
+        rng, number_poses, (number_trackers, 3), 1.0
+    )
+    local_positions[:, 0] = 0.0
+    positions = hmd_positions[:, None, :] + rot.mul_quat_vec(projected, local_positions)
+    # Velocities (backward differences)
+    velocities = np.zeros_like(positions)
+    velocities[1:] = (positions[1:] - positions[:-1]) / frame_time
+    angular_velocities = np.zeros_like(positions)
+    angular_velocities[1:] = (
+        rot.quat_to_scaled_angle_axis(
+            rot.abs_quat(rot.mul_quat(rotations[1:], rot.inverse_quat(rotations[:-1])))
+        )
+        / frame_time
+    )
+    # Features w.r.t. the HMD projected on the ground
+    inverse_projected = rot.inverse_quat(projected)
+    features = np.concatenate(
+        (
+            rot.quat_to_continuous(rot.mul_quat(inverse_projected, rotations)),
+            rot.mul_quat_vec(inverse_projected, velocities),
+            rot.mul_quat_vec(inverse_projected, angular_velocities),
+        ),
+        axis=-1,
+    ).reshape(number_poses, -1)
+    data, mean, std = normalize(features, [6, 3, 3] * number_trackers)
+    with open(path, "wb") as f:
+        write_header(f, [number_poses, number_trackers, 12, features.shape[1]])
+        write_mean_std(f, mean, std)
+        f.write(data.astype("<f4").tobytes())
+        f.write(positions.astype("<f4").tobytes())
+        # VRSpaceToTracker
+        f.write(np.tile([0.0, 0.0, 0.0, 1.0], number_trackers).astype("<f4").tobytes())
+    return hmd_positions, yaw
+
+
+def write_poses(path, number_poses, number_joints=24, seed=0, frame_time=1.0 / 60.0):
+    rng = np.random.default_rng(seed)
+    # Simulation bone w.r.t. the projected HMD: small yaw offsets
+    simulation_bone = rot.quat_from_yaw(0.3 * smooth_noise(rng, number_poses, (), 0.5))
+    joints = rot.quat_from_scaled_angle_axis(
+        0.4 * smooth_noise(rng, number_poses, (number_joints - 1, 3), 1.0)
+    )
+    rotations = np.concatenate((simulation_bone[:, None, :], joints), axis=1)
+    poses = rot.quat_to_continuous(rotations).reshape(number_poses, -1)
+    hips = np.array([0.0, 0.95, 0.0]) + 0.05 * smooth_noise(
+        rng, number_poses, (3,), 1.0
+    )
+    data, mean, std = normalize(
+        np.concatenate((poses, hips), axis=-1), [6] * number_joints + [3]
+    )
+    offsets = rng.normal(0.0, 0.15, (number_joints, 3))
+    offsets[:2] = 0.0  # root and hips
+    with open(path, "wb") as f:
+        write_header(f, [number_poses, number_joints * 6, 3, number_joints])
+        write_mean_std(f, mean, std)
+        f.write(offsets.astype("<f4").tobytes())
+        f.write(data[:, : number_joints * 6].astype("<f4").tobytes())
+        f.write(data[:, number_joints * 6 :].astype("<f4").tobytes())
+
+
+def write_ms_data(path, name, number_poses, number_joints=24, seed=0):
+    # Writes path/name/name.mstrackers and path/name/name.mspose (the layout
+    # expected by train_direction, e.g., name = "TrainingMSData")
+    folder = os.path.join(path, name)
+    os.makedirs(folder, exist_ok=True)
+    write_trackers(os.path.join(folder, name + ".mstrackers"), number_poses, seed)
+    write_poses(
+        os.path.join(folder, name + ".mspose"), number_poses, number_joints, seed + 1
+    )
+    return os.path.join(folder, "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Write synthetic TrainingMSData/TestMSData databases"
+    )
+    parser.add_argument("output", help="folder for TrainingMSData/ and TestMSData/")
+    parser.add_argument("--training-poses", type=int, default=100000)
+    parser.add_argument("--test-poses", type=int, default=20000)
+    parser.add_argument("--joints", type=int, default=24)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_ms_data(
+        args.output, "TrainingMSData", args.training_poses, args.joints, args.seed
+    )
+    write_ms_data(
+        args.output, "TestMSData", args.test_poses, args.joints, args.seed + 2
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@ import serializer_helper as sh
 
 
 class trackers_info_dataset:
-    def __init__(self, path):
-        self.import_info(path)
+    def __init__(self, path, only_mean_std=False, memmap=False):
+        if only_mean_std:
+            self.import_mean_std(path)
+        elif memmap:
+            self.import_info_memmap(path)
+        else:
+            self.import_info(path)
 
     def import_info(self, path):
         # Open as read binary
@@ -31,3 +36,37 @@ class trackers_info_dataset:
                 for j in range(3):
                     for k in range(3):
                         self.positions[i][j][k] = sh.read_float(f)
+
+    def import_mean_std(self, path):
+        # Open as read binary
+        with open(path, "rb") as f:
+            # Read Header
+            self.number_poses = sh.read_uint(f)
+            self.number_trackers = sh.read_uint(f)
+            self.number_features_tracker = sh.read_uint(f)
+            self.number_features = sh.read_uint(f)
+            # Mean and Standard Deviation
+            self.mean = np.zeros(self.number_features)
+            self.std = np.zeros(self.number_features)
+            for i in range(self.number_features):
+                self.mean[i] = sh.read_float(f)
+                self.std[i] = sh.read_float(f)
+            self.header_size = f.tell()
+
+    def import_info_memmap(self, path):
+        # Info and positions are memory-mapped (float32) instead of read into memory
+        self.import_mean_std(path)
+        self.info = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r",
+            offset=self.header_size,
+            shape=(self.number_poses, self.number_features),
+        )
+        self.positions = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r",
+            offset=self.header_size + self.number_poses * self.number_features * 4,
+            shape=(self.number_poses, 3, 3),
+        )
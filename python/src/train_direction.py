@@ -1,33 +1,96 @@
+import argparse
+import collections
+import json
 import os
+import time
 import losses
 import feedforward
+import checkpoint
+import evaluation_worker
+import prioritized_sampler
 import trackers_info_dataset
 import pose_dataset
+import streaming_dataset
 import torch
 from torch import nn
 import numpy as np
 from torch.utils.data import DataLoader
 from torch.utils.data import Dataset
-from ray import tune
-from ray.tune import CLIReporter
-from ray.tune.schedulers import ASHAScheduler
-
-# Hyperparameters
-use_tune = False
-use_adam = True
-epochs = 10
-filename_input = "data/direction_predictor.onnx"
-loss_type = "mse"  # "mse" or "dot"
-gamma = 0.95  # Decay factor for the learning rate
-# Learning
-config = {
-    "batch_size": tune.choice([64]),
-    "hidden_size": tune.choice([32, 64, 128]),
-    "number_hidden_layers": tune.choice([2]),
-    "learning_rate": tune.loguniform(1e-4, 1e-3),
-    "weight_decay": tune.loguniform(1e-2, 1),
-    # "momentum": tune.uniform(0.0, 0.99),
+
+# Heavy modules (ray, onnx) are only imported by the subcommands that need them
+
+path_data = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "MMVR/Assets/MMData/Data"
+)
+
+# Settings (can be overridden with --config and --set, see main())
+default_settings = {
+    "use_adam": True,
+    "epochs": 10,
+    "filename_output": "data/direction_predictor.onnx",
+    "path_checkpoints": "data/checkpoints/",  # training resumes from the latest one
+    "keep_checkpoints": 3,  # number of most recent checkpoints kept on disk
+    "loss_type": "mse",  # "mse" or "dot"
+    "scheduler": "exponential",  # "exponential" or "plateau" (test loss)
+    "gamma": 0.95,  # Decay factor for the learning rate
+    "plateau_factor": 0.5,  # "plateau": decay factor when the test loss stalls
+    "plateau_patience": 2,  # "plateau": epochs without improvement before decaying
+    # Evaluation of the test set in a separate process while training continues
+    # (results are applied to the scheduler and reported when ready). With the
+    # "plateau" scheduler, checkpoints are written once their epoch's test loss
+    # has been applied (up to evaluation_max_pending epochs later)
+    "async_evaluation": False,
+    "evaluation_device": "cpu",
+    "evaluation_threads": 1,
+    "evaluation_max_pending": 2,  # epochs training can run ahead of evaluation
+    # Training windows: "uniform" or "prioritized" (sampled by their last
+    # training loss with importance weights, see prioritized_sampler.py)
+    "sampler": "uniform",
+    "priority_alpha": 0.6,
+    "priority_beta": 0.4,  # annealed to 1 in the last epoch
+    "priority_epsilon": 0.001,
+    "priority_refresh_batches": 50,
+    # Recursive Learning
+    "number_recursions": 50,
+    # Gradient checkpointing of the rollout: recursions per segment whose
+    # activations are recomputed in backward (0: disabled, keeps all of them)
+    "checkpoint_segment": 0,
+    "path_training": os.path.join(path_data, "TrainingMSData/"),
+    "path_test": os.path.join(path_data, "TestMSData/"),
+    # Out-of-core training: windows are streamed from memory-mapped files
+    "streaming": False,
+    "chunk_size": 65536,  # frames read sequentially at once
+    "shuffle_buffer": 4096,  # windows per worker
+    "num_workers": 0,
+    # Hyperparameter tuning. The experiment is stored in tune_local_dir/tune_name
+    # and resumed if it exists (use another name to start a new one)
+    "tune_name": "direction_predictor",
+    "tune_local_dir": "data/ray_results/",
+    "tune_num_samples": 10,
+    "tune_cpu": 2,
+    "tune_gpu": 0.2,  # if gpu < 1: Share GPU among trials (make sure there is enough memory)
 }
+# Settings that must match to resume from a checkpoint (with the config):
+# they change the model, the optimizer/scheduler/sampler states or the windows
+resume_settings = [
+    "use_adam",
+    "loss_type",
+    "scheduler",
+    "gamma",
+    "plateau_factor",
+    "plateau_patience",
+    "sampler",
+    "priority_alpha",
+    "priority_beta",
+    "priority_epsilon",
+    "priority_refresh_batches",
+    "number_recursions",
+    "checkpoint_segment",
+    "streaming",
+    "chunk_size",
+    "shuffle_buffer",
+]
+# Learning
 default_config = {
     "batch_size": 64,
     "hidden_size": 32,
@@ -36,19 +99,24 @@ default_config = {
     "weight_decay": 0.035,
     "momentum": 0.9,
 }
-# Recursive Learning
-number_recursions = 50
-assert number_recursions >= 1
 
-path_training = "PATH_TO_YOUR_PROJECT/MMVR/Assets/MMData/Data/TrainingMSData/"
-path_test = (
-    "PATH_TO_YOUR_PROJECT/MMVR/Assets/MMData/Data/TestMSData/"
-)
+
+def tune_search_space():
+    from ray import tune
+
+    return {
+        "batch_size": tune.choice([64]),
+        "hidden_size": tune.choice([32, 64, 128]),
+        "number_hidden_layers": tune.choice([2]),
+        "learning_rate": tune.loguniform(1e-4, 1e-3),
+        "weight_decay": tune.loguniform(1e-2, 1),
+        # "momentum": tune.uniform(0.0, 0.99),
+    }
 
 
 # Dataloader
 class dataset_input(Dataset):
-    def __init__(self, trackers_info):
+    def __init__(self, trackers_info, number_recursions):
         input = np.arange(
             1, trackers_info.shape[0] - number_recursions, 1, dtype=np.longlong
         )
@@ -61,84 +129,196 @@ class dataset_input(Dataset):
         return self.input[idx]
 
 
-# Training
+# Data
+class direction_data:
+    # Decoded once and shared by training, tuning (through the Ray object store)
+    # and evaluation. When streaming, only the headers are read.
+    def __init__(self, path_training, path_test, load_training=True, streaming=False):
+        start = time.perf_counter()
+        self.path_training = path_training
+        self.path_test = path_test
+        self.streaming = streaming
+        self.training_trackers = None
+        self.training_poses = None
+        self.test_trackers = None
+        self.test_poses = None
+        if load_training and not streaming:
+            trackers_input = trackers_info_dataset.trackers_info_dataset(
+                path_training + "TrainingMSData.mstrackers"
+            )
+            self.training_trackers = trackers_input.info
+            pose_dataset_input = pose_dataset.pose_dataset(
+                path_training + "TrainingMSData.mspose"
+            )
+            self.training_poses = pose_dataset_input.poses
+        else:
+            pose_dataset_input = pose_dataset.pose_dataset(
+                path_training + "TrainingMSData.mspose", only_mean_std=True
+            )
+        # Mean and Std are always the ones from the training set
+        self.poses_mean = pose_dataset_input.mean
+        self.poses_std = pose_dataset_input.std
+
+        trackers_test_input = trackers_info_dataset.trackers_info_dataset(
+            path_test + "TestMSData.mstrackers", only_mean_std=streaming
+        )
+        if not streaming:
+            self.test_trackers = trackers_test_input.info
+            pose_test_dataset_input = pose_dataset.pose_dataset(
+                path_test + "TestMSData.mspose"
+            )
+            self.test_poses = pose_test_dataset_input.poses
 
-# Hyperparameter tuning
-if use_tune:
-    scheduler_tuning = ASHAScheduler(
-        metric="loss", mode="min", max_t=epochs, grace_period=5, reduction_factor=2
-    )
-    reporter = CLIReporter(metric_columns=["loss", "training_iteration"])
+        self.input_pose_size = trackers_test_input.number_features + 6
+        self.output_pose_size = 6
+        print("Data loaded in {:.2f}s".format(time.perf_counter() - start))
 
 
-def train_direction(config):
-    # Device
+def get_device():
     device = "cpu"
     if torch.cuda.is_available():
         device = "cuda:0"
+    return device
 
-    # Import Data
-    trackers_input = trackers_info_dataset.trackers_info_dataset(
-        path_training + "TrainingMSData.mstrackers"
-    )
-    trackers = trackers_input.info
-    pose_dataset_input = pose_dataset.pose_dataset(
-        path_training + "TrainingMSData.mspose"
-    )
-    poses = pose_dataset_input.poses
-    poses_mean = pose_dataset_input.mean
-    poses_std = pose_dataset_input.std
 
-    trackers_test_input = trackers_info_dataset.trackers_info_dataset(
-        path_test + "TestMSData.mstrackers"
+def load_data(settings, load_training=True):
+    return direction_data(
+        settings["path_training"],
+        settings["path_test"],
+        load_training=load_training,
+        streaming=settings["streaming"],
     )
-    trackers_test = trackers_test_input.info
-    pose_test_dataset_input = pose_dataset.pose_dataset(path_test + "TestMSData.mspose")
-    poses_test = pose_test_dataset_input.poses
 
-    training_trackers = trackers
-    training_poses = poses
-    test_trackers = trackers_test
-    test_poses = poses_test
 
-    training_dataset = dataset_input(training_trackers)
+def create_test_dataloader(config, settings, data):
+    if data.streaming:
+        test_dataset = streaming_dataset.streaming_dataset(
+            data.path_test + "TestMSData.mstrackers",
+            data.path_test + "TestMSData.mspose",
+            settings["number_recursions"],
+            config["batch_size"],
+            chunk_size=settings["chunk_size"],
+            shuffle=False,
+        )
+        return DataLoader(
+            test_dataset, batch_size=None, num_workers=settings["num_workers"]
+        )
     test_dataset = dataset_input(
-        test_trackers
+        data.test_trackers, settings["number_recursions"]
     )  # training_trackers_locomotion is the same because the input will be zeroed differently
+    return DataLoader(test_dataset, batch_size=config["batch_size"], shuffle=True)
 
-    input_pose_size = training_trackers.shape[1] + 6
-    output_pose_size = 6
 
-    # Data
-    train_dataloader = DataLoader(
-        training_dataset, batch_size=config["batch_size"], shuffle=True
-    )
-    test_dataloader = DataLoader(
-        test_dataset, batch_size=config["batch_size"], shuffle=True
-    )
+def get_loss_fn(settings, data, device, reduction="mean"):
+    # reduction: "mean" (of the batch) or "none" (one loss per sample)
+    if settings["loss_type"] == "mse":
+        loss_fn = nn.MSELoss() if reduction == "mean" else losses.mse_loss()
+    elif settings["loss_type"] == "dot":
+        loss_fn = losses.dot_loss(
+            data.poses_mean[:6], data.poses_std[:6], device, reduction
+        )
+    return loss_fn
 
-    # Model
-    direction_model = feedforward.FeedForward(
-        training_trackers,
-        training_poses,
-        test_trackers,
-        test_poses,
-        input_pose_size,
+
+def create_model(config, settings, data, device):
+    return feedforward.FeedForward(
+        data.training_trackers,
+        data.training_poses,
+        data.test_trackers,
+        data.test_poses,
+        data.input_pose_size,
         config["hidden_size"],
         config["number_hidden_layers"],
-        output_pose_size,
-        number_recursions,
+        data.output_pose_size,
+        settings["number_recursions"],
         device,
+        settings["checkpoint_segment"],
     ).to(device)
 
+
+def create_scheduler(optimizer, settings):
+    if settings["scheduler"] == "plateau":
+        return torch.optim.lr_scheduler.ReduceLROnPlateau(
+            optimizer,
+            factor=settings["plateau_factor"],
+            patience=settings["plateau_patience"],
+        )
+    return torch.optim.lr_scheduler.ExponentialLR(optimizer, gamma=settings["gamma"])
+
+
+# Training
+def train_direction(
+    config, settings=None, data=None, use_tune=False, on_test_loss=None
+):
+    # on_test_loss(epoch, loss) is called with every test loss (e.g. benchmarks)
+    if settings is None:
+        settings = default_settings
+    if data is None:
+        data = load_data(settings)
+    if use_tune:
+        from ray import tune
+
+    # Device
+    device = get_device()
+
+    # Data
+    # Seeded like the global RNG (random per process unless torch.manual_seed is
+    # called), its state is saved in checkpoints to resume shuffling
+    sampler_generator = torch.Generator().manual_seed(torch.initial_seed())
+    sampler = None
+    if data.streaming:
+        assert (
+            settings["sampler"] == "uniform"
+        ), "The prioritized sampler needs the in-memory datasets (streaming=false)"
+        training_dataset = streaming_dataset.streaming_dataset(
+            data.path_training + "TrainingMSData.mstrackers",
+            data.path_training + "TrainingMSData.mspose",
+            settings["number_recursions"],
+            config["batch_size"],
+            chunk_size=settings["chunk_size"],
+            shuffle_buffer=settings["shuffle_buffer"],
+        )
+        train_dataloader = DataLoader(
+            training_dataset, batch_size=None, num_workers=settings["num_workers"]
+        )
+    elif settings["sampler"] == "prioritized":
+        training_dataset = dataset_input(
+            data.training_trackers, settings["number_recursions"]
+        )
+        sampler = prioritized_sampler.prioritized_sampler(
+            len(training_dataset),
+            config["batch_size"],
+            settings["priority_alpha"],
+            settings["priority_beta"],
+            settings["priority_epsilon"],
+            settings["priority_refresh_batches"],
+            sampler_generator,
+        )
+        train_dataloader = DataLoader(training_dataset, batch_sampler=sampler)
+    else:
+        training_dataset = dataset_input(
+            data.training_trackers, settings["number_recursions"]
+        )
+        train_dataloader = DataLoader(
+            training_dataset,
+            batch_size=config["batch_size"],
+            shuffle=True,
+            generator=sampler_generator,
+        )
+    if not settings["async_evaluation"]:
+        test_dataloader = create_test_dataloader(config, settings, data)
+
+    # Model
+    direction_model = create_model(config, settings, data, device)
+
     # Loss
-    if loss_type == "mse":
-        loss_fn = nn.MSELoss()
-    elif loss_type == "dot":
-        loss_fn = losses.dot_loss(poses_mean[:6], poses_std[:6], device)
+    loss_fn = get_loss_fn(settings, data, device)
+    train_loss_fn = (
+        loss_fn if sampler is None else get_loss_fn(settings, data, device, "none")
+    )
 
     # Optimizer
-    if use_adam:
+    if settings["use_adam"]:
         optimizer = torch.optim.AdamW(
             direction_model.parameters(),
             lr=config["learning_rate"],
@@ -152,126 +332,309 @@ def train_direction(config):
             weight_decay=config["weight_decay"],
         )
 
+    scheduler = create_scheduler(optimizer, settings)
+    plateau = isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau)
+
     # Checkpoint
-    # if checkpoint_dir:
-    #     model_state, optimizer_state = torch.load(
-    #         os.path.join(checkpoint_dir, "checkpoint")
-    #     )
-    #     direction_model.load_state_dict(model_state)
-    #     optimizer.load_state_dict(optimizer_state)
+    if use_tune:
+        checkpoint_dir = os.path.join(tune.get_trial_dir(), "checkpoints")
+    else:
+        checkpoint_dir = settings["path_checkpoints"]
+    start_epoch = 0
+    training_settings = {key: settings[key] for key in resume_settings}
+    state = checkpoint.load_latest(checkpoint_dir, device)
+    if state is not None and (
+        state["config"] != config or state.get("settings") != training_settings
+    ):
+        print(
+            "Ignoring checkpoints in {} (different config or settings)".format(
+                checkpoint_dir
+            )
+        )
+        state = None
+    if state is not None:
+        start_epoch = checkpoint.restore(
+            state, direction_model, optimizer, scheduler, sampler_generator, sampler
+        )
+        print("Resuming from epoch {}".format(start_epoch))
+    writer = checkpoint.checkpoint_writer(checkpoint_dir, settings["keep_checkpoints"])
+
+    def take_snapshot(epoch):
+        return checkpoint.snapshot(
+            epoch,
+            config,
+            direction_model,
+            optimizer,
+            scheduler,
+            sampler_generator,
+            sampler,
+            training_settings,
+        )
 
-    scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer, gamma=gamma)
+    # With async evaluation and "plateau", the snapshot of an epoch is written
+    # once its test loss has been applied to the scheduler, so a resumed run
+    # sees the same test losses as an uninterrupted one
+    deferred = settings["async_evaluation"] and plateau
+    waiting = collections.deque()
+
+    def test_results(results):
+        # Applied in epoch order when they are ready
+        for epoch, avg_test_loss, seconds in results:
+            print(
+                "Epoch {} test loss: {:>8f} ({:.2f}s)".format(
+                    epoch, avg_test_loss, seconds
+                )
+            )
+            if on_test_loss is not None:
+                on_test_loss(epoch, avg_test_loss)
+            if plateau:
+                scheduler.step(avg_test_loss)
+            if len(waiting) > 0 and waiting[0]["epoch"] == epoch:
+                state = waiting.popleft()
+                checkpoint.update_scheduler(state, optimizer, scheduler)
+                writer.save(state)
+            if use_tune:
+                # ASHA uses the epoch, trials resumed from a checkpoint restart
+                # their training_iteration
+                tune.report(loss=avg_test_loss, epoch=epoch + 1)
+
+    if settings["async_evaluation"]:
+        worker = evaluation_worker.evaluation_worker(
+            config,
+            settings,
+            data,
+            settings["evaluation_device"],
+            settings["evaluation_threads"],
+            settings["evaluation_max_pending"],
+        )
 
     # Training
-    for epoch in range(epochs):
-        print("Epoch: {}".format(epoch) + " ----------------------------")
-        direction_model.train()
-        avg_train_loss = direction_model.train_loop(
-            train_dataloader, loss_fn, optimizer
-        )
-        direction_model.eval()
-        avg_test_loss = direction_model.test_loop(test_dataloader, loss_fn)
-        if scheduler != None:
-            scheduler.step()
-        if use_tune:
-            with tune.checkpoint_dir(epoch) as checkpoint_dir:
-                path = os.path.join(checkpoint_dir, "checkpoint")
-                torch.save((direction_model.state_dict(), optimizer.state_dict()), path)
-            tune.report(loss=avg_test_loss)
+    try:
+        for epoch in range(start_epoch, settings["epochs"]):
+            print("Epoch: {}".format(epoch) + " ----------------------------")
+            if data.streaming:
+                training_dataset.set_epoch(epoch)
+            if sampler is not None:
+                sampler.set_epoch(epoch, settings["epochs"])
+            direction_model.train()
+            avg_train_loss = direction_model.train_loop(
+                train_dataloader, train_loss_fn, optimizer, sampler
+            )
+            if settings["async_evaluation"]:
+                if deferred:
+                    waiting.append(take_snapshot(epoch))
+                test_results(worker.submit(epoch, direction_model))
+                test_results(worker.poll())
+            else:
+                direction_model.eval()
+                start = time.perf_counter()
+                avg_test_loss = direction_model.test_loop(test_dataloader, loss_fn)
+                test_results([(epoch, avg_test_loss, time.perf_counter() - start)])
+            if not plateau:
+                scheduler.step()
+            if not deferred:
+                # Written in the background from a snapshot
+                writer.save(take_snapshot(epoch))
+        if settings["async_evaluation"]:
+            test_results(worker.close())
+    finally:
+        if settings["async_evaluation"]:
+            worker.terminate()
+        # Waits for the queued snapshots (also when training fails)
+        writer.close()
 
     print("Finished Training")
     return direction_model
 
 
-# Device
-device = "cpu"
-if torch.cuda.is_available():
-    device = "cuda:0"
+def test_model(direction_model, config, settings, data, device):
+    test_dataloader = create_test_dataloader(config, settings, data)
+    loss_fn = get_loss_fn(settings, data, device)
+    direction_model.eval()
+    return direction_model.test_loop(test_dataloader, loss_fn)
 
-# Import Data
-trackers_input = trackers_info_dataset.trackers_info_dataset(
-    path_training + "TrainingMSData.mstrackers"
-)
-trackers = trackers_input.info
-pose_dataset_input = pose_dataset.pose_dataset(path_training + "TrainingMSData.mspose")
-poses = pose_dataset_input.poses
-poses_mean = pose_dataset_input.mean
-poses_std = pose_dataset_input.std
-
-trackers_test_input = trackers_info_dataset.trackers_info_dataset(
-    path_test + "TestMSData.mstrackers"
-)
-trackers_test = trackers_test_input.info
-pose_test_dataset_input = pose_dataset.pose_dataset(path_test + "TestMSData.mspose")
-poses_test = pose_test_dataset_input.poses
 
-training_trackers = trackers
-training_poses = poses
-test_trackers = trackers_test
-test_poses = poses_test
+def load_checkpoint(path, device):
+    # 'path' is a checkpoint file or a directory (its latest checkpoint is used)
+    if os.path.isdir(path):
+        state = checkpoint.load_latest(path, device)
+    else:
+        state = torch.load(path, map_location=device)
+    if state is None:
+        raise FileNotFoundError("No checkpoint found in " + path)
+    return state
+
+
+# Subcommands
+def command_train(settings, config, args):
+    data = load_data(settings)
+    direction_model = train_direction(config, settings, data)
+    direction_model.save(
+        data.input_pose_size, get_device(), settings["filename_output"]
+    )
 
-training_dataset = dataset_input(training_trackers)
-test_dataset = dataset_input(
-    test_trackers
-)  # training_trackers_locomotion is the same because the input will be zeroed differently
 
-input_pose_size = training_trackers.shape[1] + 6
-output_pose_size = 6
+def command_tune(settings, config, args):
+    from ray import tune
+    from ray.tune import CLIReporter
+    from ray.tune.schedulers import ASHAScheduler
+
+    device = get_device()
+    data = load_data(settings)
+
+    scheduler_tuning = ASHAScheduler(
+        metric="loss",
+        mode="min",
+        time_attr="epoch",
+        max_t=settings["epochs"],
+        grace_period=5,
+        reduction_factor=2,
+    )
+    reporter = CLIReporter(metric_columns=["loss", "epoch"])
 
-if use_tune:
     result = tune.run(
-        # partial(
-        #     train_direction,
-        #     checkpoint_dir=checkpoint_dir,
-        # ),
-        train_direction,
+        # Data is put once in the object store instead of being decoded per trial
+        tune.with_parameters(
+            train_direction, settings=settings, data=data, use_tune=True
+        ),
         resources_per_trial={
-            "cpu": 2,
-            "gpu": 0.2,
-        },  # if gpu < 1: Share GPU among trials (make sure there is enough memory)
-        config=config,
-        num_samples=10,
+            "cpu": settings["tune_cpu"],
+            "gpu": settings["tune_gpu"],
+        },
+        config=tune_search_space(),
+        num_samples=settings["tune_num_samples"],
         scheduler=scheduler_tuning,
         progress_reporter=reporter,
+        # After a crash, unfinished trials are restarted in their own folders
+        # and resume from their latest checkpoint
+        name=settings["tune_name"],
+        local_dir=os.path.abspath(settings["tune_local_dir"]),
+        resume="AUTO",
     )
 
     best_trial = result.get_best_trial("loss", "min", "last")
     print("Best trial config: {}".format(best_trial.config))
     print("Best trial final validation loss: {}".format(best_trial.last_result["loss"]))
 
-    best_direction_model = feedforward.FeedForward(
-        training_trackers,
-        training_poses,
-        test_trackers,
-        test_poses,
+    best_direction_model = create_model(best_trial.config, settings, data, device)
+    best_checkpoint = checkpoint.load_latest(
+        os.path.join(best_trial.logdir, "checkpoints"), device
+    )
+    best_direction_model.load_state_dict(best_checkpoint["model"])
+
+    test_error = test_model(
+        best_direction_model, best_trial.config, settings, data, device
+    )
+    print("Best trial test set loss: {}".format(test_error))
+
+    best_direction_model.save(data.input_pose_size, device, settings["filename_output"])
+
+
+def command_export(settings, config, args):
+    # Only the headers are read, the datasets are not needed to export
+    device = get_device()
+    state = load_checkpoint(args.checkpoint or settings["path_checkpoints"], device)
+    trackers_header = trackers_info_dataset.trackers_info_dataset(
+        settings["path_test"] + "TestMSData.mstrackers", only_mean_std=True
+    )
+    input_pose_size = trackers_header.number_features + 6
+    direction_model = feedforward.FeedForward(
+        None,
+        None,
+        None,
+        None,
         input_pose_size,
-        best_trial.config["hidden_size"],
-        best_trial.config["number_hidden_layers"],
-        output_pose_size,
-        number_recursions,
+        state["config"]["hidden_size"],
+        state["config"]["number_hidden_layers"],
+        6,
+        settings["number_recursions"],
         device,
     ).to(device)
+    direction_model.load_state_dict(state["model"])
+    direction_model.eval()
+    direction_model.save(input_pose_size, device, settings["filename_output"])
+    print("Exported to " + settings["filename_output"])
+
+
+def command_eval(settings, config, args):
+    device = get_device()
+    state = load_checkpoint(args.checkpoint or settings["path_checkpoints"], device)
+    data = load_data(settings, load_training=False)
+    direction_model = create_model(state["config"], settings, data, device)
+    direction_model.load_state_dict(state["model"])
+    test_model(direction_model, state["config"], settings, data, device)
+
+
+commands = {
+    "train": command_train,
+    "tune": command_tune,
+    "export": command_export,
+    "eval": command_eval,
+}
 
-    best_checkpoint_dir = best_trial.checkpoint.value
-    model_state, optimizer_state = torch.load(
-        os.path.join(best_checkpoint_dir, "checkpoint")
-    )
-    best_direction_model.load_state_dict(model_state)
 
-    def test_best_model(direction_model, trial):
-        test_dataloader = DataLoader(
-            test_dataset, batch_size=trial.config["batch_size"], shuffle=True
-        )
-        if loss_type == "mse":
-            loss_fn = nn.MSELoss()
-        elif loss_type == "dot":
-            loss_fn = losses.dot_loss(poses_mean[:6], poses_std[:6], device)
-        test_losses = direction_model.test_loop(test_dataloader, loss_fn)
-        return test_losses
-
-    test_error = test_best_model(best_direction_model, best_trial)
-    print("Best trial test set loss: {}".format(test_error))
-else:
-    best_direction_model = train_direction(default_config)
+def parse_value(value):
+    # --set values are parsed as JSON when possible (numbers, booleans...)
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
 
-best_direction_model.save(input_pose_size, device, filename_input)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Direction predictor training")
+    parser.add_argument("command", choices=commands.keys())
+    parser.add_argument(
+        "--config",
+        help="JSON file overriding settings and hyperparameters (default_config)",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="override a setting or hyperparameter, e.g. --set epochs=20",
+    )
+    parser.add_argument("--path-training", help="folder with TrainingMSData")
+    parser.add_argument("--path-test", help="folder with TestMSData")
+    parser.add_argument("--epochs", type=int)
+    parser.add_argument("--output", help="output .onnx file")
+    parser.add_argument(
+        "--checkpoint", help="checkpoint file or folder for export and eval"
+    )
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.config is not None:
+        with open(args.config, "r") as f:
+            overrides.update(json.load(f))
+    for item in args.set:
+        key, _, value = item.partition("=")
+        overrides[key] = parse_value(value)
+    if args.path_training is not None:
+        overrides["path_training"] = os.path.join(args.path_training, "")
+    if args.path_test is not None:
+        overrides["path_test"] = os.path.join(args.path_test, "")
+    if args.epochs is not None:
+        overrides["epochs"] = args.epochs
+    if args.output is not None:
+        overrides["filename_output"] = args.output
+
+    # Copies, the module defaults stay untouched (e.g. main() called twice)
+    settings = dict(default_settings)
+    config = dict(default_config)
+    for key, value in overrides.items():
+        if key in settings:
+            settings[key] = value
+        elif key in config:
+            config[key] = value
+        else:
+            parser.error("unknown setting: " + key)
+    if settings["number_recursions"] < 1:
+        parser.error("number_recursions must be at least 1")
+
+    commands[args.command](settings, config, args)
+
+
+if __name__ == "__main__":
+    main()